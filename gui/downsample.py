@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    Decimate plotted series down to about the number of pixels they're drawn across
+"""
+
+import numpy as np
+
+
+def minmax_indices(x: np.ndarray, y: np.ndarray, n_buckets: int) -> np.ndarray:
+    """Indices of the min and max y in each of n_buckets equal slices of the x range
+
+    Drawing just these points looks the same as drawing all of them, as long as each slice is
+    no wider than a pixel: every peak and trough is kept. NaN y values are dropped.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        In increasing order
+    y : np.ndarray
+        Same length as x
+    n_buckets : int
+        Number of slices, so at most 2 * n_buckets indices are returned
+
+    Returns
+    -------
+    np.ndarray
+        Indices into x and y, in increasing order
+    """
+    keep = np.flatnonzero(~np.isnan(y))
+    if len(keep) <= 2 * n_buckets:
+        return keep
+    x, y = x[keep], y[keep]
+
+    edges = np.linspace(x[0], x[-1], n_buckets + 1)[:-1]
+    starts = np.unique(np.searchsorted(x, edges))  # Empty slices share a start
+    bucket = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(x)]))
+
+    def first_in_bucket(matches):
+        candidates = np.flatnonzero(matches)
+        _, first = np.unique(bucket[candidates], return_index=True)
+        return candidates[first]
+
+    min_idx = first_in_bucket(y == np.minimum.reduceat(y, starts)[bucket])
+    max_idx = first_in_bucket(y == np.maximum.reduceat(y, starts)[bucket])
+    return keep[np.union1d(min_idx, max_idx)]
+
+
+def decimate(x: np.ndarray, y: np.ndarray, max_points: int):
+    """x and y cut down to at most max_points points (the min and max of each of max_points // 2
+    slices of the x range), or all of them if there are only that many
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        (x, y)
+    """
+    idx = minmax_indices(x, y, max(max_points // 2, 1))
+    return x[idx], y[idx]
@@ -7,11 +7,12 @@
 
 # Standard imports
 import datetime
+import time
 from dateutil import relativedelta
 
 # 3rd party imports
 import tkinter as tk
-import pandas as pd
+import numpy as np
 from loguru import logger
 
 # Plotting imports
@@ -20,6 +21,7 @@ from matplotlib.figure import (
     Figure,
 )
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.collections import PolyCollection
 from matplotlib.ticker import FormatStrFormatter, FuncFormatter
 import matplotlib.dates as mdates
 
@@ -32,6 +34,37 @@ from helpers import (
     get_start_of_year,
 )
 from windows import Subwindow, ErrorPromptPage, fontTuple, activity_kick
+from telemetry_cache import get_telemetry
+from downsample import decimate
+
+# Which rollup (if any) each mode plots as min/max envelopes, rather than every raw record
+ROLLUP_BY_MODE = {"month": "hour", "year": "day"}
+
+
+def to_epoch_ms(t: datetime.datetime) -> int:
+    """Epoch milliseconds of a naive local datetime"""
+    return int(t.timestamp() * 1000)
+
+
+def from_epoch_ms(t_ms: int) -> datetime.datetime:
+    """Naive local datetime of epoch milliseconds"""
+    return datetime.datetime.fromtimestamp(t_ms / 1000)
+
+
+def local_offset_ms(t_ms: int) -> int:
+    """The local timezone's UTC offset at epoch milliseconds t_ms"""
+    t = datetime.datetime.fromtimestamp(t_ms / 1000, datetime.timezone.utc).astimezone()
+    return int(t.utcoffset().total_seconds() * 1000)
+
+
+def to_local_datenums(timestamps_ms: np.ndarray) -> np.ndarray:
+    """Matplotlib date numbers of naive local time, from an array of epoch milliseconds.
+    The offset is looked up once per hour rather than per timestamp (DST changes on the hour).
+    """
+    hours, inverse = np.unique(timestamps_ms // 3600000, return_inverse=True)
+    offsets_ms = np.array([local_offset_ms(h * 3600000) for h in hours], dtype=np.int64)
+    local_ms = timestamps_ms + offsets_ms[inverse]
+    return mdates.date2num(local_ms.astype("datetime64[ms]"))
 
 
 class GraphPage(Subwindow):
@@ -39,16 +72,19 @@ class GraphPage(Subwindow):
         super().__init__(field, draw_exit_button=False, draw_lock_button=False)
 
         self.jData = jData
-        # Read in the dataframe and parse timestamp strings to datetime
-        self.df = pd.read_csv(jData["telemetry_file"], parse_dates=["Timestamp"])
-
-        # Set the index to timestamp column so we can index by it
-        self.df["Timestamp"] = self.df["Timestamp"].dt.round(
-            "60min"
-        )  # Rounding to the nearest hour makes x-axis auto labelling cleaner
-        self.df.set_index("Timestamp", inplace=True)
+        # The store is memory-mapped and shared by every graph, so only the records in the range
+        # being plotted get read, and only once
+        try:
+            self.telemetry = get_telemetry(jData["telemetry_store"])
+            self.store = self.telemetry.store
+            self.rollups = self.telemetry.rollups
+        except (OSError, ValueError) as e:
+            logger.error(f"Unable to open telemetry store: {e}")
+            ErrorPromptPage("Unable to open the telemetry store.\nHas any telemetry been recorded yet?")
+            self.telemetry = self.store = None
+            self.rollups = {}
         logger.info(
-            f"Dataset ranges from {self.df.index.min()} to {self.df.index.max()}"
+            f"Dataset ranges from {self.data_start()} to {self.data_end()}"
         )
 
         # Pull the safe hi/lo bounds to plot horz lines from config file
@@ -58,10 +94,12 @@ class GraphPage(Subwindow):
             logger.error(f'Bad Graph Type "{field}"')
             self.exit()
 
+        plt.rcParams.update({"font.size": 24})
         self.fig = Figure(figsize=(10, 4), dpi=100)
         self.ax = self.fig.add_subplot()
 
         self.field = field
+        self.setup_axes()
 
         top = tk.Frame(self.master)
         bottom = tk.Frame(self.master)
@@ -73,7 +111,7 @@ class GraphPage(Subwindow):
 
         # By default, show the last week of data
         self.max_time_to_plot = (
-            self.df.index.max()
+            self.data_end()
         )  # Rather than use actual "now" timestamp, use the last piece of data in log
 
         self.ONE_WEEK = datetime.timedelta(days=7)
@@ -189,8 +227,52 @@ class GraphPage(Subwindow):
         else:
             logger.error(f'Unknown date mode "{self.mode}"')
 
+    def setup_axes(self):
+        """Create the plot's artists. Navigating only changes their data and the axis limits."""
+        self.ax.xaxis_date()
+        (self.line,) = self.ax.plot([], [])
+        # Min/max envelope, for the modes plotted from rollups
+        self.envelope = PolyCollection([], alpha=0.3, lw=0, facecolors=self.line.get_color())
+        self.ax.add_collection(self.envelope)
+
+        if self.settings["yaxis_warnings"] is not None:
+            # If there are warning lines, draw them (across the whole x-axis, whatever its limits)
+            for y in self.settings["yaxis_warnings"]:
+                self.ax.axhline(y=y, color="red", linestyle="--", lw=1)
+
+        self.ax.yaxis.set_major_formatter(
+            FormatStrFormatter(self.settings["formatter"])
+        )
+        self.ax.set_xlabel("")
+        self.ax.grid(which="both")
+        self.fig.subplots_adjust(bottom=0.18, left=0.14)
+
+        month_fmt = mdates.DateFormatter("%b")
+
+        def m_fmt(x, pos=None):
+            return month_fmt(x)[0]
+
+        day_fmt = mdates.DateFormatter("%d")
+
+        def d_fmt(x, pos=None):
+            return day_fmt(x)
+
+        day_locator = mdates.DayLocator()
+        # x-axis tick locator and formatter for each mode
+        self.axis_formats = {
+            "week": (day_locator, mdates.ConciseDateFormatter(day_locator)),
+            "month": (
+                mdates.WeekdayLocator(byweekday=mdates.SU),  # Tick on Sundays every week
+                FuncFormatter(d_fmt),
+            ),
+            "year": (mdates.MonthLocator(), FuncFormatter(m_fmt)),
+        }
+
     def set_mode(self, m: str):
         self.mode = m
+        locator, formatter = self.axis_formats[m]
+        self.ax.xaxis.set_major_locator(locator)
+        self.ax.xaxis.set_major_formatter(formatter)
         self.next_btn.configure(text=f"Forward 1\n{m.capitalize()}")
         self.prev_btn.configure(text=f"Back 1\n{m.capitalize()}")
 
@@ -201,7 +283,7 @@ class GraphPage(Subwindow):
         tentative_new_max = self.max_time_to_plot - self.ONE_WEEK
         tentative_new_min = tentative_new_max - self.ONE_WEEK
 
-        if tentative_new_max <= self.df.index.min():
+        if tentative_new_max <= self.data_start():
             logger.info(
                 "Cannot go back further -- RHS of plot would be before any data"
             )
@@ -217,7 +299,7 @@ class GraphPage(Subwindow):
         tentative_new_min = tentative_new_max - self.ONE_WEEK
 
         now = (
-            self.df.index.max()
+            self.data_end()
         )  # Rather than use actual "now" timestamp, use the last piece of data in log
         if tentative_new_min >= now:
             logger.info(
@@ -238,7 +320,7 @@ class GraphPage(Subwindow):
             self.max_time_to_plot - self.ONE_MONTH
         )  # New left hand side of x-axis
 
-        if tentative_new_max <= self.df.index.min():
+        if tentative_new_max <= self.data_start():
             logger.info(
                 "Cannot go back further -- RHS of plot would be before any data"
             )
@@ -258,7 +340,7 @@ class GraphPage(Subwindow):
         )  # New left hand side of x-axis
 
         now = (
-            self.df.index.max()
+            self.data_end()
         )  # Rather than use actual "now" timestamp, use the last piece of data in lpg
         if tentative_new_min >= now:
             logger.info(
@@ -279,7 +361,7 @@ class GraphPage(Subwindow):
             self.max_time_to_plot - self.ONE_YEAR
         )  # New left hand side of x-axis
 
-        if tentative_new_max <= self.df.index.min():
+        if tentative_new_max <= self.data_start():
             logger.info(
                 "Cannot go back further -- RHS of plot would be before any data"
             )
@@ -299,7 +381,7 @@ class GraphPage(Subwindow):
         )  # New left hand side of x-axis
 
         now = (
-            self.df.index.max()
+            self.data_end()
         )  # Rather than use actual "now" timestamp, use the last piece of data in lpg
         if tentative_new_min >= now:
             logger.info(
@@ -312,7 +394,7 @@ class GraphPage(Subwindow):
     @activity_kick
     def show_this_week(self):
         """Show the most recent 7 day's worth of data."""
-        now = self.df.index.max()
+        now = self.data_end()
         self.max_time_to_plot = now
 
         self.set_mode("week")
@@ -325,7 +407,7 @@ class GraphPage(Subwindow):
     @activity_kick
     def show_this_month(self):
         """Show this month"""
-        now = self.df.index.max()
+        now = self.data_end()
         self.max_time_to_plot = now
 
         self.set_mode("month")
@@ -338,7 +420,7 @@ class GraphPage(Subwindow):
     @activity_kick
     def show_this_year(self):
         """Show the past year"""
-        now = self.df.index.max()
+        now = self.data_end()
         self.max_time_to_plot = now
 
         self.set_mode("year")
@@ -351,7 +433,7 @@ class GraphPage(Subwindow):
     def plot_data(
         self, start_time: datetime.datetime, end_time: datetime.datetime, title=None
     ):
-        """Actually plot the data in `self.df` between `start_time` and `end_time`
+        """Actually plot the telemetry between `start_time` and `end_time`
 
         Parameters
         ----------
@@ -360,55 +442,36 @@ class GraphPage(Subwindow):
         end_time : datetime.datetime
             The end of the data range
         """
-        plt.rcParams.update({"font.size": 24})
-
-        self.ax.cla()
+        draw_start = time.perf_counter()
         logger.info(f"Plotting between {start_time} and {end_time}")
-        try:
-            sub_df = self.df[start_time:end_time]
-            # sub_df.plot(y=[self.field], ax=self.ax)
-            self.ax.plot(sub_df.index, sub_df[self.field])
-        except KeyError:
-            logger.error("Could not grab dates of interest from telemetry file")
-            ErrorPromptPage(
-                "Oops! Looks like the telemetry file got corrupted.\nRepair of file attemped...\nPlease retry."
-            )
-            self.repair_telemetry_file()
-            self.exit()
-            return
-
-        if self.settings["yaxis_warnings"] is not None:
-            # If there are warning lines, draw them
-            self.ax.hlines(
-                y=self.settings["yaxis_warnings"],
-                xmin=[start_time],
-                xmax=[end_time],
-                colors="red",
-                linestyles="--",
-                lw=1,
+        rollup = self.rollups.get(ROLLUP_BY_MODE.get(self.mode))
+        if rollup is None:
+            timestamps_ms, values = self.query(start_time, end_time)
+            # No point drawing more than about one point per pixel; decimate() keeps the peaks
+            plotted_ms, values = decimate(timestamps_ms, values, int(self.fig.bbox.width))
+            x = to_local_datenums(plotted_ms)
+            self.line.set_data(x, values)
+            self.envelope.set_visible(False)
+            lows = highs = values
+        else:
+            timestamps_ms, lows, means, highs = self.query_rollup(rollup, start_time, end_time)
+            x = to_local_datenums(timestamps_ms)  # Already few enough points
+            self.line.set_data(x, means)
+            self.envelope.set_verts(
+                [np.column_stack((np.r_[x, x[::-1]], np.r_[lows, highs[::-1]]))]
             )
-
-        self.ax.yaxis.set_major_formatter(
-            FormatStrFormatter(self.settings["formatter"])
-        )
+            self.envelope.set_visible(len(x) > 0)
 
         # Decide on y-axis limits
-        min_val = sub_df[self.field].min()
-        max_val = sub_df[self.field].max()
+        if len(lows):
+            min_val = float(np.nanmin(lows))
+            max_val = float(np.nanmax(highs))
+        else:
+            min_val = max_val = 0.0
         the_range = max_val - min_val
         if the_range < self.settings["yaxis_min_range"]:
             the_range = self.settings["yaxis_min_range"]
 
-        month_fmt = mdates.DateFormatter("%b")
-
-        def m_fmt(x, pos=None):
-            return month_fmt(x)[0]
-
-        day_fmt = mdates.DateFormatter("%d")
-
-        def d_fmt(x, pos=None):
-            return day_fmt(x)
-
         buffer = self.settings["yaxis_buffer_factor"] * the_range
         yrange = [min_val - buffer, max_val + buffer]
         yrange_rounded = [round(x, 1) for x in yrange]
@@ -417,48 +480,65 @@ class GraphPage(Subwindow):
         )
         self.ax.set_ylim(yrange_rounded)
         self.ax.set_xlim([start_time, end_time])
-        self.ax.set_xlabel("")
         if self.mode == "week":
-            self.ax.xaxis.set_major_locator(mdates.DayLocator())
-            self.ax.xaxis.set_major_formatter(
-                mdates.ConciseDateFormatter(self.ax.xaxis.get_major_locator())
-            )
             self.ax.set_title("Week of " + start_time.strftime("%b %d %Y"))
-
         elif self.mode == "month":
-            self.ax.xaxis.set_major_locator(
-                mdates.WeekdayLocator(byweekday=mdates.SU)
-            )  # Tick on Sundays every week
-            self.ax.xaxis.set_major_formatter(FuncFormatter(d_fmt))
             self.ax.set_title(start_time.strftime("%b %Y"))
-
         elif self.mode == "year":
-            self.ax.xaxis.set_major_locator(mdates.MonthLocator())
-            self.ax.xaxis.set_major_formatter(FuncFormatter(m_fmt))
             self.ax.set_title(start_time.strftime("%Y"))
 
         if title is not None:
             self.ax.set_title(title)
 
-        self.ax.grid(which="both")
-        # self.ax.get_legend().remove()
-        self.fig.subplots_adjust(bottom=0.18, left=0.14)
         self.canvas.draw()
+        self.redraw_ms = (time.perf_counter() - draw_start) * 1000
+        logger.info(
+            f"Redrew {self.field} graph ({len(x)} of {len(timestamps_ms)} points) in {self.redraw_ms:.0f} ms"
+        )
 
-    def repair_telemetry_file(self):
+    def data_start(self) -> datetime.datetime:
+        """Time of the first telemetry record (now, if there isn't one)"""
+        if self.store is None or not len(self.store):
+            return datetime.datetime.now()
+        return from_epoch_ms(self.store.first_timestamp_ms)
+
+    def data_end(self) -> datetime.datetime:
+        """Time of the last telemetry record (now, if there isn't one)"""
+        if self.store is None:
+            return datetime.datetime.now()
+        self.telemetry.refresh()  # Pick up anything recorded since the page opened
+        if not len(self.store):
+            return datetime.datetime.now()
+        return from_epoch_ms(self.store.last_timestamp_ms)
+
+    def query(self, start_time: datetime.datetime, end_time: datetime.datetime):
+        """Timestamps and values of this page's field between `start_time` and `end_time`
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            Epoch milliseconds, and the values at each
         """
-        Attempt repairs of telemetery file. Specifically, sort entries by time
+        if self.store is None:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        timestamps_ms, values = self.store.query(to_epoch_ms(start_time), to_epoch_ms(end_time))
+        return timestamps_ms, values[:, self.store.channels.index(self.field)]
+
+    def query_rollup(self, rollup, start_time: datetime.datetime, end_time: datetime.datetime):
+        """Pre-aggregated min/mean/max of this page's field for each of rollup's buckets between `start_time` and `end_time`
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+            Epoch milliseconds of the middle of each bucket, and the min, mean and max in it. Buckets
+            with no readings of this field (NaN, e.g. while its sensor was missing) are left out.
         """
-        logger.info("Attempting repair of telemetry file...")
-
-        # Read in the dataframe and parse timestamp strings to datetime
-        self.df = pd.read_csv(self.jData["telemetry_file"], parse_dates=["Timestamp"])
-
-        # Set the index to timestamp column so we can index by it
-        self.df.set_index("Timestamp", inplace=True)
-
-        # Sort by dates
-        self.df.sort_index(inplace=True)
-
-        # Send back to file
-        self.df.to_csv(self.jData["telemetry_file"])
+        buckets = rollup.query(to_epoch_ms(start_time), to_epoch_ms(end_time))
+        channel = self.store.channels.index(self.field)
+        has_data = ~np.isnan(buckets.mean[:, channel])
+        return (
+            buckets.start_ms[has_data] + rollup.width_ms // 2,
+            buckets.min[has_data, channel],
+            buckets.mean[has_data, channel],
+            buckets.max[has_data, channel],
+        )
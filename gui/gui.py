@@ -186,6 +186,12 @@ class MainWindow(Window):
 
         self.drawButtonGrid(buttons)
 
+        # Sensor readings get pushed from the server as they happen, rather than polled for
+        self.latest_readings = {"temperature": None, "ph": None}
+        self.sensor_subscription = hwCntrl.startSensorSubscription(
+            self.on_sensor_reading, self.on_sensor_connection_change
+        )
+
         # After we're done setting everything up...
         self.scheduler_count = 0
         self.update_scheduler()
@@ -245,21 +251,19 @@ class MainWindow(Window):
         elif newMode == "Lights On":
             self.buttons[0].configure(image=self.light_white)
             self.the_scheduler.disable_timers(["tank_lights", "outlet1"])
-            for lightId in [1, 2, 3]:
-                hwCntrl.setLightColor(lightId, "white")
+            hwCntrl.setLightColors({1: "white", 2: "white", 3: "white"})
 
         elif newMode == "Blue Only":
             self.buttons[0].configure(image=self.light_blue)
             self.the_scheduler.disable_timers(["tank_lights", "outlet1"])
-            for lightId in [1, 2]:
-                hwCntrl.setLightColor(lightId, "blue")
-            hwCntrl.setLightColor(3, "white")  # Keep gro lights on
+            hwCntrl.setLightColors(
+                {1: "blue", 2: "blue", 3: "white"}  # Keep gro lights on
+            )
 
         elif newMode == "Lights Off":
             self.buttons[0].configure(image=self.light_off)
             self.the_scheduler.disable_timers(["tank_lights", "outlet1"])
-            for lightId in [1, 2, 3]:
-                hwCntrl.setLightColor(lightId, "off")
+            hwCntrl.setLightColors({1: "off", 2: "off", 3: "off"})
         else:
             raise ValueError(
                 f"Unhandled lightToggleMode [{self.currentLightToggleModeInx}]: {newMode}"
@@ -271,8 +275,20 @@ class MainWindow(Window):
         logger.debug("Scheduler update")
         self.the_scheduler.update(datetime.datetime.now())
 
+    def on_sensor_reading(self, sensor: str, timestamp: datetime.datetime, value: float):
+        """Called from the sensor subscription thread whenever the server has a new reading.
+        Tkinter isn't thread safe, so just stash the value here and let refresh_data() display it.
+        """
+        self.latest_readings[sensor] = value
+
+    def on_sensor_connection_change(self, connected: bool):
+        """Called from the sensor subscription thread. While it's down, the last readings we got
+        are out of date, so drop them rather than keep displaying them."""
+        if not connected:
+            self.latest_readings = {"temperature": None, "ph": None}
+
     def refresh_data(self):
-        """Called every 1sec. Updates time, gets fresh pH/Temp readings, and kicks the systemd watchdog.
+        """Called every 1sec. Updates time, displays the latest pH/Temp readings, and kicks the systemd watchdog.
         Updates scheduler every 30th call.
         """
 
@@ -283,16 +299,23 @@ class MainWindow(Window):
         self.updateTimestamp()
 
         # Update the temperature reading
-        temp_degC = hwCntrl.getTemperature_degC()
-        temp_degF = (temp_degC * 9.0) / 5.0 + 32.0
-        self.temp_value.set(f"{temp_degF:0.1f}°F")
+        temp_degC = self.latest_readings["temperature"]
+        if temp_degC is not None:
+            temp_degF = (temp_degC * 9.0) / 5.0 + 32.0
+            self.temp_value.set(f"{temp_degF:0.1f}°F")
+        else:
+            self.temp_value.set("--.-°F")  # No connection to the server
 
         # Update the pH Reading
-        ph = hwCntrl.getPH()
-        self.ph_value.set(f"{ph:0.1f}")
-        # Uncomment next line to make pH button change color based on pH
-        # self.buttons[2].configure(bg=ph_to_color(ph))
-        self.update_ph_for_lock_screen(ph)
+        ph = self.latest_readings["ph"]
+        if ph is not None:
+            self.ph_value.set(f"{ph:0.1f}")
+            # Uncomment next line to make pH button change color based on pH
+            # self.buttons[2].configure(bg=ph_to_color(ph))
+            self.update_ph_for_lock_screen(ph)
+        else:
+            self.ph_value.set("-.-")
+            self.ph_value_for_lock_screen.set("-.-")
 
         # By doing this in this function, it is tied to the systemd watchdog. And if the displayed time is
         # updating, then the scheduler is alive!
@@ -324,6 +347,7 @@ class MainWindow(Window):
         self.lock_screen_ph_text.set(wrap_text(lock_screen_msg, width=20))
 
     def quit(self):
+        self.sensor_subscription.cancel()
         self.root.quit()
 
 
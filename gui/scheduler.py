@@ -181,26 +181,30 @@ class LightTimer:
             except KeyError:
                 pass
 
-            for light_name, color_masks in self.jData["lights"].items():
-                self.hwCntrl.setLightColor(
-                    lightKeys[light_name],
-                    "white" if color_masks["white_enabled"] else "off",
-                )
+            self.hwCntrl.setLightColors(
+                {
+                    lightKeys[light_name]: (
+                        "white" if color_masks["white_enabled"] else "off"
+                    )
+                    for light_name, color_masks in self.jData["lights"].items()
+                }
+            )
 
         elif new_state == TimerState.NIGHT:
+            colors = {}
             for light_name, color_masks in self.jData["lights"].items():
                 if self.light_mode_at_night == "off":
-                    self.hwCntrl.setLightColor(lightKeys[light_name], "off")
+                    colors[lightKeys[light_name]] = "off"
                 elif self.light_mode_at_night == "blue":
-                    self.hwCntrl.setLightColor(
-                        lightKeys[light_name],
-                        "blue" if color_masks["blue_enabled"] else "off",
+                    colors[lightKeys[light_name]] = (
+                        "blue" if color_masks["blue_enabled"] else "off"
                     )
                 else:
                     logger.error(f"Unexpected value: {self.light_mode_at_night}")
-                    self.hwCntrl.setLightColor(
-                        lightKeys[light_name], "off"
-                    )  # Just turn it off in this case
+                    colors[lightKeys[light_name]] = (
+                        "off"  # Just turn it off in this case
+                    )
+            self.hwCntrl.setLightColors(colors)
 
         elif new_state == TimerState.ECLIPSE:
             # This key better exist if we're in this state!
@@ -208,11 +212,14 @@ class LightTimer:
                 minutes=self.jData["eclipse_blue_duration_min"]
             )
             logger.info(f"Starting eclipse! Ends at {self.eclipseEndTime}")
-            for light_name, color_masks in self.jData["lights"].items():
-                self.hwCntrl.setLightColor(
-                    lightKeys[light_name],
-                    "blue" if color_masks["blue_enabled"] else "off",
-                )
+            self.hwCntrl.setLightColors(
+                {
+                    lightKeys[light_name]: (
+                        "blue" if color_masks["blue_enabled"] else "off"
+                    )
+                    for light_name, color_masks in self.jData["lights"].items()
+                }
+            )
 
         else:
             logger.error(f"{self.name}: Unhandled state in changeStateTo():{new_state}")
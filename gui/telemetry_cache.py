@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+    Process-wide cache of the telemetry store, shared by every GraphPage
+"""
+
+# Standard imports
+import os
+import time
+
+# 3rd party imports
+from loguru import logger
+
+# Custom imports
+from tsstore import TimeSeriesStore
+from rollups import open_rollups
+
+# Don't look for new telemetry more often than this (it's recorded every minute at most)
+REFRESH_INTERVAL_S = 5.0
+
+_cache = {}  # Expanded path -> Telemetry
+
+
+class Telemetry(object):
+    """
+    The memory-mapped telemetry store and its rollups. It's opened once, and refresh() then only
+    maps in (and indexes) the records appended since the last refresh, so opening another graph
+    doesn't read anything that's already been read.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.store = TimeSeriesStore(path)
+        self.rollups = open_rollups(self.store)
+        self.last_refresh = time.monotonic()
+        logger.info(f"Opened telemetry store {path}: {len(self.store)} records")
+
+    def refresh(self):
+        now = time.monotonic()
+        if now - self.last_refresh < REFRESH_INTERVAL_S:
+            return
+        self.last_refresh = now
+        before = len(self.store)
+        self.store.refresh()
+        if len(self.store) != before:
+            logger.debug(f"Telemetry store has {len(self.store) - before} new records")
+
+
+def get_telemetry(path: str) -> Telemetry:
+    """The shared Telemetry for the store at path, opening it the first time
+
+    Raises
+    ------
+    OSError, ValueError
+        If the store can't be opened (it's tried again on the next call)
+    """
+    path = os.path.realpath(os.path.expanduser(path))
+    telemetry = _cache.get(path)
+    if telemetry is None:
+        telemetry = _cache[path] = Telemetry(path)
+    else:
+        telemetry.refresh()
+    return telemetry
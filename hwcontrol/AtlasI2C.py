@@ -9,8 +9,13 @@
 import io
 import sys
 import fcntl
+import json
+import os
 import time
-import copy
+
+
+# Masks off the MSB of every byte. See AtlasI2C.handle_raspi_glitch()
+_GLITCH_TABLE = bytes(b & 0x7F for b in range(256))
 
 
 class AtlasI2C:
@@ -25,24 +30,31 @@ class AtlasI2C:
     DEFAULT_ADDRESS = 98
     LONG_TIMEOUT_COMMANDS = ("R", "CAL")
     SLEEP_COMMANDS = ("SLEEP",)
+    # the ioctl for setting the slave address, from i2c-dev.h
+    I2C_SLAVE = 0x703
+    # largest response the EZO circuits send (status byte + 31 characters + null)
+    MAX_RESPONSE_SIZE = 40
+    # valid 7 bit addresses (0x00-0x02 and 0x78-0x7F are reserved)
+    SCAN_ADDRESSES = range(0x03, 0x78)
+
+    # bus number -> addresses found by list_i2c_devices()
+    _scan_cache = {}
 
     def __init__(self, address=None, moduletype="", name="", bus=None):
         """
-        open two file streams, one for reading and one for writing
+        open one read/write file on the I2C bus
         the specific I2C channel is selected with bus
         it is usually 1, except for older revisions where its 0
-        wb and rb indicate binary read and write
         """
         self._address = address or self.DEFAULT_ADDRESS
         self.bus = bus or self.DEFAULT_BUS
         self._long_timeout = self.LONG_TIMEOUT
         self._short_timeout = self.SHORT_TIMEOUT
-        self.file_read = io.open(
-            file="/dev/i2c-{}".format(self.bus), mode="rb", buffering=0
-        )
-        self.file_write = io.open(
-            file="/dev/i2c-{}".format(self.bus), mode="wb", buffering=0
+        self.file = io.open(
+            file="/dev/i2c-{}".format(self.bus), mode="r+b", buffering=0
         )
+        self._slave_address = None  # what the fd is currently pointed at
+        self._buffer = bytearray(self.MAX_RESPONSE_SIZE)
         self.set_i2c_address(self._address)
         self._name = name
         self._module = moduletype
@@ -70,12 +82,11 @@ class AtlasI2C:
     def set_i2c_address(self, addr):
         """
         set the I2C communications to the slave specified by the address
-        the commands for I2C dev using the ioctl functions are specified in
-        the i2c-dev.h file from i2c-tools
+        the ioctl is skipped if the fd is already pointed at addr
         """
-        I2C_SLAVE = 0x703
-        fcntl.ioctl(self.file_read, I2C_SLAVE, addr)
-        fcntl.ioctl(self.file_write, I2C_SLAVE, addr)
+        if addr != self._slave_address:
+            fcntl.ioctl(self.file, self.I2C_SLAVE, addr)
+            self._slave_address = addr
         self._address = addr
 
     def write(self, cmd):
@@ -83,7 +94,7 @@ class AtlasI2C:
         appends the null character and sends the string over I2C
         """
         cmd += "\00"
-        self.file_write.write(cmd.encode("latin-1"))
+        self.file.write(cmd.encode("latin-1"))
 
     def handle_raspi_glitch(self, response):
         """
@@ -92,30 +103,19 @@ class AtlasI2C:
         NOTE: having to change the MSB to 0 is a glitch in the raspberry pi,
         and you shouldn't have to do this!
         """
-        if self.app_using_python_two():
-            return list(map(lambda x: chr(ord(x) & ~0x80), list(response)))
-        else:
-            return list(map(lambda x: chr(x & ~0x80), list(response)))
+        return list(bytes(response).translate(_GLITCH_TABLE).decode("latin-1"))
 
     def app_using_python_two(self):
         return sys.version_info[0] < 3
 
     def get_response(self, raw_data):
-        if self.app_using_python_two():
-            response = [i for i in raw_data if i != "\x00"]
-        else:
-            response = raw_data
-
-        return response
+        return raw_data
 
     def response_valid(self, response):
         valid = True
         error_code = None
         if len(response) > 0:
-            if self.app_using_python_two():
-                error_code = str(ord(response[0]))
-            else:
-                error_code = str(response[0])
+            error_code = str(response[0])
 
             if error_code != "1":  # 1:
                 valid = False
@@ -132,21 +132,29 @@ class AtlasI2C:
         """
         reads a specified number of bytes from I2C, then parses and displays the result
         """
+        return self.read_response(num_of_bytes)[1]
 
-        raw_data = self.file_read.read(num_of_bytes)
-        response = self.get_response(raw_data=raw_data)
-        # print(response)
-        is_valid, error_code = self.response_valid(response=response)
+    def read_response(self, num_of_bytes=31):
+        """
+        reads a specified number of bytes from I2C, and returns (response code, result)
+        the code is 1 for success, 254 if the device is still processing the last command,
+        and the result is what read() returns
+        """
+        view = memoryview(self._buffer)[: min(num_of_bytes, self.MAX_RESPONSE_SIZE)]
+        count = self.file.readinto(view)
+        return self.parse_response(view[:count])
 
-        if is_valid:
-            char_list = self.handle_raspi_glitch(response[1:])
-            value = str("".join(char_list)).rstrip("\x00")
-            result = f"Success {self.get_device_info()}: {value}"
-        else:
-            result = f"Error {self.get_device_info()}: {error_code}"
+    def parse_response(self, raw_data):
+        """
+        turn the raw bytes read from the device into (response code, result)
+        """
+        if len(raw_data) == 0 or raw_data[0] == 1:
+            value = bytes(raw_data[1:]).translate(_GLITCH_TABLE)
+            value = value.rstrip(b"\x00").decode("latin-1")
+            return 1, value
 
-            return result
-        return value
+        error_code = raw_data[0]
+        return error_code, f"Error {self.get_device_info()}: {error_code}"
 
     def get_command_timeout(self, command):
         timeout = None
@@ -171,16 +179,20 @@ class AtlasI2C:
             return self.read()
 
     def close(self):
-        self.file_read.close()
-        self.file_write.close()
+        self.file.close()
 
-    def list_i2c_devices(self):
+    def list_i2c_devices(self, refresh=False):
         """
-        save the current address so we can restore it after
+        scan the valid 7 bit addresses for devices. the result is cached per bus,
+        pass refresh=True to scan again
         """
-        prev_addr = copy.deepcopy(self._address)
+        if not refresh and self.bus in AtlasI2C._scan_cache:
+            return list(AtlasI2C._scan_cache[self.bus])
+
+        # save the current address so we can restore it after
+        prev_addr = self._address
         i2c_devices = []
-        for i in range(0, 128):
+        for i in self.SCAN_ADDRESSES:
             try:
                 self.set_i2c_address(i)
                 self.read(1)
@@ -190,7 +202,8 @@ class AtlasI2C:
         # restore the address we were using
         self.set_i2c_address(prev_addr)
 
-        return i2c_devices
+        AtlasI2C._scan_cache[self.bus] = i2c_devices
+        return list(i2c_devices)
 
 
 def print_devices(device_list, device):
@@ -216,6 +229,44 @@ def get_devices():
     return device_list
 
 
+def get_devices_cached(cache_file):
+    """
+    like get_devices(), but the address map found by the bus scan is saved to cache_file
+    and reused next time, as long as every cached device still answers
+    """
+    device_list = []
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+        for d in cached:
+            device_list.append(
+                AtlasI2C(address=d["address"], moduletype=d["moduletype"], name=d["name"])
+            )
+        for device in device_list:
+            device.query("I")  # raises IOError if the device has gone
+        return device_list
+    except (IOError, ValueError, KeyError):
+        # no cache, bad cache, or hardware changed: drop any handles opened from it before rescanning
+        for device in device_list:
+            device.close()
+
+    device_list = get_devices()
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        with open(cache_file, "w") as f:
+            json.dump(
+                [
+                    {"address": d.address, "moduletype": d.moduletype, "name": d.name}
+                    for d in device_list
+                ],
+                f,
+                indent=4,
+            )
+    except IOError as e:
+        print(f"Unable to write device cache {cache_file}: {e}")
+    return device_list
+
+
 def print_help_text():
     print(
         """
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Threshold alarms on the sensor readings
+#
+#
+
+import threading
+from collections import namedtuple
+from loguru import logger
+
+AlarmEvent = namedtuple(
+    "AlarmEvent",
+    [
+        "name",  # The rule's name, e.g. "ph_range"
+        "sensor",  # Poller name, e.g. "ph"
+        "active",  # True when the alarm is raised, False when it clears
+        "level",  # "high" or "low": which threshold was crossed
+        "value",  # The reading that raised/cleared it
+        "threshold",
+        "timestamp",  # When that reading was taken
+        "message",
+    ],
+)
+
+
+class AlarmRule(object):
+    """
+    One sensor's low and/or high threshold.
+
+    The alarm raises once readings have been beyond a threshold for debounce_s (by their sample
+    timestamps), and clears once they've been back inside by more than hysteresis for debounce_s.
+    So a reading that's noisy around a threshold raises one alarm, not a stream of them. Readings that
+    go straight from beyond one threshold to beyond the other (for debounce_s) clear the first alarm
+    and raise the other.
+    """
+
+    def __init__(
+        self, name, sensor, low=None, high=None, hysteresis=0.0, debounce_s=0.0
+    ):
+        if low is None and high is None:
+            raise ValueError(f"Alarm {name} needs a low and/or high threshold")
+        if (
+            low is not None
+            and high is not None
+            and low + hysteresis >= high - hysteresis
+        ):
+            raise ValueError(
+                f"Alarm {name}: low ({low}) and high ({high}) thresholds overlap with hysteresis {hysteresis}"
+            )
+        self.name = name
+        self.sensor = sensor
+        self.low = low
+        self.high = high
+        self.hysteresis = hysteresis
+        self.debounce_s = debounce_s
+
+        self.active_level = None  # "high"/"low" while raised
+        self.pending_level = None  # What the readings are heading for, while debouncing
+        self.pending_since = None
+
+    def beyond(self, value: float):
+        """Which threshold value is beyond ("high"/"low"), or None"""
+        if self.high is not None and value > self.high:
+            return "high"
+        if self.low is not None and value < self.low:
+            return "low"
+        return None
+
+    def cleared(self, value: float) -> bool:
+        """Whether value is far enough back inside the thresholds to clear the alarm"""
+        return (self.high is None or value < self.high - self.hysteresis) and (
+            self.low is None or value > self.low + self.hysteresis
+        )
+
+    def threshold(self, level: str) -> float:
+        return self.high if level == "high" else self.low
+
+    def update(self, timestamp, value: float):
+        """Check a new (timestamp, value) reading
+
+        Returns
+        -------
+        List[AlarmEvent]
+            The alarm clearing and/or raising: usually nothing, and a clear then a raise when the
+            readings have crossed to the other threshold
+        """
+        if self.active_level is None:
+            target = self.beyond(value)
+        elif self.cleared(value):
+            target = None
+        else:
+            target = self.beyond(value) or self.active_level
+
+        if target == self.active_level:
+            self.pending_level = self.pending_since = None
+            return []
+        if target != self.pending_level or self.pending_since is None:
+            self.pending_level = target
+            self.pending_since = timestamp
+        if (timestamp - self.pending_since).total_seconds() < self.debounce_s:
+            return []
+
+        events = []
+        if self.active_level is not None:
+            events.append(self.event(timestamp, value, self.active_level, False))
+        if target is not None:
+            events.append(self.event(timestamp, value, target, True))
+        self.active_level = target
+        self.pending_level = self.pending_since = None
+        return events
+
+    def event(self, timestamp, value, level, active):
+        threshold = self.threshold(level)
+        if active:
+            message = f"{self.sensor} {value:.2f} is {'above' if level == 'high' else 'below'} {threshold}"
+        else:
+            message = f"{self.sensor} {value:.2f} is back {'below' if level == 'high' else 'above'} {threshold}"
+        return AlarmEvent(
+            name=self.name,
+            sensor=self.sensor,
+            active=active,
+            level=level,
+            value=value,
+            threshold=threshold,
+            timestamp=timestamp,
+            message=message,
+        )
+
+
+def rules_from_config(conf: list):
+    """AlarmRules from the "alarms" list in hwcontrol_server.json"""
+    return [
+        AlarmRule(
+            name=c["name"],
+            sensor=c["sensor"],
+            low=c.get("low"),
+            high=c.get("high"),
+            hysteresis=c.get("hysteresis", 0.0),
+            debounce_s=c.get("debounce_sec", 0.0),
+        )
+        for c in conf
+    ]
+
+
+class AlarmEngine(object):
+    """
+    Runs every new sensor reading through that sensor's alarm rules, and tells listeners about each
+    alarm that raises or clears. Like DatumPublisher, listeners are called as listener(event) from
+    the thread that produced the reading, so they should be quick and must not raise.
+    """
+
+    def __init__(self, rules=()):
+        self.lock = threading.Lock()
+        self.rules = {}  # Sensor name -> [AlarmRule]
+        self.active = {}  # Rule name -> AlarmEvent that raised it
+        self.listeners = []
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        with self.lock:
+            self.rules = {}
+            for rule in rules:
+                self.rules.setdefault(rule.sensor, []).append(rule)
+            self.active = {}
+        logger.info(f"Alarm rules: {[rule.name for rule in rules]}")
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            try:
+                self.listeners.remove(listener)
+            except ValueError:
+                pass  # Already gone
+
+    def active_alarms(self):
+        """The event that raised each alarm that's currently active"""
+        with self.lock:
+            return list(self.active.values())
+
+    def evaluate(self, sensor: str, datum):
+        """Check a poller's new (timestamp, value) datum against its rules"""
+        events = []
+        with self.lock:
+            for rule in self.rules.get(sensor, []):
+                for event in rule.update(*datum):
+                    if event.active:
+                        self.active[rule.name] = event
+                    else:
+                        self.active.pop(rule.name, None)
+                    events.append(event)
+            listeners = list(self.listeners)
+
+        for event in events:
+            if event.active:
+                logger.warning(f"ALARM {event.name}: {event.message}")
+            else:
+                logger.info(f"Alarm {event.name} cleared: {event.message}")
+            for listener in listeners:
+                listener(event)
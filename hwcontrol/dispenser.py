@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Dispense job runner
+# Runs a whole dispense (light interlock, stepping, restore) inside the server.
+#
+
+import threading
+import time
+from enum import Enum
+from loguru import logger
+
+
+class DispenseState(Enum):
+    STARTING = 0
+    RUNNING = 1
+    COMPLETE = 2
+    CANCELLED = 3
+
+
+class DispenseJob(object):
+    """
+    One dispense, run on its own thread so it finishes (and the lights come back on) no matter
+    what happens to the client that asked for it. Progress is published via wait_for_update().
+    """
+
+    PROGRESS_PERIOD_S = 0.25  # How often progress is updated while stepping
+    SETTLE_TIME_S = 0.5  # Wait between interlocking the lights and starting the pump
+    FINISH_TIME_S = 1.0  # Wait between the pump finishing and restoring the lights
+
+    def __init__(self, stepper, interlock_relays, lock, volume_ml, steps):
+        self.stepper = stepper
+        self.interlock_relays = interlock_relays
+        self.lock = lock
+        self.volume_ml = volume_ml
+
+        self.state = DispenseState.STARTING
+        self.steps_done = 0
+        self.steps_total = steps
+        self.eta_s = 0.0
+
+        self.version = 0  # Bumped on every progress update
+        self.condition = threading.Condition()
+        self.cancel_event = threading.Event()
+
+        self.thread = threading.Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+
+    def is_finished(self) -> bool:
+        return self.state in (DispenseState.COMPLETE, DispenseState.CANCELLED)
+
+    def cancel(self):
+        """Stop the dispense early. Lights are still restored."""
+        self.cancel_event.set()
+        self.stepper.sendStop()
+
+    def wait_for_update(self, last_version: int, timeout: float) -> int:
+        """Block until progress changes from last_version (or timeout). Returns the current version."""
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self.version != last_version, timeout=timeout
+            )
+            return self.version
+
+    def _update(self, **kwargs):
+        with self.condition:
+            for key, value in kwargs.items():
+                setattr(self, key, value)
+            self.version += 1
+            self.condition.notify_all()
+
+    def _run(self):
+        """
+        This method should run as in its own thread.
+        """
+        logger.info(
+            f"Starting dispense of {self.volume_ml}mL ({self.steps_total} steps)"
+        )
+
+        logger.info("Turning off tank lights for pump")
+        with self.lock:
+            cached_states = [r.gpioObj.is_active for r in self.interlock_relays]
+            for r in self.interlock_relays:
+                r.gpioObj.off()
+
+        try:
+            time.sleep(self.SETTLE_TIME_S)
+            if not self.cancel_event.is_set():
+                self._step()
+            time.sleep(
+                self.FINISH_TIME_S
+            )  # Allow some time for ongoing dispense to finish
+        finally:
+            logger.info("Reenabling lights")
+            with self.lock:
+                for r, was_active in zip(self.interlock_relays, cached_states):
+                    if was_active:
+                        r.gpioObj.on()
+                    else:
+                        r.gpioObj.off()
+
+            state = (
+                DispenseState.COMPLETE
+                if self.steps_done >= self.steps_total
+                else DispenseState.CANCELLED
+            )
+            self._update(state=state, eta_s=0.0)
+            logger.info(
+                f"Dispense {state.name} ({self.steps_done}/{self.steps_total} steps)"
+            )
+
+    def _step(self):
+        cmd = self.stepper.sendCommand(self.steps_total)
+        self._update(state=DispenseState.RUNNING)
+
+        start_time = None
+        while not cmd["done"].wait(timeout=self.PROGRESS_PERIOD_S):
+            if self.cancel_event.is_set():
+                self.stepper.sendStop()  # In case stop arrived before stepper picked up cmd
+
+            steps_done = cmd["steps_done"]
+            if start_time is None and steps_done > 0:
+                start_time = (time.monotonic(), steps_done)
+
+            eta_s = 0.0
+            if start_time is not None and steps_done > start_time[1]:
+                rate = (steps_done - start_time[1]) / (time.monotonic() - start_time[0])
+                eta_s = (self.steps_total - steps_done) / rate
+
+            self._update(steps_done=steps_done, eta_s=eta_s)
+
+        self._update(steps_done=cmd["steps_done"])
+
+
+class Dispenser(object):
+    """Starts dispense jobs, making sure only one runs at a time"""
+
+    def __init__(self, stepper, interlock_relays, lock, steps_per_ml):
+        self.stepper = stepper
+        self.interlock_relays = interlock_relays
+        self.lock = lock
+        self.steps_per_ml = steps_per_ml
+        self.job = None
+        self.start_lock = threading.Lock()
+
+    def ml_to_steps(self, ml: float) -> int:
+        return int(self.steps_per_ml * ml)
+
+    def start(self, volume_ml: float) -> DispenseJob:
+        """Start a new dispense job. Raises RuntimeError if one is already running."""
+        with self.start_lock:
+            if self.job is not None and not self.job.is_finished():
+                raise RuntimeError("Dispense already in progress")
+
+            self.job = DispenseJob(
+                self.stepper,
+                self.interlock_relays,
+                self.lock,
+                volume_ml,
+                self.ml_to_steps(volume_ml),
+            )
+            return self.job
+
+    def cancel(self):
+        """Cancel the running dispense job, if any"""
+        if self.job is not None and not self.job.is_finished():
+            logger.info("Cancelling dispense")
+            self.job.cancel()
@@ -3,9 +3,117 @@
 #
 # Fake GPIO class for use when not on raspberry pi
 #
+# Pin states are kept in a small memory-mapped file so other processes (e.g. test/viz_demo.py) can
+# watch them, without every on()/off() rewriting a file. Run this module to print the current states.
 #
+# File layout (little endian):
+#   header: 8 byte magic, uint32 layout version, uint32 number of slots in use
+#   MAX_PINS slots of SLOT_SIZE bytes: pin name (ascii, null padded to 15 bytes), state byte
+#
+
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+STATE_FILE = "gpiostate.bin"  # This is where state of GPIO regsiters are written to
+
+MAGIC = b"FAKEGPIO"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+SLOT_SIZE = 16
+NAME_SIZE = SLOT_SIZE - 1
+MAX_PINS = 64
+FILE_SIZE = HEADER.size + MAX_PINS * SLOT_SIZE
+
+# When set to a list, every on()/off() appends (pin, time.monotonic(), state), so tests can
+# measure output timing. See enable_edge_log().
+edge_log = None
+
+
+def enable_edge_log():
+    """Start recording GPIO edges. Returns the (empty) log list."""
+    global edge_log
+    edge_log = []
+    return edge_log
+
+
+def disable_edge_log():
+    global edge_log
+    edge_log = None
+
+
+class GpioBank(object):
+    """The memory-mapped state file. Created fresh (all slots empty) when the bank is opened."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.count = 0
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, 0)  # Clear out whatever was there last run
+            os.ftruncate(fd, FILE_SIZE)
+            self.mm = mmap.mmap(fd, FILE_SIZE)
+        finally:
+            os.close(fd)  # The mapping stays valid
+        HEADER.pack_into(self.mm, 0, MAGIC, LAYOUT_VERSION, 0)
 
-LOG_FILE = "gpiostate.txt"  # This is where state of GPIO regsiters are written to
+    def add_pin(self, name) -> int:
+        """Claim a slot for a pin. Returns the slot index, or -1 if the bank is full."""
+        with self.lock:
+            if self.count >= MAX_PINS:
+                return -1
+            slot = self.count
+            offset = HEADER.size + slot * SLOT_SIZE
+            self.mm[offset : offset + NAME_SIZE] = (
+                str(name).encode("ascii", "replace")[:NAME_SIZE].ljust(NAME_SIZE, b"\0")
+            )
+            self.mm[offset + NAME_SIZE] = 0
+            self.count += 1
+            HEADER.pack_into(self.mm, 0, MAGIC, LAYOUT_VERSION, self.count)
+            return slot
+
+    def set_state(self, slot, state):
+        # A single byte store, so no locking needed
+        self.mm[HEADER.size + slot * SLOT_SIZE + NAME_SIZE] = state
+
+
+_bank = None
+
+
+def get_bank() -> GpioBank:
+    """The process wide bank, opened on first use at STATE_FILE"""
+    global _bank
+    if _bank is None:
+        _bank = GpioBank(STATE_FILE)
+    return _bank
+
+
+def read_states(path=STATE_FILE):
+    """Read a state file written by a (possibly different) process
+
+    Returns
+    -------
+    List[Tuple[str, int]]
+        (pin name, state) for each pin, in the order the pins were created
+    """
+    with open(path, "rb") as f:
+        data = f.read(FILE_SIZE)
+
+    magic, version, count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != LAYOUT_VERSION:
+        raise ValueError(f"{path} is not a fake GPIO state file")
+
+    states = []
+    for slot in range(min(count, MAX_PINS)):
+        offset = HEADER.size + slot * SLOT_SIZE
+        name = data[offset : offset + NAME_SIZE].rstrip(b"\0").decode("ascii")
+        states.append((name, data[offset + NAME_SIZE]))
+    return states
 
 
 class DigitalOutputDevice:
@@ -15,21 +123,28 @@ class DigitalOutputDevice:
         self.pin = pin
         self.active_high = active_high
         self.state = 0
+        self.slot = get_bank().add_pin(pin)
         DigitalOutputDevice.instances.append(self)
 
     def on(self):
-        self.state = 1
-        DigitalOutputDevice.printGpios()
+        self._set(1)
 
     def off(self):
-        self.state = 0
-        DigitalOutputDevice.printGpios()
+        self._set(0)
+
+    def _set(self, state):
+        if edge_log is not None:
+            edge_log.append((self.pin, time.monotonic(), state))
+        self.state = state
+        if self.slot >= 0:
+            get_bank().set_state(self.slot, state)
 
     @property
     def is_active(self):
         return self.state
 
-    @classmethod
-    def printGpios(cls):
-        with open(LOG_FILE, mode="w") as f:
-            f.write(" ".join([str(x.is_active) for x in cls.instances]) + "\n")
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else STATE_FILE
+    for name, state in read_states(path):
+        print(f"{name:>{NAME_SIZE}}: {state}")
@@ -11,6 +11,14 @@ import json
 from collections import namedtuple
 import os
 import argparse
+import asyncio
+import signal
+import sys
+import queue
+import datetime
+import threading
+import time
+from google.protobuf import timestamp_pb2
 from loguru import logger
 
 # Note: Lazy import of gpiozero below to support mock hw
@@ -18,9 +26,91 @@ from loguru import logger
 # Custom libraries
 import stepper
 import sensorpollers
+import pollsched
+import alarms
+import dispenser
+import ringbuffer
+import telemetry
 import hardwareControl_pb2
 import hardwareControl_pb2_grpc
 
+# Atlas EZO module type -> SensorType enum
+ATLAS_SENSOR_TYPES = {
+    "pH": hardwareControl_pb2.Sensor_PH,
+    "EC": hardwareControl_pb2.Sensor_EC,
+    "ORP": hardwareControl_pb2.Sensor_ORP,
+    "DO": hardwareControl_pb2.Sensor_DO,
+    "RTD": hardwareControl_pb2.Sensor_RTD,
+}
+
+# Poller name -> SensorType enum
+SENSOR_TYPES_BY_NAME = {
+    "temperature": hardwareControl_pb2.Sensor_Temperature,
+    **{t.lower(): sensor for t, sensor in ATLAS_SENSOR_TYPES.items()},
+}
+
+
+def datetime_to_timestamp(d: datetime.datetime) -> timestamp_pb2.Timestamp:
+    """Convert a (naive, local time) datetime from the pollers into a protobuf Timestamp"""
+    ts = timestamp_pb2.Timestamp()
+    ts.FromMicroseconds(int(d.timestamp() * 1e6))
+    return ts
+
+
+def make_sensor_reading(sensor, datum) -> hardwareControl_pb2.SensorReading:
+    """Pack a poller (timestamp, value) datum into a SensorReading message"""
+    return hardwareControl_pb2.SensorReading(
+        sensor=sensor, value=datum[1], timestamp=datetime_to_timestamp(datum[0])
+    )
+
+
+def latest_sensor_reading(sensor, poller) -> hardwareControl_pb2.SensorReading:
+    """A poller's latest datum as a SensorReading, with its age. Marked stale (and without a
+    timestamp) if the poller hasn't produced anything yet."""
+    if not poller.deque:
+        return hardwareControl_pb2.SensorReading(sensor=sensor, is_stale=True)
+    datum = poller.getLatestDatum()
+    age_s, is_stale = datum_freshness(poller, datum)
+    reading = make_sensor_reading(sensor, datum)
+    reading.age_sec = age_s
+    reading.is_stale = is_stale
+    return reading
+
+
+def datum_freshness(poller, datum):
+    """How old a poller's (timestamp, value) datum is, and whether that's too old to trust
+
+    Returns
+    -------
+    Tuple[float, bool]
+        (age in seconds, whether it's stale)
+    """
+    age_s = (datetime.datetime.now() - datum[0]).total_seconds()
+    interval_s = poller.get_sample_time_msec() / 1000
+    return age_s, age_s > hwMap.pollSupervisor.stale_limit_s(interval_s)
+
+
+def has_live_reading(poller) -> bool:
+    """Whether a poller's latest datum came from a real sample, isn't stale, and the poller (or the
+    AtlasPoller behind an Atlas sensor) is healthy. The placeholders pushed for missing sensors
+    never make it into the history, so they don't count."""
+    if not (poller.deque and len(poller.history)):
+        return False
+    _, is_stale = datum_freshness(poller, poller.getLatestDatum())
+    sampler = poller.poller if isinstance(poller, sensorpollers.AtlasSensor) else poller
+    return not is_stale and hwMap.pollSupervisor.is_healthy(sampler)
+
+
+def make_adaptive_interval(conf: dict):
+    """AdaptiveInterval for a sensor's config section, or None if it doesn't use adaptive sampling"""
+    if not conf["adaptive_sampling"]:
+        return None
+    return pollsched.AdaptiveInterval(
+        min_interval_s=conf["min_poll_interval_sec"],
+        max_interval_s=conf["max_poll_interval_sec"],
+        threshold=conf["adaptive_threshold"],
+    )
+
 
 class Light:
     """
@@ -86,6 +176,18 @@ class Light:
             # Unhandled!
             pass
 
+    @staticmethod
+    def relayStatesForColor(color: hardwareControl_pb2.LightColorEnum):
+        """Map a color to the (enable_relay, mode_relay) states that produce it. None if color is unhandled."""
+        if color == hardwareControl_pb2.LightColor_Off:
+            return (False, False)
+        elif color == hardwareControl_pb2.LightColor_White:
+            return (True, True)
+        elif color == hardwareControl_pb2.LightColor_Blue:
+            return (True, False)
+        else:
+            return None
+
     def __str__(self):
         return f"<{self.name}: {self.color_enum}>"
 
@@ -98,6 +200,8 @@ class HardwareMap:
     def __init__(self):
         self.bufferedLightCmdList = []
         self.scope = ""
+        # Held while changing relay/light/scope state, so snapshots never see a half-applied change
+        self.lock = threading.RLock()
 
     def setup(self, jData, use_mock_hw=False):
         self.jData = jData
@@ -147,29 +251,183 @@ class HardwareMap:
             self.jData["stepper"]["ms2_pin"],
             self.jData["stepper"]["ms3_pin"],
             use_mock_hw=use_mock_hw,
+            max_rate_hz=self.jData["stepper"]["max_rate_hz"],
+            start_rate_hz=self.jData["stepper"]["start_rate_hz"],
+            accel=self.jData["stepper"]["accel_hz_per_s"],
+            step_mode=stepper.StepMode[self.jData["stepper"]["step_mode"]],
+            pulse_backend=self.jData["stepper"]["pulse_backend"],
         )
 
+        # Tank lights get turned off while the pump runs
+        self.dispenser = dispenser.Dispenser(
+            self.stepper,
+            [lookupRly(name) for name in self.jData["dispenser"]["interlock_relays"]],
+            self.lock,
+            self.jData["dispenser"]["steps_per_ml"],
+        )
+
+        SECONDS_PER_DAY = 24 * 60 * 60
+        thermometer_conf = self.jData["thermometer"]
+        ph_sensor_conf = self.jData["ph_sensor"]
         if not use_mock_hw:
             self.thermometerPoller = sensorpollers.ThermometerPoller(
-                interval_s=self.jData["thermometer"]["poll_interval_sec"]
+                interval_s=thermometer_conf["poll_interval_sec"],
+                history_s=thermometer_conf["history_days"] * SECONDS_PER_DAY,
+                resolution_bits=thermometer_conf["resolution_bits"],
+                primary_probe=thermometer_conf["primary_probe"],
+                phase_s=thermometer_conf["poll_phase_sec"],
+                adaptive=make_adaptive_interval(thermometer_conf),
             )
-            self.phSensorPoller = sensorpollers.PhSensorPoller(
-                interval_s=self.jData["ph_sensor"]["poll_interval_sec"]
+            self.atlasPoller = sensorpollers.AtlasPoller(
+                interval_s=ph_sensor_conf["poll_interval_sec"],
+                history_s=ph_sensor_conf["history_days"] * SECONDS_PER_DAY,
+                device_cache_file=os.path.join(
+                    os.path.dirname(__file__), ph_sensor_conf["device_cache_file"]
+                ),
+                temperature_poller=(
+                    self.thermometerPoller
+                    if ph_sensor_conf["temperature_compensation"]
+                    else None
+                ),
+                max_temperature_age_s=ph_sensor_conf["max_temperature_age_sec"],
+                phase_s=ph_sensor_conf["poll_phase_sec"],
+                adaptive=(
+                    {"pH": make_adaptive_interval(ph_sensor_conf)}
+                    if ph_sensor_conf["adaptive_sampling"]
+                    else None
+                ),
             )
+            self.phSensorPoller = self.atlasPoller.sensors.get("pH")
+            if self.phSensorPoller is None:
+                logger.warning("Ph sensor not found!!!")
+                self.phSensorPoller = sensorpollers.DatumPublisher(
+                    name="ph", interval_s=ph_sensor_conf["poll_interval_sec"]
+                )
+                # Push a fake reading so code will run
+                self.phSensorPoller.deque.append((datetime.datetime.now(), 0))
         else:
+            self.atlasPoller = None
             self.thermometerPoller = sensorpollers.SimulatedPoller(
-                interval_s=self.jData["thermometer"]["poll_interval_sec"],
+                interval_s=thermometer_conf["poll_interval_sec"],
                 minV=22,
                 maxV=30,
                 stepV=0.1,
+                name="temperature",
+                history_s=thermometer_conf["history_days"] * SECONDS_PER_DAY,
+                phase_s=thermometer_conf["poll_phase_sec"],
+                adaptive=make_adaptive_interval(thermometer_conf),
             )
             self.phSensorPoller = sensorpollers.SimulatedPoller(
-                interval_s=self.jData["ph_sensor"]["poll_interval_sec"],
+                interval_s=ph_sensor_conf["poll_interval_sec"],
                 minV=7,
                 maxV=8,
                 stepV=0.2,
+                name="ph",
+                history_s=ph_sensor_conf["history_days"] * SECONDS_PER_DAY,
+                phase_s=ph_sensor_conf["poll_phase_sec"],
+                adaptive=make_adaptive_interval(ph_sensor_conf),
+            )
+
+        supervisor_conf = self.jData["poll_supervisor"]
+        self.pollSupervisor = pollsched.PollSupervisor(
+            pollsched.default_scheduler(),
+            pollers=self.scheduledPollers(),
+            check_interval_s=supervisor_conf["check_interval_sec"],
+            stale_intervals=supervisor_conf["stale_intervals"],
+            min_backoff_s=supervisor_conf["min_restart_backoff_sec"],
+            max_backoff_s=supervisor_conf["max_restart_backoff_sec"],
+        )
+        self.pollSupervisor.start()
+
+        # Rules are loaded separately (see setupAlarms), but every reading goes through the engine
+        self.alarmEngine = alarms.AlarmEngine()
+        for poller in self.sensorPollers().values():
+            poller.add_listener(
+                lambda datum, name=poller.name: self.alarmEngine.evaluate(name, datum)
             )
 
+    def setupAlarms(self, conf: list):
+        """Load the alarm rules (the "alarms" list in hwcontrol_server.json)"""
+        rules = alarms.rules_from_config(conf)
+        for rule in rules:
+            if rule.sensor not in SENSOR_TYPES_BY_NAME:
+                raise ValueError(
+                    f"Alarm {rule.name}: unknown sensor {rule.sensor} (expected one of {list(SENSOR_TYPES_BY_NAME)})"
+                )
+        self.alarmEngine.set_rules(rules)
+
+    def scheduledPollers(self) -> list:
+        """The pollers the poll scheduler runs (the Atlas circuits are all read by one AtlasPoller)"""
+        pollers = [self.thermometerPoller]
+        if self.atlasPoller is None:
+            pollers.append(self.phSensorPoller)
+        elif self.atlasPoller.sensors:
+            pollers.append(self.atlasPoller)
+        return pollers
+
+    def sensorPollers(self) -> dict:
+        """Map of SensorType enum to the poller producing that sensor's data"""
+        pollers = {
+            hardwareControl_pb2.Sensor_Temperature: self.thermometerPoller,
+            hardwareControl_pb2.Sensor_PH: self.phSensorPoller,
+        }
+        pollers.update(
+            {ATLAS_SENSOR_TYPES[t]: s for t, s in self.atlasSensors().items()}
+        )
+        return pollers
+
+    def atlasSensors(self) -> dict:
+        """Map of module type ("pH", "EC", ...) to AtlasSensor, for every Atlas circuit found"""
+        if self.atlasPoller is None:
+            return {}
+        return {
+            moduletype: sensor
+            for moduletype, sensor in self.atlasPoller.sensors.items()
+            if moduletype in ATLAS_SENSOR_TYPES
+        }
+
+    def applyLightColors(self, colors: dict):
+        """Change several lights at once.
+
+        Relays are switched in three passes: lights going off, then all mode relays, then lights coming on.
+        This is the same per-light ordering as Light.changeColor, but all lights change together rather than
+        one light at a time.
+
+        Parameters
+        ----------
+        colors : dict
+            Map of light index (0-based) to hardwareControl_pb2.LightColorEnum
+        """
+        targets = {}
+        for inx, color in colors.items():
+            states = Light.relayStatesForColor(color)
+            if states is None:
+                continue  # Unhandled, same as changeColor
+            targets[self.lightObjs[inx]] = (color, states)
+
+        logger.info(
+            "Changing lights: "
+            + ", ".join(
+                f"{light.name} <-- {color}" for light, (color, _) in targets.items()
+            )
+        )
+
+        for light, (_, (enable, _)) in targets.items():
+            if not enable and light.enable_relay:
+                light.enable_relay.gpioObj.off()
+
+        for light, (_, (_, mode)) in targets.items():
+            if light.mode_relay:
+                if mode:
+                    light.mode_relay.gpioObj.on()
+                else:
+                    light.mode_relay.gpioObj.off()
+
+        for light, (color, (enable, _)) in targets.items():
+            if enable and light.enable_relay:
+                light.enable_relay.gpioObj.on()
+            light.color_enum = color
+
     def bufferLightCmd(self, lightInx, state):
         """Record the given command to be applied later (when scope is released)
         Parameters
@@ -200,6 +458,132 @@ class HardwareMap:
 hwMap = HardwareMap()
 
 
+def relay_state_msgs() -> list:
+    """Current state of every relay, as RelayState messages"""
+    return [
+        hardwareControl_pb2.RelayState(
+            channel=(inx + 1), isEngaged=rly.gpioObj.is_active
+        )
+        for inx, rly in enumerate(hwMap.relayObjs)
+    ]
+
+
+def subscribe_sensor_readings(put):
+    """Call put(SensorReading) with the latest reading of each sensor, then again for every new poller datum.
+    put() is called from the poller threads, so it must be thread safe and quick.
+
+    Returns
+    -------
+    Callable
+        Call this to stop the readings
+    """
+
+    def make_listener(sensor):
+        return lambda datum: put(make_sensor_reading(sensor, datum))
+
+    listeners = {}
+    for sensor, poller in hwMap.sensorPollers().items():
+        listeners[sensor] = make_listener(sensor)
+        poller.add_listener(listeners[sensor])
+        if poller.deque:  # No reading yet just after startup
+            put(make_sensor_reading(sensor, poller.getLatestDatum()))
+
+    def unsubscribe():
+        for sensor, poller in hwMap.sensorPollers().items():
+            poller.remove_listener(listeners[sensor])
+
+    return unsubscribe
+
+
+def make_alarm_event(event) -> hardwareControl_pb2.AlarmEvent:
+    """Pack an alarms.AlarmEvent into an AlarmEvent message"""
+    return hardwareControl_pb2.AlarmEvent(
+        name=event.name,
+        sensor=SENSOR_TYPES_BY_NAME[event.sensor],
+        active=event.active,
+        level=event.level,
+        value=event.value,
+        threshold=event.threshold,
+        timestamp=datetime_to_timestamp(event.timestamp),
+        message=event.message,
+    )
+
+
+def subscribe_alarms(put):
+    """Call put(AlarmEvent) for every active alarm, then again each time an alarm raises or clears.
+    put() is called from the poller threads, so it must be thread safe and quick.
+
+    Returns
+    -------
+    Callable
+        Call this to stop the events
+    """
+
+    def listener(event):
+        put(make_alarm_event(event))
+
+    hwMap.alarmEngine.add_listener(listener)
+    for event in hwMap.alarmEngine.active_alarms():
+        put(make_alarm_event(event))
+
+    return lambda: hwMap.alarmEngine.remove_listener(listener)
+
+
+def start_dispense(request, context):
+    """Validate a DispenseRequest and start the job. Returns None (with error set on context) if it can't start."""
+    if request.volume_ml <= 0:
+        context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        context.set_details(f"Invalid dispense volume ({request.volume_ml})")
+        return None
+
+    try:
+        return hwMap.dispenser.start(request.volume_ml)
+    except RuntimeError as e:
+        context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+        context.set_details(str(e))
+        return None
+
+
+def make_dispense_progress(job) -> hardwareControl_pb2.DispenseProgress:
+    """Pack the current state of a DispenseJob into a DispenseProgress message"""
+    return hardwareControl_pb2.DispenseProgress(
+        state=job.state.value,
+        volume_ml=job.volume_ml,
+        steps_done=job.steps_done,
+        steps_total=job.steps_total,
+        eta_sec=job.eta_s,
+    )
+
+
+def light_color_msgs() -> list:
+    """Current color of every light, as LightColor messages"""
+    return [
+        hardwareControl_pb2.LightColor(lightId=(inx + 1), color_enum=obj.getColor())
+        for inx, obj in enumerate(hwMap.lightObjs)
+    ]
+
+
+def set_sample_time(poller, conf_key: str, sample_time_msec: int):
+    """Set a poller's sample time. 0 returns it to the configured interval, and adaptive sampling if
+    that's configured; anything else holds until then."""
+    adaptive = sample_time_msec == 0
+    if adaptive:
+        sample_time_msec = hwMap.jData[conf_key]["poll_interval_sec"] * 1000
+    poller.set_sample_time(sample_time_msec, adaptive=adaptive)
+    logger.info(
+        f"Set {poller.name} sample time to {sample_time_msec}ms"
+        + (" (adaptive)" if poller.is_adaptive() else "")
+    )
+
+
+def sample_time_msg(poller) -> hardwareControl_pb2.SampleTime:
+    """A poller's current (effective, if adaptive) sample time"""
+    return hardwareControl_pb2.SampleTime(
+        sample_time_msec=int(poller.get_sample_time_msec()),
+        adaptive=poller.is_adaptive(),
+    )
+
+
 class HardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
     """ """
 
@@ -217,10 +601,11 @@ class HardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
 
         inx = request.channel - 1
         try:
-            if request.isEngaged:
-                hwMap.relayObjs[inx].gpioObj.on()
-            else:
-                hwMap.relayObjs[inx].gpioObj.off()
+            with hwMap.lock:
+                if request.isEngaged:
+                    hwMap.relayObjs[inx].gpioObj.on()
+                else:
+                    hwMap.relayObjs[inx].gpioObj.off()
         except IndexError:
             context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
             context.set_details(f"Invalid relay channel ({request.channel})")
@@ -232,12 +617,7 @@ class HardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
         Return all relay states
         """
         response = hardwareControl_pb2.RelayStates()
-        for inx, rly in enumerate(hwMap.relayObjs):
-            response.states.append(
-                hardwareControl_pb2.RelayState(
-                    channel=(inx + 1), isEngaged=rly.gpioObj.is_active
-                )
-            )
+        response.states.extend(relay_state_msgs())
         return response
 
     def SetLightColor(self, request, context) -> None:
@@ -248,23 +628,53 @@ class HardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
             f'Got request with scope "{request.scope}": Light{request.lightId} <-- {request.color_enum}'
         )
 
-        if hwMap.scope == "" or hwMap.scope == request.scope:
-            # We are OK to set this directly
-            try:
-                hwMap.lightObjs[request.lightId - 1].changeColor(request.color_enum)
-            except IndexError:
-                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
-                context.set_details(f"Invalid light channel ({request.lightId})")
-                # TODO add handling for bad state enum
-        elif request.scope == "":
-            # Requester does not have control. Buffer the requests (only no scoped commands get buffered)
-            try:
-                logger.info("Buffering command until scope released")
-                hwMap.bufferLightCmd(request.lightId - 1, request.color_enum)
-            except IndexError:
-                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
-                context.set_details(f"Invalid light channel ({request.lightId})")
-                # TODO add handling for bad state enum
+        with hwMap.lock:
+            if hwMap.scope == "" or hwMap.scope == request.scope:
+                # We are OK to set this directly
+                try:
+                    hwMap.lightObjs[request.lightId - 1].changeColor(request.color_enum)
+                except IndexError:
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    context.set_details(f"Invalid light channel ({request.lightId})")
+                    # TODO add handling for bad state enum
+            elif request.scope == "":
+                # Requester does not have control. Buffer the requests (only no scoped commands get buffered)
+                try:
+                    logger.info("Buffering command until scope released")
+                    hwMap.bufferLightCmd(request.lightId - 1, request.color_enum)
+                except IndexError:
+                    context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                    context.set_details(f"Invalid light channel ({request.lightId})")
+                    # TODO add handling for bad state enum
+
+        return hardwareControl_pb2.Empty()
+
+    def SetLightColors(self, request, context):
+        """
+        Set several light colors in one server-side pass, return nothing.
+        Scope and buffering work the same as SetLightColor. If any light ID is invalid, nothing is changed.
+        """
+        logger.info(
+            f'Got request with scope "{request.scope}": '
+            + ", ".join(f"Light{c.lightId} <-- {c.color_enum}" for c in request.colors)
+        )
+
+        colors = {c.lightId - 1: c.color_enum for c in request.colors}
+        bad_ids = [inx + 1 for inx in colors if not 0 <= inx < len(hwMap.lightObjs)]
+        if bad_ids:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"Invalid light channel(s) ({bad_ids})")
+            return hardwareControl_pb2.Empty()
+
+        with hwMap.lock:
+            if hwMap.scope == "" or hwMap.scope == request.scope:
+                # We are OK to set these directly
+                hwMap.applyLightColors(colors)
+            elif request.scope == "":
+                # Requester does not have control. Buffer the requests (only no scoped commands get buffered)
+                logger.info("Buffering commands until scope released")
+                for inx, color in colors.items():
+                    hwMap.bufferLightCmd(inx, color)
 
         return hardwareControl_pb2.Empty()
 
@@ -273,49 +683,113 @@ class HardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
         Return all light states
         """
         response = hardwareControl_pb2.LightColors()
-        for inx, obj in enumerate(hwMap.lightObjs):
-            response.colors.append(
-                hardwareControl_pb2.LightColor(
-                    lightId=(inx + 1), color_enum=obj.getColor()
-                )
-            )
+        response.colors.extend(light_color_msgs())
         return response
 
     def GetTemperature(self, request, context):
         """
-        Get temperature from sensor and return.
-        TODO: add timestamp of data collected to message?
+        Get temperature from sensor and return, with when it was sampled.
         """
-        latest_datum = hwMap.thermometerPoller.getLatestDatum()
-        return hardwareControl_pb2.Temperature(temperature_degC=latest_datum[1])
+        reading = latest_sensor_reading(
+            hardwareControl_pb2.Sensor_Temperature, hwMap.thermometerPoller
+        )
+        probes = []
+        if isinstance(hwMap.thermometerPoller, sensorpollers.ThermometerPoller):
+            probes = [
+                hardwareControl_pb2.ProbeTemperature(
+                    id=probe_id,
+                    temperature_degC=datum[1],
+                    timestamp=datetime_to_timestamp(datum[0]),
+                )
+                for probe_id, datum in hwMap.thermometerPoller.getProbeReadings().items()
+            ]
+        temperature = hardwareControl_pb2.Temperature(
+            temperature_degC=reading.value,
+            probes=probes,
+            age_sec=reading.age_sec,
+            is_stale=reading.is_stale,
+        )
+        if reading.HasField("timestamp"):
+            temperature.timestamp.CopyFrom(reading.timestamp)
+        return temperature
 
     def GetPH(self, request, context):
         """
         Get pH from sensor and return.
         """
-        # Get the latest reading from polling thread...
-        latest_datum = hwMap.phSensorPoller.getLatestDatum()
-        return hardwareControl_pb2.pH(pH=latest_datum[1])
+        reading = latest_sensor_reading(
+            hardwareControl_pb2.Sensor_PH, hwMap.phSensorPoller
+        )
+        ph = hardwareControl_pb2.pH(
+            pH=reading.value, age_sec=reading.age_sec, is_stale=reading.is_stale
+        )
+        if reading.HasField("timestamp"):
+            ph.timestamp.CopyFrom(reading.timestamp)
+        return ph
 
     def MoveStepper(self, request, context):
         """
         Handle command to move stepper motor a certain number of steps
         """
-        hwMap.stepper.sendCommand(request.numSteps, isReverse=request.isReverse)
+        mode = None
+        if request.step_mode != hardwareControl_pb2.StepMode_Default:
+            mode = stepper.StepMode(request.step_mode - 1)
+
+        try:
+            hwMap.stepper.sendCommand(
+                request.numSteps,
+                isReverse=request.isReverse,
+                mode=mode,
+                max_rate_hz=request.max_rate_hz,
+                accel=request.accel,
+            )
+        except ValueError as e:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(str(e))
 
         return hardwareControl_pb2.Empty()
 
     def StopStepper(self, request, context):
         """Handle command to stop any active stepper motor activity"""
+        hwMap.dispenser.cancel()
         hwMap.stepper.sendStop()
         return hardwareControl_pb2.Empty()
 
+    def Dispense(self, request, context):
+        """
+        Start a dispense job and stream its progress until it finishes.
+        If the client disconnects, the job keeps going (and still restores the lights).
+        """
+        job = start_dispense(request, context)
+        if job is None:
+            return
+
+        version = -1
+        while True:
+            version = job.wait_for_update(version, timeout=1.0)
+            yield make_dispense_progress(job)
+            if job.is_finished():
+                break
+            if not context.is_active():
+                logger.info("Dispense client went away, dispense continues")
+                break
+
     def IsStepperActive(self, request, context):
         """Respond with whether or not stepper is actively doing something"""
-        return hardwareControl_pb2.StepperState(isActive=hwMap.stepper.getIsActive())
+        result = hwMap.stepper.last_result
+        return hardwareControl_pb2.StepperState(
+            isActive=hwMap.stepper.getIsActive(),
+            requested_step_rate_hz=result.requested_rate_hz if result else 0.0,
+            achieved_step_rate_hz=result.achieved_rate_hz if result else 0.0,
+        )
 
     def SetScope(self, request, context):
         """Handles scope set/reset"""
+        with hwMap.lock:
+            self._setScope(request, context)
+        return hardwareControl_pb2.Empty()
+
+    def _setScope(self, request, context):
         # Is our existing scope empty?
         if hwMap.scope == "":
             # Is new scope empty?
@@ -349,27 +823,362 @@ class HardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
                 context.set_code(grpc.StatusCode.PERMISSION_DENIED)
                 context.set_details(f"Scope is already set to {hwMap.scope}")
 
-        return hardwareControl_pb2.Empty()
-
     def SetPHSampleTime(self, request, context):
-        if request.sample_time_msec == 0:
-            request.sample_time_msec = (
-                hwMap.jData["ph_sensor"]["poll_interval_sec"] * 1000
-            )
-        logger.info(f"Setting pH sensor sample time to {request.sample_time_msec}ms")
-        hwMap.phSensorPoller.set_sample_time(request.sample_time_msec)
+        set_sample_time(hwMap.phSensorPoller, "ph_sensor", request.sample_time_msec)
         return hardwareControl_pb2.Empty()
 
     def GetPHSampleTime(self, request, context):
-        msec = int(hwMap.phSensorPoller.get_sample_time_msec())
-        return hardwareControl_pb2.SampleTime(sample_time_msec=msec)
+        return sample_time_msg(hwMap.phSensorPoller)
+
+    def SetTemperatureSampleTime(self, request, context):
+        set_sample_time(
+            hwMap.thermometerPoller, "thermometer", request.sample_time_msec
+        )
+        return hardwareControl_pb2.Empty()
+
+    def GetTemperatureSampleTime(self, request, context):
+        return sample_time_msg(hwMap.thermometerPoller)
 
     def SendPHCommand(self, request, context):
         """Send the given command to the ph sensor, and return the result. Hopefully will be quick enough"""
+        if not hasattr(hwMap.phSensorPoller, "send_command"):
+            # Just the placeholder publisher, no pH circuit was found
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            context.set_details("pH sensor not found")
+            return hardwareControl_pb2.PHResponse()
         return hardwareControl_pb2.PHResponse(
             response=hwMap.phSensorPoller.send_command(request.cmd)
         )
 
+    def GetSystemSnapshot(self, request, context):
+        """Return all sensor, relay, light and stepper state in one go.
+        hwMap.lock is held throughout, so no relay/light/scope change can land mid-snapshot.
+        """
+        with hwMap.lock:
+            return hardwareControl_pb2.SystemSnapshot(
+                timestamp=datetime_to_timestamp(datetime.datetime.now()),
+                temperature=latest_sensor_reading(
+                    hardwareControl_pb2.Sensor_Temperature, hwMap.thermometerPoller
+                ),
+                ph=latest_sensor_reading(
+                    hardwareControl_pb2.Sensor_PH, hwMap.phSensorPoller
+                ),
+                relays=relay_state_msgs(),
+                lights=light_color_msgs(),
+                stepper_active=hwMap.stepper.getIsActive(),
+                ph_sample_time_msec=hwMap.phSensorPoller.get_sample_time_msec(),
+                temperature_sample_time_msec=hwMap.thermometerPoller.get_sample_time_msec(),
+            )
+
+    def GetAtlasReadings(self, request, context):
+        """Latest reading from every Atlas circuit found on the bus"""
+        return hardwareControl_pb2.AtlasReadings(
+            readings=[
+                latest_sensor_reading(ATLAS_SENSOR_TYPES[moduletype], sensor)
+                for moduletype, sensor in hwMap.atlasSensors().items()
+                if sensor.deque
+            ]
+        )
+
+    def GetPollerHealth(self, request, context):
+        """Sample counts, errors, latency and restarts of each sensor poller"""
+        now = time.monotonic()
+        return hardwareControl_pb2.PollerHealthList(
+            pollers=[
+                hardwareControl_pb2.PollerHealth(
+                    name=poller.name,
+                    healthy=hwMap.pollSupervisor.is_healthy(poller, now),
+                    samples=poller.stats.samples,
+                    errors=poller.stats.errors,
+                    consecutive_errors=poller.stats.consecutive_errors,
+                    skipped=poller.stats.skipped,
+                    restarts=poller.stats.restarts,
+                    mean_latency_msec=1000 * poller.stats.mean_lateness_s,
+                    max_latency_msec=1000 * poller.stats.max_lateness_s,
+                    mean_duration_msec=1000 * poller.stats.mean_duration_s,
+                    max_duration_msec=1000 * poller.stats.max_duration_s,
+                    last_error=poller.stats.last_error,
+                    last_success_age_sec=(
+                        now - poller.stats.last_success_at
+                        if poller.stats.last_success_at is not None
+                        else -1
+                    ),
+                )
+                for poller in hwMap.pollSupervisor.pollers()
+            ]
+        )
+
+    def GetSensorHistory(self, request, context):
+        """
+        Return the samples a sensor took between request.start and request.end, from the poller's in-memory
+        history. If there are more than request.max_points, they are averaged down to max_points.
+        """
+        try:
+            poller = hwMap.sensorPollers()[request.sensor]
+        except KeyError:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"Invalid sensor ({request.sensor})")
+            return hardwareControl_pb2.SensorHistory()
+
+        end_ms = (
+            request.end.ToMilliseconds()
+            if request.HasField("end")
+            else int(datetime.datetime.now().timestamp() * 1000)
+        )
+        timestamps_ms, values = poller.history.get_range(
+            request.start.ToMilliseconds(), end_ms
+        )
+        timestamps_ms, values = ringbuffer.downsample(
+            timestamps_ms, values, request.max_points
+        )
+        return hardwareControl_pb2.SensorHistory(
+            sensor=request.sensor,
+            timestamps_ms=timestamps_ms.tolist(),
+            values=values.tolist(),
+        )
+
+    def GetSensorStats(self, request, context):
+        """Return a sensor's running statistics, as kept up to date by its poller"""
+        try:
+            poller = hwMap.sensorPollers()[request.sensor]
+        except KeyError:
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            context.set_details(f"Invalid sensor ({request.sensor})")
+            return hardwareControl_pb2.SensorStats()
+
+        stats = poller.signal_stats.snapshot()
+        msg = hardwareControl_pb2.SensorStats(sensor=request.sensor, count=stats.count)
+        if stats.count == 0:
+            return msg
+
+        msg.last = stats.last[1]
+        msg.last_timestamp.FromMilliseconds(stats.last[0])
+        msg.ewma = stats.ewma
+        msg.mean = stats.mean
+        msg.std = stats.std
+        msg.rate_per_hour = stats.rate_per_s * 3600
+        for window in stats.windows:
+            window_msg = msg.windows.add(
+                window_sec=int(window.window_s), min=window.min[1], max=window.max[1]
+            )
+            window_msg.min_timestamp.FromMilliseconds(window.min[0])
+            window_msg.max_timestamp.FromMilliseconds(window.max[0])
+        return msg
+
+    def SubscribeSensors(self, request, context):
+        """
+        Stream sensor readings to the client. The latest reading of each sensor is sent right away,
+        then a new message every time a poller produces a new datum.
+        """
+        readings = queue.Queue()
+        unsubscribe = subscribe_sensor_readings(readings.put)
+
+        logger.info(f"Sensor subscriber connected ({context.peer()})")
+        try:
+            while context.is_active():
+                try:
+                    yield readings.get(timeout=1.0)
+                except queue.Empty:
+                    pass  # Loop around to check if client is still there
+        finally:
+            unsubscribe()
+            logger.info(f"Sensor subscriber disconnected ({context.peer()})")
+
+    def WatchAlarms(self, request, context):
+        """
+        Stream alarm events to the client: every active alarm right away, then a message each time
+        an alarm raises or clears.
+        """
+        events = queue.Queue()
+        unsubscribe = subscribe_alarms(events.put)
+
+        logger.info(f"Alarm watcher connected ({context.peer()})")
+        try:
+            while context.is_active():
+                try:
+                    yield events.get(timeout=1.0)
+                except queue.Empty:
+                    pass  # Loop around to check if client is still there
+        finally:
+            unsubscribe()
+            logger.info(f"Alarm watcher disconnected ({context.peer()})")
+
+
+class AsyncHardwareControl(hardwareControl_pb2_grpc.HardwareControlServicer):
+    """
+    asyncio (grpc.aio) version of the servicer. Handlers that only touch in-memory state run straight on
+    the event loop by calling the matching HardwareControl handler. Handlers that can block (pH commands
+    waiting on the I2C bus, queueing stepper commands, anything taking hwMap.lock, which a running
+    dispense holds while it interlocks the lights) are pushed to a dedicated executor. A slow request
+    never ties up the loop, and open streams don't use up a thread each.
+    """
+
+    def __init__(self, executor: futures.Executor):
+        self.sync = HardwareControl()
+        self.executor = executor
+
+    async def run_blocking(self, func, *args):
+        """Run func(*args) on the blocking-work executor and wait for the result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def Echo(self, request, context):
+        return self.sync.Echo(request, context)
+
+    async def SetRelayState(self, request, context):
+        return await self.run_blocking(self.sync.SetRelayState, request, context)
+
+    async def GetRelayStates(self, request, context):
+        return self.sync.GetRelayStates(request, context)
+
+    async def SetLightColor(self, request, context):
+        return await self.run_blocking(self.sync.SetLightColor, request, context)
+
+    async def SetLightColors(self, request, context):
+        return await self.run_blocking(self.sync.SetLightColors, request, context)
+
+    async def GetLightColors(self, request, context):
+        return self.sync.GetLightColors(request, context)
+
+    async def GetTemperature(self, request, context):
+        return self.sync.GetTemperature(request, context)
+
+    async def GetPH(self, request, context):
+        return self.sync.GetPH(request, context)
+
+    async def MoveStepper(self, request, context):
+        return await self.run_blocking(self.sync.MoveStepper, request, context)
+
+    async def StopStepper(self, request, context):
+        return self.sync.StopStepper(request, context)
+
+    async def Dispense(self, request, context):
+        job = start_dispense(request, context)
+        if job is None:
+            return
+
+        version = -1
+        while True:
+            version = await self.run_blocking(job.wait_for_update, version, 1.0)
+            yield make_dispense_progress(job)
+            if job.is_finished():
+                break
+
+    async def IsStepperActive(self, request, context):
+        return self.sync.IsStepperActive(request, context)
+
+    async def SetScope(self, request, context):
+        return await self.run_blocking(self.sync.SetScope, request, context)
+
+    async def SetPHSampleTime(self, request, context):
+        return self.sync.SetPHSampleTime(request, context)
+
+    async def GetPHSampleTime(self, request, context):
+        return self.sync.GetPHSampleTime(request, context)
+
+    async def SetTemperatureSampleTime(self, request, context):
+        return self.sync.SetTemperatureSampleTime(request, context)
+
+    async def GetTemperatureSampleTime(self, request, context):
+        return self.sync.GetTemperatureSampleTime(request, context)
+
+    async def SendPHCommand(self, request, context):
+        return await self.run_blocking(self.sync.SendPHCommand, request, context)
+
+    async def GetSystemSnapshot(self, request, context):
+        return await self.run_blocking(self.sync.GetSystemSnapshot, request, context)
+
+    async def GetAtlasReadings(self, request, context):
+        return self.sync.GetAtlasReadings(request, context)
+
+    async def GetPollerHealth(self, request, context):
+        return self.sync.GetPollerHealth(request, context)
+
+    async def GetSensorHistory(self, request, context):
+        # Copying and downsampling a week of samples is real work, keep it off the loop
+        return await self.run_blocking(self.sync.GetSensorHistory, request, context)
+
+    async def GetSensorStats(self, request, context):
+        return self.sync.GetSensorStats(request, context)
+
+    async def SubscribeSensors(self, request, context):
+        """Same as HardwareControl.SubscribeSensors, but the pollers feed an asyncio queue on this loop"""
+        loop = asyncio.get_running_loop()
+        readings = asyncio.Queue()
+        unsubscribe = subscribe_sensor_readings(
+            lambda msg: loop.call_soon_threadsafe(readings.put_nowait, msg)
+        )
+
+        logger.info(f"Sensor subscriber connected ({context.peer()})")
+        try:
+            while True:
+                yield await readings.get()
+        finally:
+            # Client going away cancels this generator, so we always land here
+            unsubscribe()
+            logger.info(f"Sensor subscriber disconnected ({context.peer()})")
+
+    async def WatchAlarms(self, request, context):
+        """Same as HardwareControl.WatchAlarms, but the engine feeds an asyncio queue on this loop"""
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        unsubscribe = subscribe_alarms(
+            lambda msg: loop.call_soon_threadsafe(events.put_nowait, msg)
+        )
+
+        logger.info(f"Alarm watcher connected ({context.peer()})")
+        try:
+            while True:
+                yield await events.get()
+        finally:
+            # Client going away cancels this generator, so we always land here
+            unsubscribe()
+            logger.info(f"Alarm watcher disconnected ({context.peer()})")
+
+
+def notify_systemd_ready():
+    """Tell systemd that this service is ready go, if possible"""
+    try:
+        import systemd.daemon
+
+        logger.info("Loaded systemd module")
+        systemd.daemon.notify("READY=1")
+    except ModuleNotFoundError:
+        logger.warning("Unable to load systemd module - skipping notify.")
+
+
+def serve(jData: dict):
+    """Run the thread pool gRPC server until terminated"""
+    logger.debug("launching grpc server")
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    hardwareControl_pb2_grpc.add_HardwareControlServicer_to_server(
+        HardwareControl(), server
+    )
+    server.add_insecure_port(jData["server"])
+    server.start()
+    notify_systemd_ready()
+    server.wait_for_termination()
+
+
+async def serve_aio(jData: dict):
+    """Run the asyncio gRPC server until terminated"""
+    logger.debug("launching grpc.aio server")
+    executor = futures.ThreadPoolExecutor(
+        max_workers=jData["aio_blocking_workers"],
+        thread_name_prefix="hwcontrol-blocking",
+    )
+    server = grpc.aio.server()
+    hardwareControl_pb2_grpc.add_HardwareControlServicer_to_server(
+        AsyncHardwareControl(executor), server
+    )
+    server.add_insecure_port(jData["server"])
+    await server.start()
+    notify_systemd_ready()
+    try:
+        await server.wait_for_termination()
+    finally:
+        executor.shutdown(wait=False)
+
 
 if __name__ == "__main__":
     logger.add(
@@ -388,6 +1197,13 @@ if __name__ == "__main__":
         default=False,
         help="Run with mock hardware for testing",
     )
+    parser.add_argument(
+        "--aio",
+        "-a",
+        action="store_true",
+        default=False,
+        help="Run the asyncio (grpc.aio) server instead of the thread pool server",
+    )
 
     args = parser.parse_args()
 
@@ -399,6 +1215,7 @@ if __name__ == "__main__":
 
     logger.info("Loaded conf file", flush=True)
     logger.info(f"UseMockHw={args.mock}")
+    logger.info(f"UseAio={args.aio}")
 
     if args.mock:
         import fakegpio as gz
@@ -415,21 +1232,31 @@ if __name__ == "__main__":
             raise Exception(msg)
 
     hwMap.setup(jData["hwmap"], use_mock_hw=args.mock)
-    logger.debug("launching grpc server")
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    hardwareControl_pb2_grpc.add_HardwareControlServicer_to_server(
-        HardwareControl(), server
-    )
-    server.add_insecure_port(jData["server"])
-    server.start()
+    hwMap.setupAlarms(jData["alarms"])
 
-    # Tell systemd that this service is ready go, if possible
-    try:
-        import systemd.daemon
+    if jData["telemetry"]["enabled"]:
+        telemetry_path = os.path.join(
+            os.path.dirname(__file__), jData["telemetry"]["file"]
+        )
+        legacy_csv = jData["telemetry"].get("legacy_csv_file")
+        if legacy_csv:
+            telemetry.migrate_legacy_telemetry(
+                telemetry_path, os.path.join(os.path.dirname(__file__), legacy_csv)
+            )
+        # Runs on its own thread, and flushes at exit
+        telemetry.TelemetryRecorder(
+            telemetry_path,
+            hwMap.thermometerPoller,
+            hwMap.phSensorPoller,
+            interval_s=jData["telemetry"]["interval_sec"],
+            flush_interval_s=jData["telemetry"]["flush_interval_sec"],
+            is_live=has_live_reading,
+        )
 
-        logger.info("Loaded systemd module")
-        systemd.daemon.notify("READY=1")
-    except ModuleNotFoundError:
-        logger.warning("Unable to load systemd module - skipping notify.")
+    # Exit cleanly on SIGTERM (i.e. systemctl stop) so buffered telemetry gets flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
-    server.wait_for_termination()
+    if args.aio:
+        asyncio.run(serve_aio(jData))
+    else:
+        serve(jData)
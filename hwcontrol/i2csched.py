@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# I2C transaction scheduler for the Atlas EZO circuits
+#
+#
+
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+from loguru import logger
+
+PRIORITY_INTERACTIVE = 0  # e.g. calibration commands from the GUI
+PRIORITY_BACKGROUND = 1  # Periodic sensor reads
+
+STILL_PROCESSING = 254  # EZO response code while a command is still running
+
+
+class Transaction(object):
+    """One command to one device: write, wait for the device to process it, read the response"""
+
+    def __init__(self, device, command, priority, seq):
+        self.device = device
+        self.command = command
+        self.priority = priority
+        self.seq = seq  # Keeps FIFO order within a priority
+        self.future = Future()
+        self.timeout_s = device.get_command_timeout(command)
+        self.written_at = None
+        self.read_at = None  # When to (next) try reading the response
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class I2CTransactionScheduler(object):
+    """
+    Owns all traffic on the I2C bus, from a single thread. Commands are split into a write, a wait
+    and a read. While one device is processing a command the thread is free to service other
+    devices, so nothing holds the bus (or a lock) for the length of a command timeout.
+
+    - Queued commands start in priority order, so an interactive command never waits behind
+      queued background reads.
+    - Each device only has one command in flight at a time (the EZO circuits process one command
+      at a time).
+    - The response is first read MIN_WAIT_FRACTION of the way through the command timeout. If the
+      device answers "still processing" it's retried every RETRY_PERIOD_S, up to MAX_WAIT_FACTOR
+      timeouts. So a transaction takes as long as the device actually needs, rather than the
+      worst case timeout, and an interactive command stuck behind an in-flight read only waits
+      for what's left of that read.
+
+    Devices need AtlasI2C's write(), get_command_timeout() and read_response().
+    """
+
+    MIN_WAIT_FRACTION = 0.6
+    RETRY_PERIOD_S = 0.1
+    MAX_WAIT_FACTOR = 2.0
+
+    def __init__(self):
+        self.pending = []  # Heap of transactions waiting to be written
+        self.in_flight = {}  # device -> transaction written and waiting to be read
+        self.seq = itertools.count()
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+
+    def submit(self, device, command: str, priority=PRIORITY_BACKGROUND) -> Future:
+        """Queue a command. The returned future resolves to the device's response (as from AtlasI2C.query)."""
+        with self.condition:
+            transaction = Transaction(device, command, priority, next(self.seq))
+            heapq.heappush(self.pending, transaction)
+            self.condition.notify()
+        return transaction.future
+
+    def query(self, device, command: str, priority=PRIORITY_BACKGROUND) -> str:
+        """Blocking version of submit()"""
+        return self.submit(device, command, priority).result()
+
+    def _next_action(self):
+        """Pick the next thing to do
+
+        Returns
+        -------
+        Tuple[Optional[Transaction], bool, Optional[float]]
+            (transaction, whether to read (vs write) it, how long to wait if there's nothing to do yet)
+        """
+        now = time.monotonic()
+
+        due = [t for t in self.in_flight.values() if t.read_at <= now]
+        if due:
+            return min(due), True, None
+
+        for t in sorted(self.pending):
+            if t.device not in self.in_flight:
+                self.pending.remove(t)
+                heapq.heapify(self.pending)
+                return t, False, None
+
+        read_times = [t.read_at for t in self.in_flight.values()]
+        return None, False, (min(read_times) - now) if read_times else None
+
+    def _run(self):
+        """
+        This method should run as in its own thread.
+        """
+        logger.info("Starting I2C transaction scheduler thread")
+
+        while True:
+            with self.condition:
+                transaction, is_read, wait_s = self._next_action()
+                while transaction is None:
+                    self.condition.wait(timeout=wait_s)
+                    transaction, is_read, wait_s = self._next_action()
+
+            try:
+                if is_read:
+                    self._read(transaction)
+                else:
+                    self._write(transaction)
+            except Exception as e:
+                logger.warning(f"I2C transaction {transaction.command} failed: {e}")
+                with self.condition:
+                    self.in_flight.pop(transaction.device, None)
+                transaction.future.set_exception(e)
+
+    def _write(self, t: Transaction):
+        t.device.write(t.command)
+        t.written_at = time.monotonic()
+        if not t.timeout_s:
+            t.future.set_result("sleep mode")  # No response to wait for
+            return
+
+        t.read_at = t.written_at + self.MIN_WAIT_FRACTION * t.timeout_s
+        with self.condition:
+            self.in_flight[t.device] = t
+
+    def _read(self, t: Transaction):
+        code, response = t.device.read_response()
+        now = time.monotonic()
+        if (
+            code == STILL_PROCESSING
+            and now - t.written_at < self.MAX_WAIT_FACTOR * t.timeout_s
+        ):
+            t.read_at = now + self.RETRY_PERIOD_S
+            return
+
+        with self.condition:
+            del self.in_flight[t.device]
+        t.future.set_result(response)
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Sample scheduler for the sensor pollers
+#
+#
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+
+class JitterStats(object):
+    """How late a poller's samples start vs their deadlines, how long they take, and how many fail.
+    Times are on the monotonic clock."""
+
+    def __init__(self):
+        self.samples = 0
+        self.mean_lateness_s = 0.0
+        self.max_lateness_s = 0.0
+        self.last_lateness_s = 0.0
+        self.mean_duration_s = 0.0
+        self.max_duration_s = 0.0
+        self.last_duration_s = 0.0
+        # Deadlines passed over because the previous sample was still running (or ran long)
+        self.skipped = 0
+
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.last_error = ""
+        self.last_success_at = None  # When the last successful sample finished
+        self.started_at = (
+            None  # When the sample now running started (None if there isn't one)
+        )
+        self.restarts = 0  # By a PollSupervisor
+
+    def record(self, lateness_s: float, duration_s: float, error=None):
+        """Record a finished sample, and the exception it raised if it failed"""
+        self.samples += 1
+        self.mean_lateness_s += (lateness_s - self.mean_lateness_s) / self.samples
+        self.max_lateness_s = max(self.max_lateness_s, lateness_s)
+        self.last_lateness_s = lateness_s
+        self.mean_duration_s += (duration_s - self.mean_duration_s) / self.samples
+        self.max_duration_s = max(self.max_duration_s, duration_s)
+        self.last_duration_s = duration_s
+
+        if error is None:
+            self.consecutive_errors = 0
+            self.last_success_at = time.monotonic()
+        else:
+            self.errors += 1
+            self.consecutive_errors += 1
+            self.last_error = str(error) or type(error).__name__
+
+    def __repr__(self):
+        return (
+            f"JitterStats(samples={self.samples}, mean={1000 * self.mean_lateness_s:.1f}ms, "
+            f"max={1000 * self.max_lateness_s:.1f}ms, skipped={self.skipped}, errors={self.errors})"
+        )
+
+
+class AdaptiveInterval(object):
+    """
+    Picks a poller's sample interval from how much its signal is moving. An exponentially weighted
+    mean and variance of the readings are updated with each sample. While the standard deviation
+    is above threshold (the signal is changing), the interval drops straight to min_interval_s.
+    Once it falls below half the threshold (the signal is flat), the interval is stretched by
+    backoff_factor each sample, up to max_interval_s. In between, the interval is left alone.
+
+    threshold is in the signal's units, e.g. degC or pH.
+    """
+
+    def __init__(
+        self,
+        min_interval_s: float,
+        max_interval_s: float,
+        threshold: float,
+        alpha=0.2,
+        backoff_factor=1.5,
+    ):
+        if not 0 < min_interval_s <= max_interval_s:
+            raise ValueError(
+                f"Need 0 < min interval ({min_interval_s}) <= max interval ({max_interval_s})"
+            )
+        self.min_interval_s = min_interval_s
+        self.max_interval_s = max_interval_s
+        self.threshold = threshold
+        self.alpha = alpha
+        self.backoff_factor = backoff_factor
+
+        self.mean = None
+        self.variance = 0.0
+        self.interval_s = min_interval_s
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+    def clamp(self, interval_s: float) -> float:
+        return min(max(interval_s, self.min_interval_s), self.max_interval_s)
+
+    def update(self, value: float) -> float:
+        """Add a reading. Returns the interval to wait before the next one."""
+        if self.mean is None:
+            self.mean = value
+            return self.interval_s
+
+        diff = value - self.mean
+        increment = self.alpha * diff
+        self.mean += increment
+        self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+
+        if self.std > self.threshold:
+            self.interval_s = self.min_interval_s
+        elif self.std < self.threshold / 2:
+            self.interval_s = self.clamp(self.interval_s * self.backoff_factor)
+        return self.interval_s
+
+    def __repr__(self):
+        return (
+            f"AdaptiveInterval({self.interval_s:.1f}s in [{self.min_interval_s}, {self.max_interval_s}], "
+            f"std={self.std:.4f}, threshold={self.threshold})"
+        )
+
+
+class PollScheduler(object):
+    """
+    Runs every poller's samples from one timer heap. Deadlines are absolute times on the monotonic
+    clock, each one interval_s after the last, so the time a sample takes doesn't push the following
+    ones back. Samples are run on a small fixed pool of worker threads, so a slow read (a 1-Wire
+    conversion, an I2C command timeout) doesn't delay other sensors. Adding a poller doesn't add a thread.
+
+    A poller is anything with:
+    - interval_s: seconds between samples (read as each sample is scheduled, so it can change on the
+      fly; call add() again to apply a shorter one straight away)
+    - phase_s: None for samples every interval_s from when it was added, or an offset (s) to align
+      samples to. Pollers with the same interval and phase sample at the same moments.
+    - stats: a JitterStats
+    - sample(): take and publish one sample
+
+    Every poller gets one sample as soon as it's added, so there's data to serve straight away.
+    If a sample is still running when the next deadline comes round, that deadline is skipped rather
+    than queueing up samples.
+    """
+
+    def __init__(self, workers=3):
+        self.heap = []  # (deadline, seq, generation, poller)
+        self.seq = itertools.count()
+        self.generations = {}  # poller -> generation of its live heap entry
+        self.busy = {}  # Poller -> Future of the sample queued or running for it
+        self.condition = threading.Condition()
+        self.workers = workers
+        self.executor = self._new_executor()
+
+        self.thread = threading.Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+
+    def add(self, poller, delay_s=0.0):
+        """Start sampling poller, with a first sample after delay_s (straight away by default). Also
+        use this to reschedule after changing its interval."""
+        with self.condition:
+            generation = self.generations.get(poller, 0) + 1
+            self.generations[poller] = generation
+            heapq.heappush(
+                self.heap,
+                (time.monotonic() + delay_s, next(self.seq), generation, poller),
+            )
+            self.condition.notify()
+
+    def remove(self, poller):
+        """Stop sampling poller (a sample already running will finish)"""
+        with self.condition:
+            self.generations.pop(poller, None)
+
+    def _new_executor(self):
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="poller")
+
+    def restart(self, poller):
+        """Reschedule poller from scratch. A sample that's still running is abandoned: it no longer
+        holds up the poller's next samples, and since it keeps its worker until it returns, samples
+        move to a fresh pool of workers. Samples still queued in the old pool are cancelled (their
+        pollers' next deadlines go to the new one), and its threads exit once their samples finish.
+        Also restarts the scheduler thread if it has died."""
+        with self.condition:
+            if self.busy.pop(poller, None) is not None:
+                old_executor, self.executor = self.executor, self._new_executor()
+                # Every sample still in the old pool is in busy. Cancelling only stops the ones that
+                # haven't started, and their done callbacks take them out of busy.
+                for future in list(self.busy.values()):
+                    future.cancel()
+                old_executor.shutdown(wait=False)
+            if not self.thread.is_alive():
+                logger.error("Poll scheduler thread died, restarting it")
+                self.thread = threading.Thread(target=self._run, args=(), daemon=True)
+                self.thread.start()
+        self.add(poller)
+
+    @staticmethod
+    def next_deadline(poller, after: float) -> float:
+        """The deadline following after: interval_s later, or for an aligned poller, the next point on
+        its grid phase_s + k * interval_s"""
+        if poller.phase_s is None:
+            return after + poller.interval_s
+        k = math.floor((after - poller.phase_s) / poller.interval_s) + 1
+        return poller.phase_s + k * poller.interval_s
+
+    def _next_due(self):
+        """Wait for the next deadline, then pop it. Returns (deadline, generation, poller). Call with condition held."""
+        while True:
+            if not self.heap:
+                self.condition.wait()
+                continue
+
+            deadline, _, generation, poller = self.heap[0]
+            if self.generations.get(poller) != generation:
+                heapq.heappop(self.heap)  # Removed or rescheduled since
+                continue
+
+            wait_s = deadline - time.monotonic()
+            if wait_s > 0:
+                self.condition.wait(timeout=wait_s)
+                continue
+
+            heapq.heappop(self.heap)
+            return deadline, generation, poller
+
+    def _run(self):
+        """
+        This method should run as in its own thread.
+        """
+        logger.info("Starting poll scheduler thread")
+
+        while True:
+            with self.condition:
+                deadline, generation, poller = self._next_due()
+
+                # Skip any deadlines we've already missed, rather than running them late
+                next_deadline = self.next_deadline(poller, deadline)
+                now = time.monotonic()
+                if next_deadline <= now:
+                    missed = math.ceil((now - next_deadline) / poller.interval_s)
+                    next_deadline += missed * poller.interval_s
+                    poller.stats.skipped += missed
+                heapq.heappush(
+                    self.heap, (next_deadline, next(self.seq), generation, poller)
+                )
+
+                if poller in self.busy:
+                    poller.stats.skipped += 1
+                    continue
+
+                # Submitted with the condition held, so restart() can't swap the executor in between
+                try:
+                    future = self.executor.submit(self._sample, poller, deadline)
+                except RuntimeError:
+                    return  # Executor shut down: the interpreter is exiting
+                self.busy[poller] = future
+                future.add_done_callback(
+                    lambda future, poller=poller: self._sample_done(poller, future)
+                )
+
+    def _sample(self, poller, deadline):
+        start = time.monotonic()
+        poller.stats.started_at = start
+        error = None
+        try:
+            poller.sample()
+        except Exception as e:
+            logger.error(f"Sample from {poller} failed: {e}")
+            error = e
+        finally:
+            poller.stats.record(start - deadline, time.monotonic() - start, error)
+
+    def _sample_done(self, poller, future):
+        """Called when a sample finishes or is cancelled"""
+        with self.condition:
+            # An abandoned sample mustn't clear the state of the one that replaced it
+            if self.busy.get(poller) is future:
+                del self.busy[poller]
+                poller.stats.started_at = None
+
+
+class PollSupervisor(object):
+    """
+    Watches each poller's heartbeat (the time of its last successful sample) and restarts pollers
+    that have stopped producing data: ones whose samples keep failing, or hang, or that have fallen
+    off the scheduler. A poller is unhealthy once it's gone stale_intervals sample intervals (plus
+    check_interval_s of grace) without a good sample.
+
+    Restarting calls the poller's restart() (if it has one) to reopen whatever it reads from, then
+    reschedules it with PollScheduler.restart(). While a poller stays unhealthy, restarts back off
+    from min_backoff_s, doubling up to max_backoff_s; the backoff resets once it recovers.
+    """
+
+    def __init__(
+        self,
+        scheduler: PollScheduler,
+        pollers=(),
+        check_interval_s=5.0,
+        stale_intervals=3,
+        min_backoff_s=5.0,
+        max_backoff_s=300.0,
+    ):
+        self.scheduler = scheduler
+        self.check_interval_s = check_interval_s
+        self.stale_intervals = stale_intervals
+        self.min_backoff_s = min_backoff_s
+        self.max_backoff_s = max_backoff_s
+
+        self.lock = threading.Lock()
+        self.watched = {}  # poller -> _Watch
+        for poller in pollers:
+            self.watch(poller)
+
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+
+    def watch(self, poller):
+        with self.lock:
+            self.watched[poller] = _Watch(time.monotonic(), self.min_backoff_s)
+
+    def pollers(self):
+        with self.lock:
+            return list(self.watched)
+
+    def stale_limit_s(self, interval_s: float) -> float:
+        """How long a poller sampling every interval_s can go without a new sample before its data is stale"""
+        return self.stale_intervals * interval_s + self.check_interval_s
+
+    def has_recent_sample(self, poller, now) -> bool:
+        last_good = poller.stats.last_success_at
+        return last_good is not None and (
+            now - last_good <= self.stale_limit_s(poller.interval_s)
+        )
+
+    def in_grace_period(self, poller, now) -> bool:
+        """Whether poller started (or was restarted) too recently to judge"""
+        with self.lock:
+            watch = self.watched.get(poller)
+        return watch is not None and (
+            now - watch.since <= self.stale_limit_s(poller.interval_s)
+        )
+
+    def is_healthy(self, poller, now=None) -> bool:
+        """Whether poller is producing data: it's had a good sample recently, or it's only just
+        started and nothing has failed yet"""
+        now = time.monotonic() if now is None else now
+        return self.has_recent_sample(poller, now) or (
+            self.in_grace_period(poller, now) and not poller.stats.consecutive_errors
+        )
+
+    def check(self, now=None):
+        """Check every poller once, restarting any that are due"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            watched = list(self.watched.items())
+
+        for poller, watch in watched:
+            if self.has_recent_sample(poller, now):
+                if watch.restarted:
+                    logger.info(f"{poller} recovered")
+                watch.restarted = False
+                watch.backoff_s = self.min_backoff_s
+            elif not self.in_grace_period(poller, now) and now >= watch.next_restart_at:
+                self.restart(poller, watch, now)
+
+    def restart(self, poller, watch, now):
+        stats = poller.stats
+        if stats.started_at is not None:
+            reason = f"sample hung for {now - stats.started_at:.0f}s"
+        elif stats.consecutive_errors:
+            reason = (
+                f"{stats.consecutive_errors} failed samples, last: {stats.last_error}"
+            )
+        else:
+            reason = "no samples"
+        logger.warning(
+            f"Restarting {poller} ({reason}), next restart in {watch.backoff_s:.0f}s if still down"
+        )
+
+        try:
+            if hasattr(poller, "restart"):
+                poller.restart()
+        except Exception as e:
+            logger.error(f"Unable to restart {poller}: {e}")
+        self.scheduler.restart(poller)
+
+        stats.restarts += 1
+        watch.restarted = True
+        watch.since = now
+        watch.next_restart_at = now + watch.backoff_s
+        watch.backoff_s = min(2 * watch.backoff_s, self.max_backoff_s)
+
+    def _run(self):
+        """
+        This method should run as in its own thread.
+        """
+        logger.info("Starting poll supervisor thread")
+
+        while True:
+            time.sleep(self.check_interval_s)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Poll supervisor check failed: {e}")
+
+
+class _Watch(object):
+    """PollSupervisor's bookkeeping for one poller"""
+
+    def __init__(self, since, backoff_s):
+        self.since = since  # When supervision (or the last restart) began
+        self.backoff_s = backoff_s
+        self.next_restart_at = since
+        self.restarted = False
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def default_scheduler() -> PollScheduler:
+    """The process wide scheduler, started on first use"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = PollScheduler()
+        return _default_scheduler
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Step pulse train generation for the stepper motor
+#
+#
+
+import time
+from collections import namedtuple
+from loguru import logger
+
+PulseTrainResult = namedtuple(
+    "PulseTrainResult",
+    [
+        "steps_done",
+        "requested_rate_hz",  # Average rate asked for, over the steps actually taken
+        "achieved_rate_hz",  # Average rate actually produced
+        "mean_lateness_s",  # How late edges were vs their deadlines (software backend only)
+        "max_lateness_s",
+        "resyncs",  # Number of times the schedule had to be re-anchored after a long stall
+    ],
+)
+
+
+def segments_duration_s(segments) -> float:
+    """Total ideal duration of a list of (rate_hz, steps) segments"""
+    return sum(steps / rate_hz for rate_hz, steps in segments)
+
+
+class SoftwarePulseBackend(object):
+    """
+    Generates step pulses by toggling a GPIO from Python. Every edge is scheduled against an absolute
+    deadline on the monotonic clock (t0 + sum of periods so far), so sleep overshoot on one edge
+    doesn't push back all the edges after it. To limit overshoot in the first place, the thread
+    sleeps until a little before each deadline and spins the rest of the way. The early wake margin
+    tracks how much time.sleep() has been overshooting.
+
+    Short stalls (e.g. GIL contention) are caught up by shortening the next period. If the thread
+    falls more than MAX_CATCHUP_PERIODS behind, the schedule is re-anchored at the current time
+    instead of bursting out the missed steps, which would make the pump skip.
+    """
+
+    MAX_CATCHUP_PERIODS = 2
+    MAX_RATE_HZ = 2000  # Beyond this, Python can't keep up with the edges
+
+    MIN_WAKE_MARGIN_S = 0.0002
+    MAX_WAKE_MARGIN_S = 0.002
+
+    def __init__(self, step_gpio, duty=0.5):
+        self.step_gpio = step_gpio
+        self.duty = duty
+        self.wake_margin_s = self.MIN_WAKE_MARGIN_S
+
+    def wait_until(self, deadline: float) -> float:
+        """Block until the monotonic clock reaches deadline. Returns how late we were (s)."""
+        remaining = deadline - time.monotonic()
+        if remaining > self.wake_margin_s:
+            time.sleep(remaining - self.wake_margin_s)
+            # Learn the sleep overshoot, so next time we wake up early enough to spin to the deadline
+            overshoot = time.monotonic() - (deadline - self.wake_margin_s)
+            target = min(
+                max(2 * overshoot, self.MIN_WAKE_MARGIN_S), self.MAX_WAKE_MARGIN_S
+            )
+            self.wake_margin_s += 0.1 * (target - self.wake_margin_s)
+
+        now = time.monotonic()
+        while now < deadline:
+            now = time.monotonic()
+        return now - deadline
+
+    def run(self, segments, stop_event, on_step=None) -> PulseTrainResult:
+        """Output the step pulses for a list of (rate_hz, steps) segments.
+
+        Parameters
+        ----------
+        segments : list
+            (rate_hz, steps) tuples, run in order
+        stop_event : threading.Event
+            Stop early if this gets set (checked every step)
+        on_step : Callable[[int], None], optional
+            Called with the total steps done after every step
+
+        Returns
+        -------
+        PulseTrainResult
+        """
+        steps_done = 0
+        ideal_duration = 0.0
+        total_lateness = 0.0
+        max_lateness = 0.0
+        resyncs = 0
+
+        start = time.monotonic()
+        next_edge = start
+        for rate_hz, steps in segments:
+            period = 1.0 / rate_hz
+            high_time = period * self.duty
+            for _ in range(steps):
+                lateness = self.wait_until(next_edge)
+                if lateness > self.MAX_CATCHUP_PERIODS * period:
+                    # Way behind. Start a new schedule from here rather than rushing to catch up
+                    resyncs += 1
+                    next_edge = time.monotonic()
+                    lateness = 0.0
+                self.step_gpio.on()
+                total_lateness += lateness
+                max_lateness = max(max_lateness, lateness)
+
+                lateness = self.wait_until(next_edge + high_time)
+                self.step_gpio.off()
+                total_lateness += lateness
+                max_lateness = max(max_lateness, lateness)
+
+                next_edge += period
+                ideal_duration += period
+                steps_done += 1
+                if on_step is not None:
+                    on_step(steps_done)
+                if stop_event.is_set():
+                    break
+            if stop_event.is_set():
+                break
+
+        # Wait out the low half of the final step so the achieved rate covers whole periods
+        self.wait_until(next_edge)
+        elapsed = time.monotonic() - start
+
+        return PulseTrainResult(
+            steps_done=steps_done,
+            requested_rate_hz=steps_done / ideal_duration if steps_done else 0.0,
+            achieved_rate_hz=steps_done / elapsed if steps_done else 0.0,
+            mean_lateness_s=total_lateness / (2 * steps_done) if steps_done else 0.0,
+            max_lateness_s=max_lateness,
+            resyncs=resyncs,
+        )
+
+
+class PigpioWaveBackend(object):
+    """
+    Hands the whole pulse train to the pigpio daemon as DMA-timed waveforms, submitted with a single
+    wave_chain() call. One single-period wave is built per segment, and the chain repeats each one
+    for the segment's step count. Timing is then done in hardware, so Python scheduling can't cause
+    jitter. Needs pigpiod running.
+    """
+
+    MAX_LOOP_COUNT = 65535  # Largest repeat count a single chain loop can hold
+    MAX_RATE_HZ = 50000
+    POLL_PERIOD_S = 0.05
+
+    def __init__(self, step_pin, duty=0.5):
+        import pigpio  # Lazy import, only needed if this backend is configured
+
+        self.pigpio = pigpio
+        self.pi = pigpio.pi()
+        if not self.pi.connected:
+            raise RuntimeError("Unable to connect to pigpio daemon!")
+        self.gpio = int(str(step_pin).replace("GPIO", ""))
+        self.duty = duty
+        self.pi.set_mode(self.gpio, pigpio.OUTPUT)
+
+    def build_chain(self, segments):
+        """Create one wave per segment, and the wave_chain() command list that plays them. Returns (wave_ids, chain)"""
+        self.pi.wave_clear()
+        wave_ids = []
+        chain = []
+        for rate_hz, steps in segments:
+            period_us = int(round(1e6 / rate_hz))
+            high_us = int(round(period_us * self.duty))
+            self.pi.wave_add_generic(
+                [
+                    self.pigpio.pulse(1 << self.gpio, 0, high_us),
+                    self.pigpio.pulse(0, 1 << self.gpio, period_us - high_us),
+                ]
+            )
+            wid = self.pi.wave_create()
+            wave_ids.append(wid)
+
+            remaining = steps
+            while remaining > 0:
+                count = min(remaining, self.MAX_LOOP_COUNT)
+                if count == 1:
+                    chain += [wid]
+                else:
+                    chain += [255, 0, wid, 255, 1, count & 0xFF, count >> 8]
+                remaining -= count
+        return wave_ids, chain
+
+    def run(self, segments, stop_event, on_step=None) -> PulseTrainResult:
+        """Same interface as SoftwarePulseBackend.run(). on_step gets an estimate, since pigpio can't report
+        how many pulses it has sent.
+        """
+        wave_ids, chain = self.build_chain(segments)
+        ideal_duration = segments_duration_s(segments)
+        total_steps = sum(steps for _, steps in segments)
+
+        start = time.monotonic()
+        self.pi.wave_chain(chain)
+        while self.pi.wave_tx_busy():
+            if stop_event.is_set():
+                self.pi.wave_tx_stop()
+                break
+            if on_step is not None:
+                on_step(self.estimate_steps(segments, time.monotonic() - start))
+            time.sleep(self.POLL_PERIOD_S)
+        elapsed = time.monotonic() - start
+        self.pi.write(self.gpio, 0)
+
+        for wid in wave_ids:
+            self.pi.wave_delete(wid)
+
+        if stop_event.is_set():
+            steps_done = self.estimate_steps(segments, elapsed)
+        else:
+            steps_done = total_steps
+        if on_step is not None:
+            on_step(steps_done)
+
+        requested_rate = total_steps / ideal_duration if total_steps else 0.0
+        return PulseTrainResult(
+            steps_done=steps_done,
+            requested_rate_hz=requested_rate,
+            achieved_rate_hz=steps_done / elapsed if steps_done else 0.0,
+            mean_lateness_s=0.0,
+            max_lateness_s=0.0,
+            resyncs=0,
+        )
+
+    @staticmethod
+    def estimate_steps(segments, elapsed_s: float) -> int:
+        """How many steps should have been sent elapsed_s into the pulse train"""
+        steps = 0
+        for rate_hz, seg_steps in segments:
+            seg_duration = seg_steps / rate_hz
+            if elapsed_s >= seg_duration:
+                steps += seg_steps
+                elapsed_s -= seg_duration
+            else:
+                steps += int(elapsed_s * rate_hz + 1e-9)
+                break
+        return steps
+
+
+def make_pulse_backend(name: str, step_gpio, step_pin):
+    """Build the named pulse backend ("software" or "pigpio"). Falls back to software if pigpio isn't usable."""
+    if name == "pigpio":
+        try:
+            return PigpioWaveBackend(step_pin)
+        except (ImportError, RuntimeError) as e:
+            logger.error(f"Unable to use pigpio pulse backend ({e}), using software")
+    elif name != "software":
+        logger.error(f'Unknown pulse backend "{name}", using software')
+
+    return SoftwarePulseBackend(step_gpio)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Fixed size sample history for the sensor pollers
+#
+#
+
+import threading
+import numpy as np
+
+
+class SampleRingBuffer(object):
+    """
+    Fixed capacity ring buffer of (timestamp, value) samples. Storage is two preallocated numpy arrays
+    (int64 epoch milliseconds, float32 values), so memory use is fixed at 12 bytes per slot no matter how
+    long the server runs. Once full, each new sample overwrites the oldest one.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"Capacity must be at least 1 (got {capacity})")
+        self.capacity = capacity
+        self.timestamps_ms = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float32)
+        self.head = 0  # Index the next sample will be written to
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp_ms: int, value: float):
+        with self.lock:
+            self.timestamps_ms[self.head] = timestamp_ms
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def get_all(self):
+        """Copy out every stored sample, oldest first
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (timestamps_ms, values)
+        """
+        with self.lock:
+            if self.count < self.capacity:
+                return (
+                    self.timestamps_ms[: self.count].copy(),
+                    self.values[: self.count].copy(),
+                )
+            return (
+                np.concatenate(
+                    (self.timestamps_ms[self.head :], self.timestamps_ms[: self.head])
+                ),
+                np.concatenate((self.values[self.head :], self.values[: self.head])),
+            )
+
+    def get_range(self, start_ms: int, end_ms: int):
+        """Copy out the samples with start_ms <= timestamp <= end_ms, oldest first
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (timestamps_ms, values)
+        """
+        timestamps_ms, values = self.get_all()
+        # A mask rather than a binary search, since wall clock timestamps can step backwards (e.g. NTP sync)
+        in_range = (timestamps_ms >= start_ms) & (timestamps_ms <= end_ms)
+        return timestamps_ms[in_range], values[in_range]
+
+
+def downsample(timestamps_ms: np.ndarray, values: np.ndarray, max_points: int):
+    """Reduce a series to at most max_points by averaging equal sized runs of consecutive samples
+
+    Parameters
+    ----------
+    timestamps_ms : np.ndarray
+        int64 epoch milliseconds
+    values : np.ndarray
+        Sample values
+    max_points : int
+        Maximum length of the output. 0 means no limit.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        (timestamps_ms, values), each at most max_points long
+    """
+    n = len(values)
+    if max_points <= 0 or n <= max_points:
+        return timestamps_ms, values
+
+    starts = np.linspace(0, n, max_points, endpoint=False).astype(np.int64)
+    counts = np.diff(np.append(starts, n))
+    mean_ts = np.add.reduceat(timestamps_ms, starts) // counts
+    mean_values = np.add.reduceat(values.astype(np.float64), starts) / counts
+    return mean_ts.astype(np.int64), mean_values.astype(np.float32)
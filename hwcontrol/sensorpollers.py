@@ -5,13 +5,19 @@
 # Andrew Kessler 2021
 #
 
-import glob
+import math
 import time
 import threading
 from collections import deque
 from loguru import logger
 import datetime as dt
 
+from ringbuffer import SampleRingBuffer
+from streamstats import SensorStats
+import i2csched
+import pollsched
+import w1therm
+
 try:
     import AtlasI2C as Atlas
 except ModuleNotFoundError:
@@ -21,74 +27,162 @@ except ModuleNotFoundError:
 import random
 
 
-class ThermometerPoller(object):
+class DatumPublisher(object):
     """
-    The temperature poller thread gets a new reading from the temperature sensor at a fixed rate, and
-    pushes it onto the RIGHT side of a deque of length 1. Main thread can pop (or peek) from
-    the left side to get the most recent sensor reading with timestamp. If pop(), needs to
-    handle case of no data on dequeue.
+    Common plumbing for the pollers: holds the latest datum and tells any registered listeners
+    when a new one arrives, so consumers can wait on new data rather than polling for it.
+    Every datum is also kept in a ring buffer sized to hold history_s worth of samples at interval_s,
+    and fed to signal_stats (a streamstats.SensorStats) for running min/max/mean and trend.
 
-    TODO: Directly adapted from sample code. Should clean up, comment, and add error handling
-    TODO: move all hardcoded stuff to config file -- possibly to HardwareMap object?
+    Listeners are called from the polling thread as listener(datum), so they should be quick
+    (e.g. put the datum on a queue) and must not raise.
     """
 
-    def __init__(self, interval_s=5):
+    DEFAULT_HISTORY_S = 7 * 24 * 60 * 60
+
+    def __init__(self, name="", interval_s=5, history_s=DEFAULT_HISTORY_S):
+        self.name = name
         self.interval_s = interval_s
         self.deque = deque(maxlen=1)
-        try:
-            base_dir = "/sys/bus/w1/devices/"
-            device_folder = glob.glob(base_dir + "28*")[0]
-            self.device_file = device_folder + "/w1_slave"
-            logger.info(f"Found temperature sensor: {device_folder}")
-
-            self.thread = threading.Thread(target=self._poll, args=(), daemon=True)
-            self.thread.start()
-        except IndexError:
-            logger.warn("Temperature sensor not found!!!")
-            v = (dt.datetime.now(), -273)  # Push a fake reading so code will run
-            self.deque.append(v)
+        self.history = SampleRingBuffer(math.ceil(history_s / interval_s))
+        self.signal_stats = SensorStats()
+        self.listeners = []
+        self.listeners_lock = threading.Lock()
+
+    def set_sample_time(self, sample_time_msec: int, adaptive=False):
+        self.interval_s = sample_time_msec / 1000
+
+    def get_sample_time_msec(self) -> int:
+        return int(1000 * self.interval_s)
+
+    def is_adaptive(self) -> bool:
+        """Whether the sample time is currently being picked by a pollsched.AdaptiveInterval"""
+        return False
 
     def getLatestDatum(self):
         return self.deque[0]  # Peek from Deck to never consume
 
-    def _poll(self):
-        """
-        This method should run as in its own thread.
-        """
+    def add_listener(self, listener):
+        with self.listeners_lock:
+            self.listeners.append(listener)
 
-        logger.info("Starting thermometer polling thread")
-
-        def read_temp_raw():
-            f = open(self.device_file, "r")
-            lines = f.readlines()
-            f.close()
-            return lines
-
-        def read_temp():
-            lines = read_temp_raw()
-            while lines[0].strip()[-3:] != "YES":
-                time.sleep(0.2)
-                lines = read_temp_raw()
-            equals_pos = lines[1].find("t=")
-            if equals_pos != -1:
-                temp_string = lines[1][equals_pos + 2 :]
-                temp_c = float(temp_string) / 1000.0
-                # temp_f = temp_c * 9.0 / 5.0 + 32.0
-                return temp_c
-
-        while True:
-            temp_c = read_temp()
-            v = (dt.datetime.now(), temp_c)
-            logger.debug(
-                f"THERM: Pushing ({v[0].strftime('%Y-%m-%d-%H:%M:%S')}, {v[1]:.3f}°C) onto deque"
-            )
-            self.deque.append(v)
-            time.sleep(self.interval_s)
+    def remove_listener(self, listener):
+        with self.listeners_lock:
+            try:
+                self.listeners.remove(listener)
+            except ValueError:
+                pass  # Already gone
+
+    def publish(self, v):
+        """Push a new (timestamp, value) datum and notify listeners"""
+        self.deque.append(v)
+        timestamp_ms = int(v[0].timestamp() * 1000)
+        self.history.append(timestamp_ms, v[1])
+        self.signal_stats.update(timestamp_ms, v[1])
+        with self.listeners_lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(v)
+
+
+class SensorPoller(DatumPublisher):
+    """
+    A DatumPublisher whose samples are taken by a pollsched.PollScheduler (the shared one by default),
+    so sensors don't each need their own thread. Subclasses implement read(), returning the new value
+    (or None if there isn't one this time), and call start() once they're ready to be sampled.
 
+    phase_s aligns samples to a shared grid (see PollScheduler); None starts sampling straight away.
 
-class PhSensorPoller(object):
+    If adaptive (a pollsched.AdaptiveInterval) is given, each reading is fed to it and the interval
+    follows how much the signal is moving, starting from interval_s. A sample time set by hand with
+    set_sample_time() holds until adaptive sampling is turned back on.
     """
-    The pH poller thread gets a new reading from the pH sensor every couple of seconds, and
+
+    def __init__(
+        self,
+        name="",
+        interval_s=5,
+        history_s=DatumPublisher.DEFAULT_HISTORY_S,
+        phase_s=None,
+        scheduler=None,
+        adaptive=None,
+    ):
+        # Size the history for the fastest rate we might sample at
+        super().__init__(
+            name=name,
+            interval_s=adaptive.min_interval_s if adaptive else interval_s,
+            history_s=history_s,
+        )
+        self.interval_s = interval_s
+        self.phase_s = phase_s
+        self.scheduler = scheduler or pollsched.default_scheduler()
+        self.stats = pollsched.JitterStats()
+        self.adaptive = adaptive
+        self.adaptive_enabled = adaptive is not None
+        if self.adaptive_enabled:
+            self.interval_s = adaptive.interval_s = adaptive.clamp(interval_s)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name})"
+
+    def start(self):
+        self.scheduler.add(self)
+
+    def set_sample_time(self, sample_time_msec: int, adaptive=False):
+        """Set the sample time. With adaptive, it's a starting point for adaptive sampling (if this
+        poller has it), otherwise it's held until adaptive sampling is turned back on.
+        """
+        super().set_sample_time(sample_time_msec)
+        self.adaptive_enabled = adaptive and self.adaptive is not None
+        if self.adaptive_enabled:
+            self.interval_s = self.adaptive.interval_s = self.adaptive.clamp(
+                self.interval_s
+            )
+        self.scheduler.add(self)  # Reschedule now, rather than after the old interval
+
+    def is_adaptive(self) -> bool:
+        return self.adaptive_enabled
+
+    def adapt(self, value: float):
+        """Let adaptive sampling pick the next interval from a new reading"""
+        if not self.adaptive_enabled:
+            return
+        interval_s = self.adaptive.update(value)
+        if interval_s == self.interval_s:
+            return
+        logger.debug(
+            f"{self.name}: sample interval {self.interval_s:.1f}s -> {interval_s:.1f}s ({self.adaptive})"
+        )
+        speeding_up = interval_s < self.interval_s
+        self.interval_s = interval_s
+        if speeding_up:
+            # The next sample is already scheduled at the old, longer interval
+            self.scheduler.add(self, delay_s=interval_s)
+
+    def read(self):
+        """Take a reading. Runs on a scheduler worker thread."""
+        raise NotImplementedError
+
+    def restart(self):
+        """Reopen whatever the poller reads from. Called by a pollsched.PollSupervisor when the
+        poller has stopped producing data, before it's rescheduled."""
+        pass
+
+    def sample(self):
+        value = self.read()
+        if value is None:
+            raise IOError(f"No {self.name} reading")
+        v = (dt.datetime.now(), value)
+        logger.debug(
+            f"{self.name}: Pushing ({v[0].strftime('%Y-%m-%d-%H:%M:%S')}, {v[1]:.3f}) onto deque"
+        )
+        self.publish(v)
+        self.adapt(value)
+
+
+class ThermometerPoller(SensorPoller):
+    """
+    The temperature poller gets a new reading from the temperature sensor at a fixed rate, and
     pushes it onto the RIGHT side of a deque of length 1. Main thread can pop (or peek) from
     the left side to get the most recent sensor reading with timestamp. If pop(), needs to
     handle case of no data on dequeue.
@@ -97,109 +191,378 @@ class PhSensorPoller(object):
     TODO: move all hardcoded stuff to config file -- possibly to HardwareMap object?
     """
 
-    def __init__(self, interval_s=5):
-        self.interval_s = interval_s
-        self.deque = deque(maxlen=1)
-        self.lock = threading.Lock()
-        try:
-            self.phSensor = Atlas.AtlasI2C(address=99, moduletype="pH")
+    def __init__(
+        self,
+        interval_s=5,
+        history_s=DatumPublisher.DEFAULT_HISTORY_S,
+        resolution_bits=None,
+        primary_probe=None,
+        phase_s=None,
+        adaptive=None,
+    ):
+        """
+        Every DS18B20 found on the bus is read each cycle (see w1therm). The primary probe's reading
+        is the one published as "the" temperature; it's primary_probe if given (e.g. "28-0316a2795d1f"),
+        otherwise the first probe found. All probes' latest readings are available from getProbeReadings().
+        """
+        super().__init__(
+            name="temperature",
+            interval_s=interval_s,
+            history_s=history_s,
+            phase_s=phase_s,
+            adaptive=adaptive,
+        )
+        self.probe_readings = {}  # Probe id -> latest (timestamp, degC)
+        self.probe_readings_lock = threading.Lock()
+
+        self.resolution_bits = resolution_bits
+        self.configured_primary_probe = primary_probe
+        self.bank = None
+        self.bank_lock = threading.Lock()
+        self.banks_reading = set()  # Banks with a read in progress
+        if self.open_bank():
+            self.start()
+        else:
+            v = (dt.datetime.now(), -273)  # Push a fake reading so code will run
+            self.deque.append(v)
 
-            logger.info("Found ph sensor!")
+    def open_bank(self) -> bool:
+        """(Re)discover the probes on the bus and pick the primary one. Returns whether any were found.
 
-            self.thread = threading.Thread(target=self._poll, args=(), daemon=True)
-            self.thread.start()
-        except IndexError:
-            logger.warn("Ph sensor not found!!!")
-            v = (dt.datetime.now(), 0)  # Push a fake reading so code will run
-            self.deque.append(v)
+        If a read from the old bank is still going (hung on the bus), the old bank is closed when it
+        returns rather than now, so none of its file descriptors can be reused for another file while
+        the read is still using it.
+        """
+        bank = w1therm.W1ThermometerBank(resolution_bits=self.resolution_bits)
+        with self.bank_lock:
+            old_bank, self.bank = self.bank, bank
+            close_old_bank = old_bank is not None and old_bank not in self.banks_reading
+        if close_old_bank:
+            old_bank.close()
+
+        if not self.bank.probes:
+            logger.warning("Temperature sensor not found!!!")
+            self.primary_probe = None
+            return False
+
+        ids = self.bank.ids()
+        primary_probe = self.configured_primary_probe
+        if primary_probe is not None and primary_probe not in ids:
+            logger.warning(f"Primary temperature probe {primary_probe} not found!")
+        self.primary_probe = primary_probe if primary_probe in ids else ids[0]
+        logger.info(f"Using temperature probe {self.primary_probe}")
+        return True
+
+    def restart(self):
+        self.open_bank()  # Picks up probes that were unplugged and plugged back in
+
+    def getProbeReadings(self):
+        """Latest reading from every probe
+
+        Returns
+        -------
+        Dict[str, Tuple[datetime, float]]
+            Probe id -> (timestamp, degC)
+        """
+        with self.probe_readings_lock:
+            return dict(self.probe_readings)
 
-    def set_sample_time(self, sample_time_msec: int):
-        self.interval_s = sample_time_msec / 1000
+    def read(self):
+        with self.bank_lock:
+            bank = self.bank
+            self.banks_reading.add(bank)
+        try:
+            readings = bank.read_all()
+        finally:
+            with self.bank_lock:
+                self.banks_reading.discard(bank)
+                retired = bank is not self.bank
+            if retired:
+                bank.close()  # Replaced by open_bank() while this read was hung
+        now = dt.datetime.now()
 
-    def get_sample_time_msec(self) -> int:
-        return int(1000 * self.interval_s)
+        with self.probe_readings_lock:
+            for probe_id, temp_c in readings.items():
+                if temp_c is not None:
+                    self.probe_readings[probe_id] = (now, temp_c)
 
-    def getLatestDatum(self):
-        return self.deque[0]  # Peek from Deck to never consume
+        return readings.get(self.primary_probe)
 
-    def _poll(self):
-        """
-        This method should run as in its own thread.
-        """
 
-        logger.info("Starting PH polling thread")
+class AtlasSensor(DatumPublisher):
+    """
+    One Atlas EZO circuit (pH, EC, ORP, DO or RTD). Readings are taken by the AtlasPoller that owns it,
+    and published under the circuit's lower case module type (e.g. "ph").
 
-        while True:
-            self.lock.acquire(blocking=True)
-            try:
-                theData = float(
-                    self.phSensor.query("R")
-                )  # TODO add error handling for failed reads
-            except ValueError as e:
-                logger.warning(f"Problem with ph reading! {e}")
-                theData = 0.0
-
-            v = (dt.datetime.now(), theData)
-            logger.debug(
-                f"PH: Pushing ({v[0].strftime('%Y-%m-%d-%H:%M:%S')}, {v[1]:.3f}) onto deque"
-            )
-            self.deque.append(v)
-            self.lock.release()
+    Circuits whose readings depend on temperature are read with "RT,<temp>", which sets the compensation
+    temperature and takes a reading in one transaction. The temperature is the latest datum from the
+    poller's temperature_poller, as long as it's no older than max_temperature_age_s. Otherwise a plain
+    "R" is sent, and the circuit uses the last temperature it was given.
+    """
 
-            # Need to account for time that query('R') waits...
-            time.sleep(max(self.interval_s - self.phSensor.LONG_TIMEOUT, 0.1))
+    COMPENSATED_TYPES = ("pH", "EC", "DO")
+    PLAUSIBLE_TEMP_RANGE_C = (
+        0.0,
+        50.0,
+    )  # Anything else is a sensor fault (e.g. the -273 placeholder)
+
+    def __init__(
+        self,
+        device,
+        poller,
+        history_s=DatumPublisher.DEFAULT_HISTORY_S,
+        min_interval_s=None,
+    ):
+        # The history is sized for the fastest rate the poller might read at
+        super().__init__(
+            name=device.moduletype.lower(),
+            interval_s=min_interval_s or poller.interval_s,
+            history_s=history_s,
+        )
+        self.device = device
+        self.poller = poller
+        self.compensated = (
+            False  # Whether the last read command was temperature compensated
+        )
+
+    # All circuits are read in the same cycle, so the sample time belongs to the poller
+    def set_sample_time(self, sample_time_msec: int, adaptive=False):
+        self.poller.set_sample_time(sample_time_msec, adaptive)
 
-    def send_command(self, cmd: str) -> str:
-        logger.debug("Waiting for polling to be paused")
-        self.lock.acquire(blocking=True)
-        logger.debug("Got it!")
-        result = self.phSensor.query(cmd)  # See implementation for wait times...
-        self.lock.release()
+    def get_sample_time_msec(self) -> int:
+        return self.poller.get_sample_time_msec()
+
+    def is_adaptive(self) -> bool:
+        return self.poller.is_adaptive()
+
+    def compensation_temperature(self):
+        """The temperature (degC) to compensate the next reading with, or None if there isn't a usable one"""
+        temperature_poller = self.poller.temperature_poller
+        if (
+            self.device.moduletype not in self.COMPENSATED_TYPES
+            or temperature_poller is None
+            or not temperature_poller.deque
+        ):
+            return None
+
+        timestamp, temp_c = temperature_poller.getLatestDatum()
+        age_s = (dt.datetime.now() - timestamp).total_seconds()
+        if age_s > self.poller.max_temperature_age_s:
+            return None
+        low, high = self.PLAUSIBLE_TEMP_RANGE_C
+        if not low <= temp_c <= high:
+            return None
+        return temp_c
+
+    def read_command(self) -> str:
+        """Command that takes a reading"""
+        temp_c = self.compensation_temperature()
+        compensated = temp_c is not None
+        if (
+            self.device.moduletype in self.COMPENSATED_TYPES
+            and self.poller.temperature_poller
+        ):
+            if self.compensated and not compensated:
+                logger.warning(
+                    f"No recent temperature, {self.name} readings not compensated for temperature"
+                )
+            elif compensated and not self.compensated:
+                logger.info(f"Compensating {self.name} readings for temperature")
+        self.compensated = compensated
+
+        return f"RT,{temp_c:.2f}" if compensated else "R"
+
+    def parse_reading(self, response: str) -> float:
+        """Value from a read response. Some circuits (e.g. EC) can return several comma separated
+        values; the first is used."""
+        return float(response.split(",")[0])
 
-        return result
+    def send_command(self, cmd: str) -> str:
+        """Send a command straight away (ahead of any queued background reads) and return the response"""
+        return self.poller.scheduler.query(
+            self.device, cmd, priority=i2csched.PRIORITY_INTERACTIVE
+        )
 
 
-class SimulatedPoller(object):
+class AtlasPoller(object):
     """
-    A simulated poller for fake sensors
+    Reads every Atlas EZO circuit on the I2C bus each cycle. A read command is sent to all of them
+    at once and their responses collected as they finish (the scheduler overlaps the waits), so a
+    cycle costs about one read timeout however many circuits there are.
+
+    Circuits are found by a bus scan the first time; the address map is cached in device_cache_file
+    so later starts skip the scan. Each circuit's readings are published by its AtlasSensor, see
+    sensors. If temperature_poller is given, its readings are used for temperature compensation
+    (see AtlasSensor).
+
+    adaptive maps module types to a pollsched.AdaptiveInterval for that circuit's readings (e.g.
+    {"pH": ...}); the cycle runs at the shortest interval any of them asks for. See SensorPoller
+    for how it interacts with set_sample_time().
     """
 
-    def __init__(self, interval_s=5, minV=0, maxV=100, stepV=0.1):
+    def __init__(
+        self,
+        interval_s=60,
+        history_s=DatumPublisher.DEFAULT_HISTORY_S,
+        scheduler=None,
+        device_cache_file="atlas_devices.json",
+        temperature_poller=None,
+        max_temperature_age_s=300,
+        phase_s=None,
+        poll_scheduler=None,
+        adaptive=None,
+    ):
+        self.name = "atlas"
         self.interval_s = interval_s
-        self.minV = minV
-        self.maxV = maxV
-        self.stepV = stepV
-        self.lock = threading.Lock()
-        self.deque = deque(maxlen=1)
-        self.thread = threading.Thread(target=self._poll, args=(), daemon=True)
-        self.thread.start()
+        self.phase_s = phase_s
+        self.adaptive = adaptive or {}
+        self.adaptive_enabled = bool(self.adaptive)
+        for a in self.adaptive.values():
+            a.interval_s = a.clamp(interval_s)
+            self.interval_s = min(self.interval_s, a.interval_s)
+        self.poll_scheduler = poll_scheduler or pollsched.default_scheduler()
+        self.stats = pollsched.JitterStats()
+        self.temperature_poller = temperature_poller
+        self.max_temperature_age_s = max_temperature_age_s
+        # All I2C traffic goes through the scheduler, with the periodic reads at background priority
+        self.scheduler = scheduler or i2csched.I2CTransactionScheduler()
+        self.sensors = {}  # Module type ("pH", "EC", ...) -> AtlasSensor
+
+        try:
+            devices = Atlas.get_devices_cached(device_cache_file)
+        except (IOError, NameError) as e:
+            logger.error(f"Unable to scan for Atlas sensors! {e}")
+            devices = []
+
+        for device in devices:
+            if device.moduletype in self.sensors:
+                logger.warning(
+                    f"Ignoring second {device.moduletype} circuit at address {device.address}"
+                )
+                continue
+            self.sensors[device.moduletype] = AtlasSensor(
+                device, self, history_s, self.min_interval_s()
+            )
+            logger.info(f"Found Atlas sensor: {device.get_device_info()}")
 
-    def set_sample_time(self, sample_time_msec: int):
+        if self.sensors:
+            self.poll_scheduler.add(self)
+
+    def __repr__(self):
+        return f"AtlasPoller({', '.join(self.sensors)})"
+
+    def set_sample_time(self, sample_time_msec: int, adaptive=False):
         self.interval_s = sample_time_msec / 1000
+        self.adaptive_enabled = adaptive and bool(self.adaptive)
+        if self.adaptive_enabled:
+            for a in self.adaptive.values():
+                a.interval_s = a.clamp(self.interval_s)
+            self.interval_s = min(a.interval_s for a in self.adaptive.values())
+        self.poll_scheduler.add(self)
 
     def get_sample_time_msec(self) -> int:
         return int(1000 * self.interval_s)
 
-    def getLatestDatum(self):
-        return self.deque[0]  # Peek from Deck to never consume
-
-    def _poll(self):
-        """
-        This method should run as in its own thread.
-        """
+    def is_adaptive(self) -> bool:
+        return self.adaptive_enabled
+
+    def restart(self):
+        """Called by a pollsched.PollSupervisor when reads have stopped coming back"""
+        if not self.scheduler.thread.is_alive():
+            logger.error("I2C transaction scheduler thread died, starting a new one")
+            self.scheduler = i2csched.I2CTransactionScheduler()
+
+    def min_interval_s(self) -> float:
+        """The shortest interval the circuits might be read at"""
+        return min(
+            [a.min_interval_s for a in self.adaptive.values()] + [self.interval_s]
+        )
+
+    def adapt(self, readings):
+        """Let adaptive sampling pick the next interval from this cycle's readings (module type -> value)"""
+        if not self.adaptive_enabled:
+            return
+        for moduletype, value in readings.items():
+            if moduletype in self.adaptive:
+                self.adaptive[moduletype].update(value)
+        interval_s = min(a.interval_s for a in self.adaptive.values())
+        if interval_s == self.interval_s:
+            return
+        logger.debug(
+            f"ATLAS: sample interval {self.interval_s:.1f}s -> {interval_s:.1f}s ({self.adaptive})"
+        )
+        speeding_up = interval_s < self.interval_s
+        self.interval_s = interval_s
+        if speeding_up:
+            # The next cycle is already scheduled at the old, longer interval
+            self.poll_scheduler.add(self, delay_s=interval_s)
+
+    def sample(self):
+        """Read every circuit. Runs on a poll scheduler worker thread."""
+        futures = [
+            (
+                sensor,
+                self.scheduler.submit(
+                    sensor.device,
+                    sensor.read_command(),
+                    priority=i2csched.PRIORITY_BACKGROUND,
+                ),
+            )
+            for sensor in self.sensors.values()
+        ]
 
-        logger.info("Starting fake polling thread")
+        readings = {}
+        for sensor, future in futures:
+            try:
+                value = sensor.parse_reading(future.result())
+            except (ValueError, OSError) as e:
+                logger.warning(f"Problem with {sensor.name} reading! {e}")
+                continue
 
-        while True:
-            self.lock.acquire(blocking=True)  # block until lock available
-            value = random.random() * (self.maxV - self.minV) + self.minV
             v = (dt.datetime.now(), value)
             logger.debug(
-                f"SIM: Pushing ({v[0].strftime('%Y-%m-%d-%H:%M:%S')}, {v[1]:.3f}) onto deque"
+                f"ATLAS: Pushing {sensor.name} ({v[0].strftime('%Y-%m-%d-%H:%M:%S')}, {v[1]:.3f}) onto deque"
             )
-            self.deque.append(v)
-            self.lock.release()
-            time.sleep(self.interval_s)
+            sensor.publish(v)
+            readings[sensor.device.moduletype] = value
+
+        if not readings:
+            raise IOError("No readings from any Atlas circuit")
+        self.adapt(readings)
+
+
+class SimulatedPoller(SensorPoller):
+    """
+    A simulated poller for fake sensors
+    """
+
+    def __init__(
+        self,
+        interval_s=5,
+        minV=0,
+        maxV=100,
+        stepV=0.1,
+        name="simulated",
+        history_s=DatumPublisher.DEFAULT_HISTORY_S,
+        phase_s=None,
+        adaptive=None,
+    ):
+        super().__init__(
+            name=name,
+            interval_s=interval_s,
+            history_s=history_s,
+            phase_s=phase_s,
+            adaptive=adaptive,
+        )
+        self.minV = minV
+        self.maxV = maxV
+        self.stepV = stepV
+        self.lock = threading.Lock()
+        self.start()
+
+    def read(self):
+        with self.lock:  # block until lock available
+            return random.random() * (self.maxV - self.minV) + self.minV
 
     def send_command(self, cmd: str) -> str:
         logger.debug("Waiting for polling to be paused")
@@ -214,12 +577,14 @@ class SimulatedPoller(object):
 if __name__ == "__main__":
     try:
         T = ThermometerPoller()
-        P = PhSensorPoller()
+        A = AtlasPoller(interval_s=5)
 
         while 1:
             time.sleep(5)  # give things a chance to start
             logger.info(f"Temp: {T.getLatestDatum()}")
-            logger.info(f"pH: {P.getLatestDatum()}")
+            for sensor in A.sensors.values():
+                if sensor.deque:
+                    logger.info(f"{sensor.name}: {sensor.getLatestDatum()}")
             time.sleep(1)
 
     except KeyboardInterrupt:
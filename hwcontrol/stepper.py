@@ -5,12 +5,15 @@
 #
 #
 
+import math
 import time
 import threading
 import queue
 from enum import Enum
 from loguru import logger
 
+import pulsegen
+
 # Note: Lazy import of gpiozero module in __init__
 
 
@@ -21,9 +24,84 @@ class StepMode(Enum):
     EIGTH_STEP = 3
     SIXTEENTH_STEP = 4
 
+    @property
+    def microsteps(self) -> int:
+        """Number of step pulses per full step in this mode"""
+        return 2**self.value
+
+
+def plan_trapezoid(steps, start_rate_hz, max_rate_hz, accel, ramp_segments=16):
+    """Plan a move as a trapezoidal velocity profile: ramp up from start_rate_hz at accel, cruise at
+    max_rate_hz, then ramp back down. Short moves that can't reach max_rate_hz get a triangular profile.
+    Each ramp is split into ramp_segments constant rate chunks.
+
+    Parameters
+    ----------
+    steps : int
+        Total steps in the move
+    start_rate_hz : float
+        Rate to start and finish at (steps/s). Should be slow enough to start from rest without skipping.
+    max_rate_hz : float
+        Cruising rate (steps/s)
+    accel : float
+        Acceleration (steps/s^2)
+    ramp_segments : int
+        Number of constant rate chunks per ramp
+
+    Returns
+    -------
+    List[Tuple[float, int]]
+        (rate_hz, steps) segments, for pulsegen
+    """
+    if steps <= 0:
+        return []
+
+    start_rate_hz = min(start_rate_hz, max_rate_hz)
+    if accel <= 0 or max_rate_hz <= start_rate_hz:
+        return [(max_rate_hz, steps)]
+
+    # v^2 = v0^2 + 2an
+    full_ramp_steps = int((max_rate_hz**2 - start_rate_hz**2) / (2 * accel))
+    ramp_steps = min(full_ramp_steps, steps // 2)
+    cruise_steps = steps - 2 * ramp_steps
+
+    ramp = []
+    edges = [round(i * ramp_steps / ramp_segments) for i in range(ramp_segments + 1)]
+    for first, last in zip(edges[:-1], edges[1:]):
+        if last > first:
+            mid = (first + last) / 2  # Rate at the middle of the chunk
+            rate = math.sqrt(start_rate_hz**2 + 2 * accel * mid)
+            ramp.append((min(rate, max_rate_hz), last - first))
+
+    if ramp_steps < full_ramp_steps:
+        # Triangular: the odd step left between the ramps (if any) can't go faster than the ramps got to
+        cruise_rate = ramp[-1][0] if ramp else start_rate_hz
+    else:
+        cruise_rate = max_rate_hz
+    cruise = [(cruise_rate, cruise_steps)] if cruise_steps > 0 else []
+    return ramp + cruise + ramp[::-1]
+
 
 class StepperMotor(object):
-    def __init__(self, step, dir, nen, ms1, ms2, ms3, use_mock_hw=False):
+    def __init__(
+        self,
+        step,
+        dir,
+        nen,
+        ms1,
+        ms2,
+        ms3,
+        use_mock_hw=False,
+        max_rate_hz=400,
+        start_rate_hz=100,
+        accel=800,
+        step_mode=StepMode.FULL_STEP,
+        pulse_backend="software",
+    ):
+        """
+        Rates (steps/s) and acceleration (steps/s^2) are in full steps, whatever the step mode,
+        so a given command moves the same distance in any mode.
+        """
         # Lazy import here to better support mock hw case
         if use_mock_hw:
             import fakegpio as gz
@@ -54,6 +132,17 @@ class StepperMotor(object):
         if ms3:
             self.gpios_msx[2] = gz.DigitalOutputDevice(pin=ms3)
 
+        self.max_rate_hz = max_rate_hz
+        self.start_rate_hz = start_rate_hz
+        self.accel = accel
+        self.step_mode = step_mode
+        self.checkMode(step_mode)
+
+        if use_mock_hw:
+            pulse_backend = "software"
+        self.pulser = pulsegen.make_pulse_backend(pulse_backend, self.gpio_step, step)
+        self.last_result = None  # pulsegen.PulseTrainResult from the most recent move
+
         self.queue = queue.Queue()
         self.stop_event = threading.Event()
         self.is_active_flag = threading.Event()
@@ -83,10 +172,28 @@ class StepperMotor(object):
         self.gpio_step.off()
         time.sleep(delay_s)
 
-    def sendCommand(self, steps, isReverse=False, mode=StepMode.FULL_STEP):
-        cmd = {"steps": steps, "isReverse": isReverse, "mode": mode}
+    def sendCommand(
+        self, steps, isReverse=False, mode=None, max_rate_hz=None, accel=None
+    ):
+        """Queue a move. Returns the command dict, whose "steps_done" count and "done" event
+        are updated by the stepper thread as the move runs. mode, max_rate_hz and accel
+        default to the values configured at construction. Raises ValueError for a step mode
+        the wiring can't select.
+        """
+        mode = self.step_mode if mode is None else mode
+        self.checkMode(mode)
+        cmd = {
+            "steps": steps,
+            "isReverse": isReverse,
+            "mode": mode,
+            "max_rate_hz": max_rate_hz or self.max_rate_hz,
+            "accel": accel or self.accel,
+            "steps_done": 0,
+            "done": threading.Event(),
+        }
         logger.debug(f"Enqueing cmd {cmd}")
         self.queue.put(cmd, timeout=1)
+        return cmd
 
     def sendStop(self):
         """Tell the stepper thread to stop what its doing"""
@@ -96,21 +203,33 @@ class StepperMotor(object):
         """Return whether or not stepper is currently doing something"""
         return self.is_active_flag.is_set()
 
+    def checkMode(self, mode):
+        """Raise ValueError if mode needs an MSx pin that isn't wired up"""
+        mask = 0x1
+        for pin in self.gpios_msx:
+            if mask & mode.value and pin is None:
+                raise ValueError(f"{mode} not available, MSx pins not all connected")
+            mask = mask << 1
+
     def setMode(self, mode):
         """
         Set the MS1,MS2, and MS3 bits appropriately. (Looks at bits 0,1,2 of mode value)
+        Unconnected pins are skipped (the driver pulls them low).
         """
 
         mask = 0x1
         for pin in self.gpios_msx:
-            if mask & mode.value:
-                pin.on()
-            else:
-                pin.off()
+            if pin is not None:
+                if mask & mode.value:
+                    pin.on()
+                else:
+                    pin.off()
 
             mask = mask << 1
 
-        print(f"{mode} ({mode.value}):{[g.is_active for g in self.gpios_msx]}")
+        logger.debug(
+            f"{mode} ({mode.value}): {[g.is_active for g in self.gpios_msx if g]}"
+        )
 
     def _run(self):
         """
@@ -131,21 +250,50 @@ class StepperMotor(object):
             else:
                 self.gpio_dir.off()
 
+            self.setMode(cmd["mode"])
             self.stop_event.clear()  # Clear any lingering stop events
             self.enableDriver()
             time.sleep(0.1)
 
-            for i in range(cmd["steps"]):
-                self.takeStep()
-                if self.stop_event.is_set():
-                    logger.info("Stepper thread got STOP command")
-                    break
+            # Plan in step pulses, report back in full steps
+            microsteps = cmd["mode"].microsteps
+            max_rate_hz = cmd["max_rate_hz"] * microsteps
+            if max_rate_hz > self.pulser.MAX_RATE_HZ:
+                logger.warning(
+                    f"Limiting step rate to {self.pulser.MAX_RATE_HZ}Hz (asked for {max_rate_hz}Hz)"
+                )
+                max_rate_hz = self.pulser.MAX_RATE_HZ
+            segments = plan_trapezoid(
+                cmd["steps"] * microsteps,
+                self.start_rate_hz * microsteps,
+                max_rate_hz,
+                cmd["accel"] * microsteps,
+            )
+
+            def on_step(pulses_done, cmd=cmd, microsteps=microsteps):
+                cmd["steps_done"] = pulses_done // microsteps
+
+            result = self.pulser.run(segments, self.stop_event, on_step)
+            result = result._replace(
+                steps_done=result.steps_done // microsteps,
+                requested_rate_hz=result.requested_rate_hz / microsteps,
+                achieved_rate_hz=result.achieved_rate_hz / microsteps,
+            )
+            self.last_result = result
+            if self.stop_event.is_set():
+                logger.info("Stepper thread got STOP command")
+            logger.info(
+                f"Stepped {result.steps_done} steps at {result.achieved_rate_hz:.1f}Hz "
+                f"(requested {result.requested_rate_hz:.1f}Hz, "
+                f"max lateness {1000 * result.max_lateness_s:.2f}ms, {result.resyncs} resyncs)"
+            )
 
             time.sleep(0.1)
 
             self.disableDriver()
 
             self.is_active_flag.clear()
+            cmd["done"].set()
             logger.info("Done with stepper cmd")
 
         logger.error("Stepper run thread exiting (uh-oh)")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Streaming statistics for the sensor pollers
+#
+# Everything here is updated one sample at a time in constant time, so it can run at the sensors'
+# sample rate without going back over the history.
+#
+
+import math
+import threading
+from collections import deque, namedtuple
+
+HOUR_S = 60 * 60
+DAY_S = 24 * HOUR_S
+WEEK_S = 7 * DAY_S
+
+
+class Ewma(object):
+    """
+    Exponentially weighted moving average with a time constant, rather than a fixed weight per sample,
+    so it means the same thing however often (or irregularly) the sensor is sampled.
+    """
+
+    def __init__(self, tau_s: float):
+        self.tau_s = tau_s
+        self.value = None
+        self.last_ms = None
+
+    def update(self, timestamp_ms: int, x: float) -> float:
+        if self.value is None:
+            self.value = x
+        else:
+            dt_s = max(timestamp_ms - self.last_ms, 0) / 1000
+            alpha = 1 - math.exp(-dt_s / self.tau_s)
+            self.value += alpha * (x - self.value)
+        self.last_ms = timestamp_ms
+        return self.value
+
+
+class Welford(object):
+    """Running mean and variance of everything seen so far (Welford's algorithm, numerically stable)"""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # Sum of squared differences from the mean
+
+    def update(self, x: float):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (0 until there are two samples)"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class RollingExtrema(object):
+    """
+    Min and max over the last window_s seconds, from two monotonic deques of (timestamp_ms, value).
+    A new sample drops every older one it beats from the back of each deque (they can never be the
+    min/max again), and samples that have left the window drop off the front. Each sample is added
+    and removed at most once, so updates are amortized constant time, and the deques only ever hold
+    the samples that could still become the min or max.
+    """
+
+    def __init__(self, window_s: float):
+        self.window_s = window_s
+        self.mins = deque()  # Increasing values
+        self.maxs = deque()  # Decreasing values
+
+    def update(self, timestamp_ms: int, x: float):
+        while self.mins and self.mins[-1][1] >= x:
+            self.mins.pop()
+        self.mins.append((timestamp_ms, x))
+        while self.maxs and self.maxs[-1][1] <= x:
+            self.maxs.pop()
+        self.maxs.append((timestamp_ms, x))
+
+        oldest_ms = timestamp_ms - 1000 * self.window_s
+        while self.mins[0][0] < oldest_ms:
+            self.mins.popleft()
+        while self.maxs[0][0] < oldest_ms:
+            self.maxs.popleft()
+
+    @property
+    def min(self):
+        """(timestamp_ms, value) of the smallest sample in the window, or None if there are none"""
+        return self.mins[0] if self.mins else None
+
+    @property
+    def max(self):
+        return self.maxs[0] if self.maxs else None
+
+
+WindowStats = namedtuple(
+    "WindowStats",
+    [
+        "window_s",
+        "min",  # (timestamp_ms, value) of the lowest sample in the window
+        "max",
+    ],
+)
+
+StatsSnapshot = namedtuple(
+    "StatsSnapshot",
+    [
+        "count",
+        "last",  # (timestamp_ms, value) of the newest sample, or None
+        "ewma",
+        "mean",  # Of every sample since startup
+        "std",
+        "rate_per_s",  # Smoothed rate of change, in units per second
+        "windows",  # List[WindowStats], shortest window first
+    ],
+)
+
+
+class SensorStats(object):
+    """
+    Incremental statistics for one sensor: an EWMA of the value, the all-time mean and standard
+    deviation, the min and max over each of windows_s, and a smoothed rate of change (an EWMA of
+    the slope between consecutive samples). update() is called with each new sample, and
+    snapshot() can be called from any thread.
+    """
+
+    def __init__(
+        self, windows_s=(HOUR_S, DAY_S, WEEK_S), ewma_tau_s=600, rate_tau_s=1800
+    ):
+        self.ewma = Ewma(ewma_tau_s)
+        self.welford = Welford()
+        self.extrema = [RollingExtrema(w) for w in sorted(windows_s)]
+        self.rate = Ewma(rate_tau_s)
+        self.last = None
+        self.lock = threading.Lock()
+
+    def update(self, timestamp_ms: int, x: float):
+        with self.lock:
+            if self.last is not None and timestamp_ms > self.last[0]:
+                slope = (x - self.last[1]) / ((timestamp_ms - self.last[0]) / 1000)
+                self.rate.update(timestamp_ms, slope)
+            self.last = (timestamp_ms, x)
+
+            self.ewma.update(timestamp_ms, x)
+            self.welford.update(x)
+            for extrema in self.extrema:
+                extrema.update(timestamp_ms, x)
+
+    def snapshot(self) -> StatsSnapshot:
+        with self.lock:
+            return StatsSnapshot(
+                count=self.welford.count,
+                last=self.last,
+                ewma=self.ewma.value,
+                mean=self.welford.mean,
+                std=self.welford.std,
+                rate_per_s=self.rate.value or 0.0,
+                windows=[WindowStats(e.window_s, e.min, e.max) for e in self.extrema],
+            )
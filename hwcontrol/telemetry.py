@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Telemetry recorder
+# Periodically logs the latest sensor readings to the telemetry store, from inside the server.
+#
+
+import atexit
+import datetime as dt
+import math
+import os
+import threading
+import time
+from loguru import logger
+
+from record_stats import append_telemetry_rows, TELEMETRY_CHANNELS
+from rollups import update_rollups
+from tsstore import migrate_csv, TimeSeriesStore
+
+
+class TelemetryRecorder(object):
+    """
+    Every interval_s, take the latest datum from each poller and queue up a telemetry row
+    (Timestamp, Temperature (F), pH). Rows are held in memory and appended to the store every
+    flush_interval_s (and at exit), so frequent recording doesn't mean frequent disk writes.
+
+    is_live(poller) says whether a poller's latest datum is a real, current reading. Channels whose
+    datum isn't (a stale reading, or a placeholder from a missing sensor) are recorded as NaN, and
+    no row is recorded when neither channel has one.
+    """
+
+    def __init__(
+        self,
+        filepath,
+        thermometerPoller,
+        phSensorPoller,
+        interval_s=60,
+        flush_interval_s=600,
+        is_live=lambda poller: True,
+    ):
+        self.filepath = filepath
+        self.thermometerPoller = thermometerPoller
+        self.phSensorPoller = phSensorPoller
+        self.is_live = is_live
+        self.interval_s = interval_s
+        self.flush_interval_s = flush_interval_s
+
+        self.rows = []
+        self.rows_lock = threading.Lock()
+
+        atexit.register(self.flush)
+        self.thread = threading.Thread(target=self._run, args=(), daemon=True)
+        self.thread.start()
+
+    def latest_value(self, poller) -> float:
+        """The poller's latest value, or NaN if it has no live reading"""
+        if not (poller.deque and self.is_live(poller)):
+            return math.nan
+        return poller.getLatestDatum()[1]
+
+    def record(self):
+        """Queue a row with the latest sensor data"""
+        temp_degC = self.latest_value(self.thermometerPoller)
+        ph = self.latest_value(self.phSensorPoller)
+        if math.isnan(temp_degC) and math.isnan(ph):
+            logger.debug("TELEMETRY: No live sensor data, skipping")
+            return
+        row = [
+            dt.datetime.now(),
+            round((temp_degC * 9.0) / 5.0 + 32.0, 2),
+            round(ph, 2),
+        ]
+        logger.debug(f"TELEMETRY: Queueing {row}")
+        with self.rows_lock:
+            self.rows.append(row)
+
+    def flush(self):
+        """Append any queued rows to the telemetry store"""
+        with self.rows_lock:
+            rows, self.rows = self.rows, []
+
+        if rows:
+            try:
+                append_telemetry_rows(self.filepath, rows)
+                logger.debug(f"TELEMETRY: Wrote {len(rows)} rows to {self.filepath}")
+            except OSError as e:
+                logger.error(f"Unable to write telemetry store! {e}")
+                with self.rows_lock:
+                    self.rows = rows + self.rows  # Try again next flush
+
+    def _run(self):
+        """
+        This method should run as in its own thread.
+        """
+        logger.info(
+            f"Starting telemetry recorder thread ({self.interval_s}s interval, writing to {self.filepath})"
+        )
+
+        # Schedule against the monotonic clock so the recording period doesn't drift
+        next_record = time.monotonic()
+        next_flush = next_record + self.flush_interval_s
+        while True:
+            self.record()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush += self.flush_interval_s
+
+            next_record += self.interval_s
+            time.sleep(max(next_record - time.monotonic(), 0))
+
+
+def migrate_legacy_telemetry(store_path, csv_path):
+    """
+    One-time copy of the old telemetry.csv into the telemetry store, if there's a CSV file and no
+    store yet. The CSV file is left where it is.
+    """
+    if os.path.exists(store_path) or not (csv_path and os.path.exists(csv_path)):
+        return
+    logger.info(f"Migrating telemetry from {csv_path} to {store_path}")
+    partial_path = store_path + ".partial"
+    if os.path.exists(partial_path):
+        os.remove(partial_path)  # Left by a migration that was cut short
+    with open(csv_path, newline="") as f:
+        header = f.readline().strip().split(",")
+    if header[1:] != TELEMETRY_CHANNELS:
+        logger.error(f"Not migrating {csv_path}: unexpected columns {header}")
+        return
+    migrate_csv(csv_path, partial_path)
+    os.replace(partial_path, store_path)
+
+    store = TimeSeriesStore(store_path)
+    try:
+        update_rollups(store)
+    finally:
+        store.close()
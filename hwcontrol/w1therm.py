@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# DS18B20 1-Wire thermometer access through the kernel w1_therm driver
+#
+#
+
+import glob
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger
+
+W1_DEVICES_DIR = "/sys/bus/w1/devices/"
+DS18B20_FAMILY = "28"
+
+# Worst case DS18B20 conversion time at each resolution
+CONVERSION_TIME_S = {9: 0.094, 10: 0.188, 11: 0.375, 12: 0.75}
+
+
+def parse_w1_slave(text: str):
+    """Parse w1_slave contents. Returns the temperature in degC, or None if the CRC check failed.
+
+    The file looks like:
+        72 01 4b 46 7f ff 0e 10 57 : crc=57 YES
+        72 01 4b 46 7f ff 0e 10 57 t=23125
+    """
+    lines = text.strip().splitlines()
+    if len(lines) < 2 or not lines[0].strip().endswith("YES"):
+        return None
+    equals_pos = lines[1].find("t=")
+    if equals_pos == -1:
+        return None
+    return float(lines[1][equals_pos + 2 :]) / 1000.0
+
+
+class W1Probe(object):
+    """
+    One DS18B20. The w1_slave file is opened once and re-read with os.pread(), since the sysfs
+    attribute regenerates its contents on every read from offset 0.
+    """
+
+    READ_SIZE = 128
+    MAX_CRC_RETRIES = 2
+
+    def __init__(self, device_dir, resolution_bits=None):
+        self.device_dir = device_dir
+        self.id = os.path.basename(device_dir.rstrip("/"))
+        self.crc_errors = 0
+
+        if resolution_bits is not None:
+            self.set_resolution(resolution_bits)
+
+        self.fd = os.open(os.path.join(device_dir, "w1_slave"), os.O_RDONLY)
+
+    def close(self):
+        os.close(self.fd)
+
+    def set_resolution(self, resolution_bits: int):
+        """Set the conversion resolution, if the driver supports it (needs write access to sysfs)"""
+        path = os.path.join(self.device_dir, "resolution")
+        if not os.path.exists(path):
+            logger.warning(
+                f"{self.id}: driver has no resolution attribute, leaving as is"
+            )
+            return
+        try:
+            with open(path, "w") as f:
+                f.write(str(resolution_bits))
+        except OSError as e:
+            logger.warning(f"{self.id}: unable to set resolution ({e})")
+
+    def get_resolution(self) -> int:
+        """Current resolution in bits (assumes the power on default of 12 if the driver can't say)"""
+        try:
+            with open(os.path.join(self.device_dir, "resolution")) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 12
+
+    def read(self):
+        """Read the temperature in degC. Returns None if the read failed, or every attempt failed the CRC check."""
+        for _ in range(1 + self.MAX_CRC_RETRIES):
+            try:
+                text = os.pread(self.fd, self.READ_SIZE, 0).decode("ascii", "replace")
+            except OSError as e:  # e.g. probe unplugged
+                logger.warning(f"{self.id}: read failed ({e})")
+                return None
+            temp_c = parse_w1_slave(text)
+            if temp_c is not None:
+                return temp_c
+            self.crc_errors += 1
+
+        logger.warning(f"{self.id}: CRC check failed {1 + self.MAX_CRC_RETRIES} times")
+        return None
+
+
+class W1ThermometerBank(object):
+    """
+    Every DS18B20 on the bus, read together so a sample cycle takes about one conversion time no
+    matter how many probes there are.
+
+    If the bus master has a therm_bulk_read attribute, one "trigger" write starts a conversion on
+    every probe at once, and the w1_slave reads that follow return the converted values straight
+    away. Otherwise each probe's read (which runs its own conversion) happens on its own thread.
+    """
+
+    BULK_POLL_PERIOD_S = 0.02
+
+    def __init__(self, devices_dir=W1_DEVICES_DIR, resolution_bits=None):
+        self.probes = [
+            W1Probe(d, resolution_bits)
+            for d in sorted(glob.glob(os.path.join(devices_dir, DS18B20_FAMILY + "-*")))
+        ]
+
+        bulk_paths = glob.glob(
+            os.path.join(devices_dir, "w1_bus_master*", "therm_bulk_read")
+        )
+        self.bulk_read_path = bulk_paths[0] if bulk_paths else None
+
+        self.conversion_time_s = max(
+            [CONVERSION_TIME_S.get(p.get_resolution(), 0.75) for p in self.probes],
+            default=0.75,
+        )
+
+        self.executor = None
+        if self.probes and self.bulk_read_path is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=len(self.probes), thread_name_prefix="w1therm"
+            )
+
+        logger.info(
+            f"Found {len(self.probes)} temperature probe(s): {[p.id for p in self.probes]} "
+            f"({'bulk' if self.bulk_read_path else 'concurrent'} conversion)"
+        )
+
+    def ids(self):
+        return [p.id for p in self.probes]
+
+    def close(self):
+        for p in self.probes:
+            p.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    def read_all(self):
+        """Convert and read every probe
+
+        Returns
+        -------
+        Dict[str, Optional[float]]
+            Probe id -> temperature in degC (None for a failed read)
+        """
+        if self.bulk_read_path is not None:
+            try:
+                return self._bulk_read()
+            except OSError as e:
+                logger.warning(
+                    f"Bulk conversion failed ({e}), reading probes individually"
+                )
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max(len(self.probes), 1), thread_name_prefix="w1therm"
+            )
+        results = self.executor.map(lambda p: p.read(), self.probes)
+        return dict(zip(self.ids(), results))
+
+    def _bulk_read(self):
+        with open(self.bulk_read_path, "w") as f:
+            f.write("trigger")
+
+        # Reads back -1 while any probe is still converting
+        deadline = time.monotonic() + 2 * self.conversion_time_s
+        time.sleep(self.conversion_time_s * 0.9)
+        while time.monotonic() < deadline:
+            with open(self.bulk_read_path) as f:
+                if f.read().strip() != "-1":
+                    break
+            time.sleep(self.BULK_POLL_PERIOD_S)
+
+        return {p.id: p.read() for p in self.probes}
@@ -14,27 +14,10 @@ from loguru import logger
 
 from hwcontrol_client import HardwareControlClient
 
-STEPS_PER_ML = 1000
-
-
-def ml_to_steps(ml: int) -> int:
-    """Convert from mL to number of stepper motor steps needed to dispense that volume.
-
-    Parameters
-    ----------
-    ml : int
-        Desired volume in mL
-
-    Returns
-    -------
-    int
-        Needed stepper motor steps
-    """
-    return int(STEPS_PER_ML * ml)
-
 
 def dispense(hwCntrl, volume_ml: int, stop_event: threading.Event):
-    """Blocking call to dispense a certain number of mL
+    """Blocking call to dispense a certain number of mL. The server runs the dispense (including turning
+    the tank lights off and back on); this just follows its progress.
 
     Parameters
     ----------
@@ -46,38 +29,22 @@ def dispense(hwCntrl, volume_ml: int, stop_event: threading.Event):
         When event is set, function will send a STOP event to stepper controller and wait for stepper to report it did stop
     """
 
-    logger.info("Turning off tank lights for pump")
-    # Just manually disable the enable relay for tnk lights... this should be smarter.
-    # Shh I am ashamed. This should really be handled on server side
-
-    cached_states = hwCntrl.getRelayStates()
-    hwCntrl.setRelayState(5, False)  # Tank Light 1
-    hwCntrl.setRelayState(7, False)  # Tank Light 2
+    logger.info(f"Sending request to dispense {volume_ml} mL")
 
-    time.sleep(0.5)
-
-    total_nsteps = ml_to_steps(volume_ml)
-    logger.info(f"Sending request to step {total_nsteps} for {volume_ml} mL")
-
-    logger.info(f"Sending request to step {total_nsteps}")
-    hwCntrl.moveStepper(total_nsteps)
-
-    while hwCntrl.getIsStepperActive():
+    progress = None
+    for progress in hwCntrl.dispense(volume_ml):
+        logger.debug(
+            f"Dispense {progress.state}: {progress.steps_done}/{progress.steps_total} steps, ETA {progress.eta_s:.1f}s"
+        )
         if stop_event.is_set():
             logger.info("Dispense got stop flag early!")
             hwCntrl.stopStepper()
-            stop_event.clear()  # So this doesn't keep retriggering, but we'll wait in this loop until stepper actually says it has stopped
+            stop_event.clear()  # So this doesn't keep retriggering, but we'll wait until server says it has stopped
 
-        time.sleep(0.2)
-
-    logger.info("Command complete")
-    time.sleep(1)  # Allow some time for ongoing dispense to finish
-
-    # renable the lights
-    logger.info("Reenabling lights")
-
-    hwCntrl.setRelayState(5, cached_states[4])  # Tank Light 1
-    hwCntrl.setRelayState(7, cached_states[6])  # Tank Light 2
+    if progress is not None:
+        logger.info(
+            f"Dispense {progress.state} ({progress.steps_done}/{progress.steps_total} steps)"
+        )
 
 
 if __name__ == "__main__":
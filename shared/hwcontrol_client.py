@@ -5,7 +5,12 @@
 #
 #
 
-from typing import List
+from typing import Callable, Dict, Iterator, List, Tuple
+from collections import namedtuple
+import datetime
+import threading
+import grpc
+from loguru import logger
 import hardwareControl_pb2
 import hardwareControl_pb2_grpc
 
@@ -28,6 +33,246 @@ def color_name_to_enum(color: str) -> hardwareControl_pb2.LightColorEnum:
     return ColorMap[color]  # This will throw KeyError if color str is invalid
 
 
+SensorMap = {
+    "temperature": hardwareControl_pb2.Sensor_Temperature,
+    "ph": hardwareControl_pb2.Sensor_PH,
+    "ec": hardwareControl_pb2.Sensor_EC,
+    "orp": hardwareControl_pb2.Sensor_ORP,
+    "do": hardwareControl_pb2.Sensor_DO,
+    "rtd": hardwareControl_pb2.Sensor_RTD,
+}
+
+
+def sensor_enum_to_name(e: hardwareControl_pb2.SensorType) -> str:
+    for sensor_name, sensor_enum in SensorMap.items():
+        if e == sensor_enum:
+            return sensor_name
+
+    return "???"
+
+
+def timestamp_to_datetime(ts) -> datetime.datetime:
+    """Convert a protobuf Timestamp to a naive datetime in local time"""
+    return datetime.datetime.fromtimestamp(ts.seconds + ts.nanos / 1e9)
+
+
+def unpack_sensor_reading(reading) -> Tuple[str, datetime.datetime, float]:
+    return (
+        sensor_enum_to_name(reading.sensor),
+        timestamp_to_datetime(reading.timestamp),
+        reading.value,
+    )
+
+
+class StreamSubscription(object):
+    """
+    Keeps a server-streaming call open from a background thread, calling on_item(item) for every
+    item it yields. If the stream ends or fails (server restarted, UNAVAILABLE, ...) it's reopened,
+    backing off from min_backoff_s to max_backoff_s between attempts, until cancel() is called.
+
+    on_connection_change(connected), if given, is called with True when the first item arrives on
+    a (re)opened stream, and with False when it drops. Both callbacks run on the subscription
+    thread, NOT the caller's thread.
+    """
+
+    def __init__(
+        self,
+        open_call: Callable,
+        on_item: Callable,
+        on_connection_change: Callable[[bool], None] = None,
+        name="Stream",
+        min_backoff_s=1.0,
+        max_backoff_s=30.0,
+    ):
+        self.open_call = open_call
+        self.on_item = on_item
+        self.on_connection_change = on_connection_change
+        self.name = name
+        self.min_backoff_s = min_backoff_s
+        self.max_backoff_s = max_backoff_s
+
+        self.connected = False
+        self.call = None
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            if self.call is not None:
+                self.call.cancel()
+
+    def _set_connected(self, connected: bool):
+        if connected == self.connected:
+            return
+        self.connected = connected
+        if self.on_connection_change is not None:
+            self.on_connection_change(connected)
+
+    def _run(self):
+        backoff_s = self.min_backoff_s
+        while not self.cancelled.is_set():
+            with self.lock:
+                if self.cancelled.is_set():
+                    break
+                self.call = self.open_call()
+            try:
+                for item in self.call:
+                    if not self.connected:
+                        logger.info(f"{self.name} subscription connected")
+                        self._set_connected(True)
+                        backoff_s = self.min_backoff_s
+                    self.on_item(item)
+                if not self.cancelled.is_set():
+                    logger.warning(f"{self.name} subscription ended by the server")
+            except grpc.RpcError as rpc_error:
+                if self.cancelled.is_set():
+                    break
+                logger.error(
+                    f"{self.name} subscription dropped! {rpc_error.code()}, retrying in {backoff_s:.0f}s"
+                )
+            self._set_connected(False)
+            self.cancelled.wait(backoff_s)
+            backoff_s = min(backoff_s * 2, self.max_backoff_s)
+        self._set_connected(False)
+
+
+AlarmEvent = namedtuple(
+    "AlarmEvent",
+    [
+        "name",  # The alarm rule's name, from the server config
+        "sensor",  # One of SensorMap keys
+        "active",  # True when the alarm raises, False when it clears
+        "level",  # "high" or "low": which threshold was crossed
+        "value",  # The reading that raised/cleared it (temperature in degrees C)
+        "threshold",
+        "timestamp",  # When that reading was taken
+        "message",
+    ],
+)
+
+
+def unpack_alarm_event(event) -> AlarmEvent:
+    return AlarmEvent(
+        name=event.name,
+        sensor=sensor_enum_to_name(event.sensor),
+        active=event.active,
+        level=event.level,
+        value=event.value,
+        threshold=event.threshold,
+        timestamp=timestamp_to_datetime(event.timestamp),
+        message=event.message,
+    )
+
+
+SystemSnapshot = namedtuple(
+    "SystemSnapshot",
+    [
+        "timestamp",  # When the server took the snapshot
+        "temperature_degC",
+        "temperature_timestamp",  # When the temperature was sampled
+        "ph",
+        "ph_timestamp",  # When the pH was sampled
+        "relay_states",  # List[bool], same as getRelayStates()
+        "light_colors",  # List[str], same as getLightColors()
+        "stepper_active",
+        "ph_sample_time_ms",
+        "temperature_sample_time_ms",
+        "temperature_is_stale",  # No new temperature sample for several sample times
+        "ph_is_stale",
+    ],
+)
+
+
+SensorStatus = namedtuple(
+    "SensorStatus",
+    [
+        "value",  # Temperature in degC, pH unitless
+        "timestamp",  # When it was sampled (None if the server has no reading yet)
+        "age_s",
+        "is_stale",  # No new sample for several sample times: the sensor is failing or restarting
+    ],
+)
+
+
+SensorStats = namedtuple(
+    "SensorStats",
+    [
+        "count",  # Samples since the server started. The rest are None if 0
+        "last",
+        "last_timestamp",
+        "ewma",  # Exponentially weighted moving average (10 minute time constant)
+        "mean",  # Of every sample since the server started
+        "std",
+        "rate_per_hour",  # Smoothed rate of change
+        "windows",  # Dict[int, WindowStats]: window length (s) -> min/max over the last window_s seconds
+    ],
+)
+
+WindowStats = namedtuple(
+    "WindowStats", ["min", "min_timestamp", "max", "max_timestamp"]
+)
+
+
+PollerHealth = namedtuple(
+    "PollerHealth",
+    [
+        "name",
+        "healthy",
+        "samples",
+        "errors",
+        "consecutive_errors",
+        "skipped",  # Deadlines missed because the previous sample was still running
+        "restarts",
+        "mean_latency_ms",  # How late samples start vs their deadlines
+        "max_latency_ms",
+        "mean_duration_ms",
+        "max_duration_ms",
+        "last_error",
+        "last_success_age_s",  # None if there hasn't been a successful sample yet
+    ],
+)
+
+
+DispenseStateMap = {
+    "starting": hardwareControl_pb2.Dispense_Starting,
+    "running": hardwareControl_pb2.Dispense_Running,
+    "complete": hardwareControl_pb2.Dispense_Complete,
+    "cancelled": hardwareControl_pb2.Dispense_Cancelled,
+}
+
+
+def dispense_state_enum_to_name(e: hardwareControl_pb2.DispenseState) -> str:
+    for state_name, state_enum in DispenseStateMap.items():
+        if e == state_enum:
+            return state_name
+
+    return "???"
+
+
+StepModeMap = {
+    "full": hardwareControl_pb2.StepMode_Full,
+    "half": hardwareControl_pb2.StepMode_Half,
+    "quarter": hardwareControl_pb2.StepMode_Quarter,
+    "eighth": hardwareControl_pb2.StepMode_Eighth,
+    "sixteenth": hardwareControl_pb2.StepMode_Sixteenth,
+}
+
+
+DispenseProgress = namedtuple(
+    "DispenseProgress",
+    [
+        "state",  # One of DispenseStateMap keys
+        "volume_ml",
+        "steps_done",
+        "steps_total",
+        "eta_s",  # Estimated time until pumping is done. 0 if not yet known
+    ],
+)
+
+
 class HardwareControlClient:
     def __init__(self, channel):
         self.stub = hardwareControl_pb2_grpc.HardwareControlStub(channel)
@@ -46,6 +291,21 @@ class HardwareControlClient:
         response = self.stub.GetTemperature(hardwareControl_pb2.Empty())
         return (response.temperature_degC * 9.0) / 5.0 + 32.0
 
+    def getProbeTemperatures_degC(self) -> Dict[str, Tuple[datetime.datetime, float]]:
+        """
+        Get the latest reading from every temperature probe
+
+        Returns
+        -------
+        Dict[str, Tuple[datetime.datetime, float]]
+            Probe id -> (timestamp, degrees C)
+        """
+        response = self.stub.GetTemperature(hardwareControl_pb2.Empty())
+        return {
+            p.id: (timestamp_to_datetime(p.timestamp), p.temperature_degC)
+            for p in response.probes
+        }
+
     def getPH(self) -> float:
         """
         Get the latest pH reading.
@@ -53,6 +313,241 @@ class HardwareControlClient:
         response = self.stub.GetPH(hardwareControl_pb2.Empty())
         return response.pH
 
+    def getTemperatureStatus(self) -> SensorStatus:
+        """
+        Get the latest temperature reading (degrees C), with when it was sampled and whether it's stale
+        """
+        response = self.stub.GetTemperature(hardwareControl_pb2.Empty())
+        return SensorStatus(
+            value=response.temperature_degC,
+            timestamp=(
+                timestamp_to_datetime(response.timestamp)
+                if response.HasField("timestamp")
+                else None
+            ),
+            age_s=response.age_sec,
+            is_stale=response.is_stale,
+        )
+
+    def getPHStatus(self) -> SensorStatus:
+        """
+        Get the latest pH reading, with when it was sampled and whether it's stale
+        """
+        response = self.stub.GetPH(hardwareControl_pb2.Empty())
+        return SensorStatus(
+            value=response.pH,
+            timestamp=(
+                timestamp_to_datetime(response.timestamp)
+                if response.HasField("timestamp")
+                else None
+            ),
+            age_s=response.age_sec,
+            is_stale=response.is_stale,
+        )
+
+    def getSensorStats(self, sensor_name: str) -> SensorStats:
+        """Get a sensor's running statistics (mean, spread, trend, min/max over the last hour/day/week).
+        The server keeps them up to date as it samples, so this is cheap to call.
+
+        Parameters
+        ----------
+        sensor_name : str
+            One of SensorMap keys, e.g. 'temperature' or 'ph'
+
+        Returns
+        -------
+        SensorStats
+            Temperature values are in degrees C
+        """
+        response = self.stub.GetSensorStats(
+            hardwareControl_pb2.SensorStatsRequest(sensor=SensorMap[sensor_name])
+        )
+        if response.count == 0:
+            return SensorStats(0, None, None, None, None, None, None, {})
+        return SensorStats(
+            count=response.count,
+            last=response.last,
+            last_timestamp=timestamp_to_datetime(response.last_timestamp),
+            ewma=response.ewma,
+            mean=response.mean,
+            std=response.std,
+            rate_per_hour=response.rate_per_hour,
+            windows={
+                w.window_sec: WindowStats(
+                    min=w.min,
+                    min_timestamp=timestamp_to_datetime(w.min_timestamp),
+                    max=w.max,
+                    max_timestamp=timestamp_to_datetime(w.max_timestamp),
+                )
+                for w in response.windows
+            },
+        )
+
+    def getPollerHealth(self) -> List[PollerHealth]:
+        """Sample counts, errors, latency and restarts of each of the server's sensor pollers"""
+        response = self.stub.GetPollerHealth(hardwareControl_pb2.Empty())
+        return [
+            PollerHealth(
+                name=p.name,
+                healthy=p.healthy,
+                samples=p.samples,
+                errors=p.errors,
+                consecutive_errors=p.consecutive_errors,
+                skipped=p.skipped,
+                restarts=p.restarts,
+                mean_latency_ms=p.mean_latency_msec,
+                max_latency_ms=p.max_latency_msec,
+                mean_duration_ms=p.mean_duration_msec,
+                max_duration_ms=p.max_duration_msec,
+                last_error=p.last_error,
+                last_success_age_s=(
+                    p.last_success_age_sec if p.last_success_age_sec >= 0 else None
+                ),
+            )
+            for p in response.pollers
+        ]
+
+    def subscribeSensors(self) -> Iterator[Tuple[str, datetime.datetime, float]]:
+        """Generator yielding (sensor_name, timestamp, value) every time the server has a new sensor reading.
+        The latest reading of each sensor is yielded first. Temperature values are in degrees C.
+        Blocks between readings, so iterate from a thread that can afford to wait.
+        """
+        for reading in self.stub.SubscribeSensors(hardwareControl_pb2.Empty()):
+            yield unpack_sensor_reading(reading)
+
+    def startSensorSubscription(
+        self,
+        callback: Callable[[str, datetime.datetime, float], None],
+        on_connection_change: Callable[[bool], None] = None,
+    ) -> StreamSubscription:
+        """Call callback(sensor_name, timestamp, value) from a background thread for every new sensor reading.
+        The subscription is reopened (with backoff) if the server goes away.
+
+        Parameters
+        ----------
+        callback : Callable[[str, datetime.datetime, float], None]
+            Called once per reading. Runs on the subscription thread, NOT the caller's thread.
+        on_connection_change : Callable[[bool], None], optional
+            Called with False when the subscription drops, and True once readings arrive again.
+
+        Returns
+        -------
+        StreamSubscription
+            Call .cancel() on it to end the subscription.
+        """
+        return StreamSubscription(
+            lambda: self.stub.SubscribeSensors(hardwareControl_pb2.Empty()),
+            lambda reading: callback(*unpack_sensor_reading(reading)),
+            on_connection_change,
+            name="Sensor",
+        )
+
+    def watchAlarms(self) -> Iterator[AlarmEvent]:
+        """Generator yielding an AlarmEvent every time one of the server's alarms raises or clears.
+        Every alarm that's already active is yielded first.
+        Blocks between events, so iterate from a thread that can afford to wait.
+        """
+        for event in self.stub.WatchAlarms(hardwareControl_pb2.Empty()):
+            yield unpack_alarm_event(event)
+
+    def startAlarmWatch(self, callback: Callable[[AlarmEvent], None]):
+        """Call callback(event) from a background thread every time an alarm raises or clears.
+
+        Parameters
+        ----------
+        callback : Callable[[AlarmEvent], None]
+            Called once per event. Runs on the watch thread, NOT the caller's thread.
+
+        Returns
+        -------
+        grpc.Call
+            The streaming call. Call .cancel() on it to stop watching.
+        """
+        call = self.stub.WatchAlarms(hardwareControl_pb2.Empty())
+
+        def run():
+            try:
+                for event in call:
+                    callback(unpack_alarm_event(event))
+            except grpc.RpcError as rpc_error:
+                if rpc_error.code() != grpc.StatusCode.CANCELLED:
+                    logger.error(f"Alarm watch ended! {rpc_error.code()}")
+
+        threading.Thread(target=run, daemon=True).start()
+        return call
+
+    def getSnapshot(self) -> SystemSnapshot:
+        """Get all sensor, relay, light and stepper state in one round trip.
+        All values are read by the server at the same moment, so they are consistent with each other.
+        """
+        response = self.stub.GetSystemSnapshot(hardwareControl_pb2.Empty())
+        return SystemSnapshot(
+            timestamp=timestamp_to_datetime(response.timestamp),
+            temperature_degC=response.temperature.value,
+            temperature_timestamp=timestamp_to_datetime(response.temperature.timestamp),
+            ph=response.ph.value,
+            ph_timestamp=timestamp_to_datetime(response.ph.timestamp),
+            relay_states=[r.isEngaged for r in response.relays],
+            light_colors=[color_enum_to_name(c.color_enum) for c in response.lights],
+            stepper_active=response.stepper_active,
+            ph_sample_time_ms=response.ph_sample_time_msec,
+            temperature_sample_time_ms=response.temperature_sample_time_msec,
+            temperature_is_stale=response.temperature.is_stale,
+            ph_is_stale=response.ph.is_stale,
+        )
+
+    def getAtlasReadings(self) -> Dict[str, Tuple[datetime.datetime, float]]:
+        """
+        Get the latest reading from every Atlas circuit the server found
+
+        Returns
+        -------
+        Dict[str, Tuple[datetime.datetime, float]]
+            Sensor name (one of SensorMap keys) -> (timestamp, value)
+        """
+        response = self.stub.GetAtlasReadings(hardwareControl_pb2.Empty())
+        return {
+            sensor_enum_to_name(r.sensor): (timestamp_to_datetime(r.timestamp), r.value)
+            for r in response.readings
+        }
+
+    def getSensorHistory(
+        self,
+        sensor_name: str,
+        start: datetime.datetime,
+        end: datetime.datetime = None,
+        max_points: int = 0,
+    ) -> Tuple[List[datetime.datetime], List[float]]:
+        """Get recent samples of a sensor from the server's in-memory history.
+
+        Parameters
+        ----------
+        sensor_name : str
+            One of ['temperature', 'ph']
+        start : datetime.datetime
+            Earliest sample to return
+        end : datetime.datetime, optional
+            Latest sample to return, by default now
+        max_points : int, optional
+            Have the server average the samples down to this many points, by default 0 (no limit)
+
+        Returns
+        -------
+        Tuple[List[datetime.datetime], List[float]]
+            Sample timestamps and values, oldest first. Temperature values are in degrees C.
+        """
+        request = hardwareControl_pb2.SensorHistoryRequest(
+            sensor=SensorMap[sensor_name], max_points=max_points
+        )
+        request.start.FromMicroseconds(int(start.timestamp() * 1e6))
+        if end is not None:
+            request.end.FromMicroseconds(int(end.timestamp() * 1e6))
+        response = self.stub.GetSensorHistory(request)
+        timestamps = [
+            datetime.datetime.fromtimestamp(t / 1000) for t in response.timestamps_ms
+        ]
+        return timestamps, list(response.values)
+
     def echo(self, payload="Test123") -> None:
         """
         Send and receive a loopback test of given string.
@@ -95,6 +590,28 @@ class HardwareControlClient:
             )
         )
 
+    def setLightColors(self, colors: Dict[int, str], scope: str = "") -> None:
+        """Set several lights at once, in a single request. The server changes them all together.
+
+        Parameters
+        ----------
+        colors : Dict[int, str]
+            Map of lightId to one of ['off', 'white', 'blue']
+        scope : str, optional
+            Command scope, by default ""
+        """
+        _ = self.stub.SetLightColors(
+            hardwareControl_pb2.LightColors(
+                colors=[
+                    hardwareControl_pb2.LightColor(
+                        lightId=lightId, color_enum=color_name_to_enum(color_name)
+                    )
+                    for lightId, color_name in colors.items()
+                ],
+                scope=scope,
+            )
+        )
+
     def getLightColors(self) -> List[str]:
         """Get all light colors and return as list of strings.
             Unpack from GRPC object and return as native Python list.
@@ -107,12 +624,38 @@ class HardwareControlClient:
         response = self.stub.GetLightColors(hardwareControl_pb2.Empty())
         return [color_enum_to_name(r.color_enum) for r in response.colors]
 
-    def moveStepper(self, numSteps: int, isReverse: bool = False) -> None:
+    def moveStepper(
+        self,
+        numSteps: int,
+        isReverse: bool = False,
+        max_rate_hz: float = 0,
+        accel: float = 0,
+        step_mode: str = "",
+    ) -> None:
         """
         Move stepper motor specified number of steps
+
+        Parameters
+        ----------
+        numSteps : int
+            Number of full steps to move
+        isReverse : bool
+            Run the motor backwards
+        max_rate_hz : float
+            Cruising rate in full steps/s. 0 means use the server's configured rate.
+        accel : float
+            Ramp acceleration in full steps/s^2. 0 means use the server's configured value.
+        step_mode : str
+            One of StepModeMap's keys ("full", "half", ...). Empty means use the server's configured mode.
         """
         _ = self.stub.MoveStepper(
-            hardwareControl_pb2.StepperCommand(numSteps=numSteps, isReverse=isReverse)
+            hardwareControl_pb2.StepperCommand(
+                numSteps=numSteps,
+                isReverse=isReverse,
+                max_rate_hz=max_rate_hz,
+                accel=accel,
+                step_mode=StepModeMap[step_mode] if step_mode else 0,
+            )
         )
 
     def stopStepper(self) -> None:
@@ -124,6 +667,21 @@ class HardwareControlClient:
         response = self.stub.IsStepperActive(hardwareControl_pb2.Empty())
         return response.isActive
 
+    def dispense(self, volume_ml: float) -> Iterator[DispenseProgress]:
+        """Have the server dispense the given volume. Generator yielding progress updates until the dispense
+        completes or is cancelled (see stopStepper()). Light interlocking is handled by the server.
+        """
+        for progress in self.stub.Dispense(
+            hardwareControl_pb2.DispenseRequest(volume_ml=volume_ml)
+        ):
+            yield DispenseProgress(
+                state=dispense_state_enum_to_name(progress.state),
+                volume_ml=progress.volume_ml,
+                steps_done=progress.steps_done,
+                steps_total=progress.steps_total,
+                eta_s=progress.eta_sec,
+            )
+
     def setScope(self, scope="") -> None:
         """Set the Light Control scope."""
         _ = self.stub.SetScope(hardwareControl_pb2.Scope(scope=scope))
@@ -138,6 +696,16 @@ class HardwareControlClient:
         response = self.stub.GetPHSampleTime(hardwareControl_pb2.Empty())
         return response.sample_time_msec
 
+    def setTemperatureSensorSampleTime(self, time_msec: int) -> None:
+        """time of 0 = return to default"""
+        _ = self.stub.SetTemperatureSampleTime(
+            hardwareControl_pb2.SampleTime(sample_time_msec=time_msec)
+        )
+
+    def getTemperatureSensorSampleTime_ms(self) -> int:
+        response = self.stub.GetTemperatureSampleTime(hardwareControl_pb2.Empty())
+        return response.sample_time_msec
+
     def sendPhSensorCommand(self, cmd: str) -> str:
         response = self.stub.SendPHCommand(hardwareControl_pb2.PHCommand(cmd=cmd))
         return response.response
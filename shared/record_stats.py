@@ -2,23 +2,26 @@
 
 """
 This script is responsible for logging tank stats (temperature, pH) to a running log file.
-This function should be invoked by a cron job or similar
+The hwcontrol server records telemetry itself (see hwcontrol/telemetry.py); this script is kept for one-off
+manual recording, and provides the shared file writer.
 """
 
 import grpc
-import csv
 import datetime
-import os
 import argparse
 from loguru import logger
 from hwcontrol_client import HardwareControlClient
+from tsstore import TimeSeriesStore
+from rollups import update_rollups
+
+TELEMETRY_CHANNELS = ["Temperature (F)", "pH"]
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Append telemetry data to running log file."
     )
-    parser.add_argument("filepath", help="File to append to.")
+    parser.add_argument("filepath", help="Telemetry store (.tss) to append to.")
 
     args = parser.parse_args()
 
@@ -26,32 +29,48 @@ def main():
     with grpc.insecure_channel("localhost:50051") as channel:
         hwCntrl = HardwareControlClient(channel)
         try:
-            the_temp_F = hwCntrl.getTemperature_degF()
-            the_pH = hwCntrl.getPH()
+            snapshot = hwCntrl.getSnapshot()
+            the_temp_F = (snapshot.temperature_degC * 9.0) / 5.0 + 32.0
+            the_pH = snapshot.ph
         except grpc.RpcError as rpc_error:
             logger.error(f"Unable to connect to server! {rpc_error.code()}")
             exit()  # Just quit, don't bother adding anything to log file
 
     # Now append to running log file...
-
-    # Check if file exists already - if not, we will add a column header.
-    if os.path.isfile(args.filepath):
-        add_header = False
-    else:
-        logger.info("File does not exist! Will add header.")
-        add_header = True
-
-    with open(args.filepath, "a", newline="") as statsfile:
-        csvwriter = csv.writer(statsfile, delimiter=",")
-        if add_header:
-            csvwriter.writerow(["Timestamp", "Temperature (F)", "pH"])
-        csvwriter.writerow(
+    append_telemetry_rows(
+        args.filepath,
+        [
             [
-                datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                datetime.datetime.now(),
                 round(the_temp_F, 2),
                 round(the_pH, 2),
             ]
-        )
+        ],
+    )
+
+
+def append_telemetry_rows(filepath: str, rows: list):
+    """Append rows of [datetime, temperature (F), pH] to the telemetry store,
+    creating it if it doesn't exist yet, and bring its rollups up to date.
+    Rows from before the last one stored are dropped.
+    """
+    store = TimeSeriesStore(filepath, channels=TELEMETRY_CHANNELS)
+    try:
+        last_ms = store.last_timestamp_ms
+        timestamps_ms, values = [], []
+        for row in sorted(rows, key=lambda row: row[0]):
+            timestamp_ms = int(row[0].timestamp() * 1000)
+            if last_ms is not None and timestamp_ms < last_ms:
+                logger.warning(
+                    f"Dropping telemetry row {row}: earlier than the last one stored"
+                )
+                continue
+            timestamps_ms.append(timestamp_ms)
+            values.append(row[1:])
+        store.append(timestamps_ms, values)
+        update_rollups(store)
+    finally:
+        store.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Hourly/daily/weekly rollups of a telemetry store
+#
+# Each rollup is a store of its own next to the raw one (telemetry.tss -> telemetry.hour.tss etc.), with one
+# record per completed bucket: the bucket's start time, then min/mean/max of each raw channel and the number of
+# records in the bucket. Buckets are aligned to the epoch, so to UTC midnight for days and Thursdays for weeks.
+#
+# The writer calls update_rollups() after appending to the raw store, which only aggregates the buckets that have
+# completed since the last update. Readers get the stored buckets, plus the bucket(s) still in progress (or any
+# the rollup is missing) aggregated from the raw store on the fly.
+#
+
+import os
+from collections import namedtuple
+import numpy as np
+from loguru import logger
+
+from tsstore import TimeSeriesStore
+
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+WEEK_MS = 7 * DAY_MS
+
+RESOLUTIONS = {"hour": HOUR_MS, "day": DAY_MS, "week": WEEK_MS}
+
+STATS = ("min", "mean", "max")
+
+# Raw records aggregated at a time when catching up, to bound memory use
+CHUNK_RECORDS = 1 << 20
+
+Buckets = namedtuple(
+    "Buckets",
+    [
+        "start_ms",  # Start of each bucket, shape (n,)
+        "min",  # Shape (n, channels)
+        "mean",
+        "max",
+        "count",  # Raw records in each bucket, shape (n,)
+    ],
+)
+
+
+def rollup_path(store_path: str, name: str) -> str:
+    base, ext = os.path.splitext(store_path)
+    return f"{base}.{name}{ext}"
+
+
+def rollup_channels(channels) -> list:
+    return [f"{c} {stat}" for c in channels for stat in STATS] + ["count"]
+
+
+def floor_ms(timestamp_ms: int, width_ms: int) -> int:
+    return (timestamp_ms // width_ms) * width_ms
+
+
+def aggregate(timestamps_ms, values, width_ms: int) -> Buckets:
+    """Min/mean/max of values over each width_ms bucket that has any records (timestamps_ms in order).
+    NaN values are left out of each channel's stats.
+    """
+    n_channels = values.shape[1]
+    if len(timestamps_ms) == 0:
+        empty = np.zeros((0, n_channels), dtype=np.float32)
+        none = np.zeros(0, dtype=np.int64)
+        return Buckets(none, empty, empty, empty, none)
+
+    bucket_ms = (timestamps_ms // width_ms) * width_ms
+    starts = np.flatnonzero(np.r_[True, bucket_ms[1:] != bucket_ms[:-1]])
+    valid = ~np.isnan(values)
+    n_valid = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (
+            np.add.reduceat(
+                np.where(valid, values, 0), starts, axis=0, dtype=np.float64
+            )
+            / n_valid
+        )
+    return Buckets(
+        start_ms=bucket_ms[starts],
+        min=np.fmin.reduceat(values, starts, axis=0),
+        mean=mean.astype(np.float32),
+        max=np.fmax.reduceat(values, starts, axis=0),
+        count=np.diff(np.r_[starts, len(timestamps_ms)]),
+    )
+
+
+def concat(a: Buckets, b: Buckets) -> Buckets:
+    return Buckets(*(np.concatenate((x, y)) for x, y in zip(a, b)))
+
+
+class Rollup(object):
+    """
+    One resolution of rollup for a raw store. Readers open it with writable=False, and get on-the-fly
+    aggregation of the whole raw store until the rollup file exists.
+    """
+
+    def __init__(self, raw: TimeSeriesStore, name: str, width_ms: int, writable=False):
+        self.raw = raw
+        self.name = name
+        self.width_ms = width_ms
+        self.path = rollup_path(raw.path, name)
+        self.store = None
+        if writable:
+            self.store = TimeSeriesStore(
+                self.path, channels=rollup_channels(raw.channels)
+            )
+        else:
+            self.open()
+
+    def open(self):
+        """Open the rollup file, if it exists now"""
+        if self.store is not None or not os.path.exists(self.path):
+            return
+        store = TimeSeriesStore(self.path)
+        if store.channels != rollup_channels(self.raw.channels):
+            store.close()
+            raise ValueError(
+                f"{self.path} doesn't match the channels in {self.raw.path}"
+            )
+        self.store = store
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+    def covered_until_ms(self):
+        """End of the last bucket in the rollup file, or None if it has none"""
+        self.open()
+        if self.store is None:
+            return None
+        self.store.refresh()
+        if not len(self.store):
+            return None
+        return self.store.last_timestamp_ms + self.width_ms
+
+    def update(self):
+        """Add any buckets that have completed since the last update. Writer only."""
+        self.raw.refresh()
+        if not len(self.raw):
+            return
+        start_ms = self.covered_until_ms()
+        if start_ms is None:
+            start_ms = floor_ms(self.raw.first_timestamp_ms, self.width_ms)
+        # The bucket the last raw record is in may still get more records
+        end_ms = floor_ms(self.raw.last_timestamp_ms, self.width_ms)
+
+        added = 0
+        while start_ms < end_ms:
+            chunk_end_ms = end_ms
+            i = self.raw.search(start_ms) + CHUNK_RECORDS
+            if i < len(self.raw):
+                chunk_end_ms = max(
+                    min(floor_ms(int(self.raw.records["t"][i]), self.width_ms), end_ms),
+                    start_ms + self.width_ms,
+                )
+            timestamps_ms, values = self.raw.query(start_ms, chunk_end_ms - 1)
+            buckets = aggregate(timestamps_ms, values, self.width_ms)
+            self.store.append(buckets.start_ms, self.pack(buckets))
+            added += len(buckets.start_ms)
+            start_ms = chunk_end_ms
+        if added:
+            logger.debug(f"Added {added} {self.name} rollup buckets")
+
+    @staticmethod
+    def pack(buckets: Buckets) -> np.ndarray:
+        """Rollup file records from Buckets: (min, mean, max) per channel, then count"""
+        n, n_channels = buckets.min.shape
+        stats = np.stack((buckets.min, buckets.mean, buckets.max), axis=2).reshape(
+            n, 3 * n_channels
+        )
+        return np.column_stack((stats, buckets.count))
+
+    @staticmethod
+    def unpack(start_ms, records) -> Buckets:
+        n = len(start_ms)
+        stats = records[:, :-1].reshape(n, (records.shape[1] - 1) // 3, 3)
+        return Buckets(
+            start_ms,
+            stats[:, :, 0],
+            stats[:, :, 1],
+            stats[:, :, 2],
+            records[:, -1].astype(np.int64),
+        )
+
+    def query(self, start_ms: int, end_ms: int) -> Buckets:
+        """Buckets overlapping start_ms to end_ms (inclusive), including any still in progress"""
+        start_ms = floor_ms(start_ms, self.width_ms)
+        covered_ms = self.covered_until_ms()
+        if covered_ms is None:
+            covered_ms = start_ms
+        stored = (
+            self.unpack(*self.store.query(start_ms, min(end_ms, covered_ms - 1)))
+            if self.store is not None
+            else None
+        )
+
+        tail_start_ms = max(start_ms, covered_ms)
+        if tail_start_ms > end_ms:
+            return stored
+        self.raw.refresh()
+        timestamps_ms, values = self.raw.query(
+            tail_start_ms, floor_ms(end_ms, self.width_ms) + self.width_ms - 1
+        )
+        tail = aggregate(timestamps_ms, values, self.width_ms)
+        return tail if stored is None else concat(stored, tail)
+
+
+def open_rollups(raw: TimeSeriesStore, writable=False) -> dict:
+    """A Rollup for each of RESOLUTIONS, by name"""
+    return {
+        name: Rollup(raw, name, width_ms, writable)
+        for name, width_ms in RESOLUTIONS.items()
+    }
+
+
+def update_rollups(raw: TimeSeriesStore):
+    for rollup in open_rollups(raw, writable=True).values():
+        try:
+            rollup.update()
+        finally:
+            rollup.close()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Append-only binary time series store for telemetry
+#
+# File layout (little endian):
+#   header (HEADER_SIZE bytes): 8 byte magic, uint32 layout version, uint32 number of channels,
+#       then each channel's name (utf-8, null padded to NAME_SIZE bytes), zero padded
+#   records: int64 epoch milliseconds, then one float32 per channel
+#
+# Records are in timestamp order, so a time range is found by binary search. The file is memory-mapped
+# for reading, and a sparse index (the timestamp of every INDEX_STRIDE'th record) narrows the search to
+# one stride before touching the mapping, so a query only pages in the records it returns.
+#
+# Run this module to migrate a telemetry CSV file:
+#   python tsstore.py telemetry.csv telemetry.tss
+#
+
+import argparse
+import csv
+import datetime
+import heapq
+import mmap
+import os
+import struct
+import numpy as np
+from loguru import logger
+
+MAGIC = b"PISCESTS"
+LAYOUT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+HEADER_SIZE = 4096
+NAME_SIZE = 32
+MAX_CHANNELS = (HEADER_SIZE - HEADER.size) // NAME_SIZE
+
+INDEX_STRIDE = 1024
+
+
+def record_dtype(n_channels: int) -> np.dtype:
+    return np.dtype([("t", "<i8"), ("v", "<f4", (n_channels,))])
+
+
+class TimeSeriesStore(object):
+    """
+    A telemetry file of (timestamp, value per channel) records. Opening a file that doesn't exist
+    creates it, with the given channel names. There should only be one writer (the hwcontrol
+    server); any number of processes can read, calling refresh() to pick up newly appended records.
+    """
+
+    def __init__(self, path, channels=None):
+        self.path = path
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            if not channels:
+                raise FileNotFoundError(
+                    f"{path} doesn't exist, and no channels given to create it"
+                )
+            self._create(channels)
+
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError(f"{path} is not a time series store (header too short)")
+        magic, version, n_channels = HEADER.unpack_from(header, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION or n_channels > MAX_CHANNELS:
+            raise ValueError(f"{path} is not a time series store")
+        self.channels = [
+            header[offset : offset + NAME_SIZE].rstrip(b"\0").decode("utf-8")
+            for offset in range(
+                HEADER.size, HEADER.size + n_channels * NAME_SIZE, NAME_SIZE
+            )
+        ]
+        if channels and list(channels) != self.channels:
+            raise ValueError(
+                f"{path} has channels {self.channels}, not {list(channels)}"
+            )
+
+        self.dtype = record_dtype(len(self.channels))
+        self.mm = None
+        self.records = None  # The mapped records, from refresh()
+        self.count = 0
+        # Timestamp of every INDEX_STRIDE'th record
+        self.index = np.zeros(0, dtype=np.int64)
+        self.refresh()
+
+    def _create(self, channels):
+        if len(channels) > MAX_CHANNELS:
+            raise ValueError(f"At most {MAX_CHANNELS} channels")
+        header = bytearray(HEADER_SIZE)
+        HEADER.pack_into(header, 0, MAGIC, LAYOUT_VERSION, len(channels))
+        for i, name in enumerate(channels):
+            encoded = name.encode("utf-8")[:NAME_SIZE]
+            offset = HEADER.size + i * NAME_SIZE
+            header[offset : offset + len(encoded)] = encoded
+        with open(self.path, "wb") as f:
+            f.write(header)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.records = None
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def refresh(self):
+        """Map any records appended since the file was opened (or last refreshed)"""
+        count = (os.path.getsize(self.path) - HEADER_SIZE) // self.dtype.itemsize
+        if count == self.count and self.records is not None:
+            return
+        self.close()
+        self.count = count
+        if count == 0:
+            self.records = np.zeros(0, dtype=self.dtype)
+        else:
+            with open(self.path, "rb") as f:
+                self.mm = mmap.mmap(
+                    f.fileno(),
+                    HEADER_SIZE + count * self.dtype.itemsize,
+                    access=mmap.ACCESS_READ,
+                )
+            self.records = np.frombuffer(
+                self.mm, dtype=self.dtype, count=count, offset=HEADER_SIZE
+            )
+
+        # Only the new part of the index needs reading
+        have = len(self.index)
+        new = self.records["t"][have * INDEX_STRIDE :: INDEX_STRIDE]
+        self.index = np.concatenate((self.index, new))
+
+    @property
+    def first_timestamp_ms(self):
+        return int(self.records["t"][0]) if self.count else None
+
+    @property
+    def last_timestamp_ms(self):
+        return int(self.records["t"][-1]) if self.count else None
+
+    def append(self, timestamps_ms, values):
+        """Append records. timestamps_ms must be in order, and no earlier than the last record already stored.
+
+        Parameters
+        ----------
+        timestamps_ms : array_like
+            Epoch milliseconds, shape (n,)
+        values : array_like
+            One value per channel for each record, shape (n, channels)
+        """
+        timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+        values = np.asarray(values, dtype=np.float32).reshape(
+            len(timestamps_ms), len(self.channels)
+        )
+        if len(timestamps_ms) == 0:
+            return
+        if np.any(np.diff(timestamps_ms) < 0):
+            raise ValueError("Timestamps are out of order")
+        self.refresh()
+        if self.count and timestamps_ms[0] < self.last_timestamp_ms:
+            raise ValueError(
+                f"Timestamp {timestamps_ms[0]} is before the last one stored ({self.last_timestamp_ms})"
+            )
+
+        records = np.empty(len(timestamps_ms), dtype=self.dtype)
+        records["t"] = timestamps_ms
+        records["v"] = values
+        with open(self.path, "r+b") as f:
+            # Drop a partial record left by a write that was cut short
+            f.truncate(HEADER_SIZE + self.count * self.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(records.tobytes())
+        self.refresh()
+
+    def search(self, timestamp_ms: int, side: str = "left") -> int:
+        """Record index where timestamp_ms would go, as np.searchsorted on the timestamps"""
+        block = max(int(np.searchsorted(self.index, timestamp_ms, side=side)) - 1, 0)
+        start = block * INDEX_STRIDE
+        end = min(start + 2 * INDEX_STRIDE, self.count)
+        return start + int(
+            np.searchsorted(self.records["t"][start:end], timestamp_ms, side=side)
+        )
+
+    def query(self, start_ms: int, end_ms: int):
+        """Copy out the records with start_ms <= timestamp <= end_ms
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            (timestamps_ms, values), values having one column per channel
+        """
+        lo = self.search(start_ms, "left")
+        hi = self.search(end_ms, "right")
+        window = self.records[lo:hi]
+        return window["t"].copy(), window["v"].copy()
+
+
+def migrate_csv(csv_path, store_path, reorder_rows=1024):
+    """
+    Copy a telemetry CSV file (Timestamp, then one column per channel) into a new store, a row at a
+    time. Rows that are out of order are put back in order, as long as they're no more than
+    reorder_rows rows out of place; rows further out than that, or that don't parse, are skipped.
+
+    Returns
+    -------
+    Tuple[int, int]
+        (rows written, rows skipped)
+    """
+    written = skipped = 0
+    pending = []  # Heap of (timestamp_ms, row number, values), the reorder buffer
+    batch_t, batch_v = [], []
+    last_ms = None
+
+    with open(csv_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        store = TimeSeriesStore(store_path, channels=header[1:])
+
+        def emit(entry):
+            nonlocal last_ms, written, skipped
+            timestamp_ms, _, values = entry
+            if last_ms is not None and timestamp_ms < last_ms:
+                skipped += 1
+                return
+            last_ms = timestamp_ms
+            batch_t.append(timestamp_ms)
+            batch_v.append(values)
+            written += 1
+            if len(batch_t) >= 4096:
+                store.append(batch_t, batch_v)
+                batch_t.clear()
+                batch_v.clear()
+
+        for row_number, row in enumerate(reader):
+            try:
+                timestamp = datetime.datetime.fromisoformat(row[0].strip())
+                values = [float(x) for x in row[1 : 1 + len(store.channels)]]
+            except (ValueError, IndexError):
+                skipped += 1
+                continue
+            if len(values) != len(store.channels):
+                skipped += 1
+                continue
+            entry = (int(timestamp.timestamp() * 1000), row_number, values)
+            if len(pending) < reorder_rows:
+                heapq.heappush(pending, entry)
+            else:
+                emit(heapq.heappushpop(pending, entry))
+
+        while pending:
+            emit(heapq.heappop(pending))
+        store.append(batch_t, batch_v)
+        store.close()
+
+    logger.info(
+        f"Migrated {csv_path} to {store_path}: {written} rows, {skipped} skipped"
+    )
+    return written, skipped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Migrate a telemetry CSV file to a time series store."
+    )
+    parser.add_argument("csv_path")
+    parser.add_argument("store_path")
+    args = parser.parse_args()
+
+    if os.path.exists(args.store_path):
+        raise SystemExit(f"{args.store_path} already exists")
+    migrate_csv(args.csv_path, args.store_path)
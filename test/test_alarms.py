@@ -0,0 +1,107 @@
+import datetime
+
+import alarms
+import pytest
+
+T0 = datetime.datetime(2022, 1, 1, 12, 0, 0)
+
+
+def at(seconds):
+    return T0 + datetime.timedelta(seconds=seconds)
+
+
+def test_hysteresis_and_debounce():
+    rule = alarms.AlarmRule(
+        "ph_range", "ph", low=6.0, high=8.0, hysteresis=0.1, debounce_s=60
+    )
+
+    # A brief excursion doesn't raise
+    assert rule.update(at(0), 8.2) == []
+    assert rule.update(at(30), 7.5) == []
+    assert rule.update(at(90), 8.2) == []
+
+    # Held beyond the threshold for the debounce time does
+    assert rule.update(at(120), 8.3) == []
+    (event,) = rule.update(at(150), 8.3)
+    assert event.active and event.level == "high" and event.threshold == 8.0
+    assert event.timestamp == at(150)
+
+    # Noise around the threshold, inside the hysteresis band, never clears it
+    for t in range(180, 600, 30):
+        assert rule.update(at(t), 7.95 if t % 60 else 8.05) == []
+
+    # Back inside by more than the hysteresis, for the debounce time
+    assert rule.update(at(600), 7.8) == []
+    (event,) = rule.update(at(660), 7.8)
+    assert not event.active and event.level == "high"
+
+    # Low side, no debounce needed with debounce_s=0
+    low = alarms.AlarmRule("temp_low", "temperature", low=23.0)
+    assert [e.level for e in low.update(at(0), 22.9)] == ["low"]
+    assert [e.active for e in low.update(at(10), 23.1)] == [False]
+
+
+def test_crossing_to_other_threshold():
+    rule = alarms.AlarmRule(
+        "ph_range", "ph", low=6.0, high=8.0, hysteresis=0.1, debounce_s=60
+    )
+    assert rule.update(at(0), 8.3) == []
+    assert [e.level for e in rule.update(at(60), 8.3)] == ["high"]
+
+    # Straight down past the low threshold: high clears and low raises, after the debounce
+    assert rule.update(at(90), 5.5) == []
+    cleared, raised = rule.update(at(150), 5.5)
+    assert (cleared.active, cleared.level) == (False, "high")
+    assert (raised.active, raised.level) == (True, "low")
+    assert raised.message == "ph 5.50 is below 6.0"
+
+    # And back up the same way
+    assert rule.update(at(160), 8.5) == []
+    assert [(e.active, e.level) for e in rule.update(at(220), 8.5)] == [
+        (False, "low"),
+        (True, "high"),
+    ]
+
+
+def test_bad_rules():
+    with pytest.raises(ValueError):
+        alarms.AlarmRule("none", "ph")
+    with pytest.raises(ValueError):
+        alarms.AlarmRule("overlap", "ph", low=7.0, high=7.1, hysteresis=0.1)
+
+
+def test_engine_notifies_transitions_only():
+    engine = alarms.AlarmEngine(
+        alarms.rules_from_config(
+            [
+                {"name": "temp_high", "sensor": "temperature", "high": 27.0},
+                {"name": "ph_range", "sensor": "ph", "low": 6.0, "high": 8.0},
+            ]
+        )
+    )
+    events = []
+    engine.add_listener(events.append)
+
+    engine.evaluate("temperature", (at(0), 26.0))
+    engine.evaluate("temperature", (at(10), 27.5))
+    engine.evaluate("temperature", (at(20), 27.6))
+    engine.evaluate("ph", (at(20), 7.0))
+    engine.evaluate("ec", (at(20), 1413))  # No rules
+    assert [(e.name, e.active) for e in events] == [("temp_high", True)]
+    assert [e.name for e in engine.active_alarms()] == ["temp_high"]
+
+    engine.evaluate("temperature", (at(30), 26.5))
+    assert [(e.name, e.active) for e in events] == [
+        ("temp_high", True),
+        ("temp_high", False),
+    ]
+    assert engine.active_alarms() == []
+
+    engine.remove_listener(events.append)
+    engine.evaluate("ph", (at(40), 5.0))
+    assert len(events) == 2
+    assert engine.active_alarms()[0].message == "ph 5.00 is below 6.0"
+
+    # Straight across to the other threshold: the low alarm clears and the high one takes its place
+    engine.evaluate("ph", (at(50), 9.0))
+    assert [(e.level, e.active) for e in engine.active_alarms()] == [("high", True)]
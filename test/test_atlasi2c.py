@@ -0,0 +1,107 @@
+import io
+import types
+
+import AtlasI2C as Atlas
+import pytest
+
+
+@pytest.fixture
+def ioctls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        Atlas.fcntl, "ioctl", lambda f, request, addr: calls.append((request, addr))
+    )
+    return calls
+
+
+def make_device(ioctls, response=b"", address=99):
+    """An AtlasI2C talking to an in-memory 'bus' instead of /dev/i2c-N"""
+    device = Atlas.AtlasI2C.__new__(Atlas.AtlasI2C)
+    device._long_timeout = 0
+    device._short_timeout = 0
+    device._slave_address = None
+    device._buffer = bytearray(Atlas.AtlasI2C.MAX_RESPONSE_SIZE)
+    device._name = ""
+    device._module = "pH"
+    device.bus = 1
+    device.file = io.BytesIO(response)
+    device.set_i2c_address(address)
+    return device
+
+
+def test_read_masks_glitch_bits(ioctls):
+    # Pi I2C glitch can set the MSB of response characters
+    raw = b"\x01" + bytes(c | 0x80 for c in b"7.012") + b"\x00" * 10
+    device = make_device(ioctls, raw)
+    assert device.read_response() == (1, "7.012")
+
+    assert device.handle_raspi_glitch(bytes(c | 0x80 for c in b"ok")) == ["o", "k"]
+
+
+def test_read_error_codes(ioctls):
+    device = make_device(ioctls, b"\xfe" + b"\x00" * 30)
+    code, result = device.read_response()
+    assert code == 254
+    assert result == "Error pH 99: 254"
+
+    assert make_device(ioctls, b"\x02").read() == "Error pH 99: 2"
+
+
+def test_write_and_address_caching(ioctls):
+    device = make_device(ioctls)
+    assert ioctls == [(Atlas.AtlasI2C.I2C_SLAVE, 99)]
+
+    device.set_i2c_address(99)  # Already there, no ioctl
+    assert len(ioctls) == 1
+    device.set_i2c_address(100)
+    assert ioctls[-1] == (Atlas.AtlasI2C.I2C_SLAVE, 100)
+    assert device.address == 100
+
+    device.write("R")
+    assert device.file.getvalue() == b"R\x00"
+
+
+def test_bus_scan_is_bounded_and_cached(ioctls, monkeypatch):
+    monkeypatch.setattr(Atlas.AtlasI2C, "_scan_cache", {})
+    device = make_device(ioctls)
+
+    def fake_read(num_of_bytes=31):
+        if device._slave_address not in (99, 102):
+            raise IOError("No ACK")
+        return ""
+
+    monkeypatch.setattr(device, "read", fake_read)
+    assert device.list_i2c_devices() == [99, 102]
+    scanned = [addr for _, addr in ioctls]
+    assert min(scanned) == 0x03 and max(scanned) == 0x77
+    assert device.address == 99  # Restored
+
+    ioctls.clear()
+    assert device.list_i2c_devices() == [99, 102]
+    assert ioctls == []  # From the cache
+
+
+def test_stale_device_cache_closes_handles(ioctls, monkeypatch, tmp_path):
+    opened = []
+
+    def fake_open(file, mode, buffering):
+        opened.append(io.BytesIO())
+        return opened[-1]
+
+    def fake_query(self, command):
+        if self.address == 102:
+            raise IOError("No ACK")  # Gone since the cache was written
+        return "?I,pH,2.0"
+
+    cache_file = tmp_path / "atlas_devices.json"
+    cache_file.write_text(
+        '[{"address": 99, "moduletype": "pH", "name": ""},'
+        ' {"address": 102, "moduletype": "RTD", "name": ""}]'
+    )
+    monkeypatch.setattr(Atlas, "io", types.SimpleNamespace(open=fake_open))
+    monkeypatch.setattr(Atlas.AtlasI2C, "query", fake_query)
+    monkeypatch.setattr(Atlas, "get_devices", lambda: [])
+
+    assert Atlas.get_devices_cached(str(cache_file)) == []
+    assert len(opened) == 2 and all(f.closed for f in opened)
+    assert cache_file.read_text().strip() == "[]"  # Rescanned
@@ -0,0 +1,39 @@
+import numpy as np
+from downsample import decimate, minmax_indices
+
+
+def test_short_series_unchanged():
+    x = np.arange(10.0)
+    y = np.array([1, 2, np.nan, 4, 5, 6, 7, 8, 9, 10], dtype=np.float32)
+    assert list(minmax_indices(x, y, 5)) == [0, 1, 3, 4, 5, 6, 7, 8, 9]
+    dx, dy = decimate(x, y, 100)
+    assert len(dx) == 9 and not np.any(np.isnan(dy))
+
+
+def test_keeps_extremes():
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(0, 1000, 100000))
+    y = rng.normal(size=len(x)).astype(np.float32)
+    y[31337] = 50  # Spike
+    y[77777] = -50
+
+    dx, dy = decimate(x, y, 1000)
+    assert len(dx) <= 1000
+    assert np.all(np.diff(dx) > 0)
+    assert 50 in dy and -50 in dy
+
+    # Each slice's min and max are kept
+    idx = minmax_indices(x, y, 500)
+    edges = np.linspace(x[0], x[-1], 501)
+    for lo, hi in [(0, 1), (250, 251), (499, 500)]:
+        inside = (x >= edges[lo]) & (x < edges[hi])
+        assert y[inside].max() in y[idx] and y[inside].min() in y[idx]
+
+
+def test_gaps():
+    # Samples bunched into two runs, so most slices are empty
+    x = np.r_[np.arange(5000.0), np.arange(5000.0) + 1e6]
+    y = np.sin(x / 100)
+    idx = minmax_indices(x, y, 100)
+    assert len(idx) <= 200
+    assert x[idx].min() < 5000 and x[idx].max() >= 1e6
@@ -0,0 +1,52 @@
+import fakegpio
+import pytest
+
+
+@pytest.fixture
+def state_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "gpiostate.bin")
+    monkeypatch.setattr(fakegpio, "_bank", fakegpio.GpioBank(path))
+    return path
+
+
+def test_states_visible_in_file(state_file):
+    relay = fakegpio.DigitalOutputDevice(pin="GPIO5")
+    step = fakegpio.DigitalOutputDevice(pin="GPIO17")
+    assert fakegpio.read_states(state_file) == [("GPIO5", 0), ("GPIO17", 0)]
+
+    relay.on()
+    assert fakegpio.read_states(state_file) == [("GPIO5", 1), ("GPIO17", 0)]
+    step.on()
+    relay.off()
+    assert fakegpio.read_states(state_file) == [("GPIO5", 0), ("GPIO17", 1)]
+    assert relay.is_active == 0 and step.is_active == 1
+
+
+def test_bank_full(state_file):
+    devices = [
+        fakegpio.DigitalOutputDevice(pin=i) for i in range(fakegpio.MAX_PINS + 1)
+    ]
+    devices[-1].on()  # No slot left, but still works
+    assert devices[-1].is_active
+    assert len(fakegpio.read_states(state_file)) == fakegpio.MAX_PINS
+
+
+def test_edge_log(state_file):
+    log = fakegpio.enable_edge_log()
+    try:
+        gpio = fakegpio.DigitalOutputDevice(pin="GPIO17")
+        gpio.on()
+        gpio.off()
+    finally:
+        fakegpio.disable_edge_log()
+    gpio.on()
+
+    assert [(pin, state) for pin, _, state in log] == [("GPIO17", 1), ("GPIO17", 0)]
+    assert log[0][1] <= log[1][1]
+
+
+def test_not_a_state_file(tmp_path):
+    path = tmp_path / "junk.bin"
+    path.write_bytes(b"\0" * fakegpio.FILE_SIZE)
+    with pytest.raises(ValueError):
+        fakegpio.read_states(str(path))
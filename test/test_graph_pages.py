@@ -0,0 +1,51 @@
+import datetime
+import json
+import os
+
+import numpy as np
+import rollups
+from graph_pages import GraphPage, to_epoch_ms
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from tsstore import TimeSeriesStore
+
+CHANNELS = ["Temperature (F)", "pH"]
+
+with open(os.path.join(os.path.dirname(__file__), "..", "gui", "gui.json")) as f:
+    GRAPH_SETTINGS = json.load(f)["graph_settings"]
+
+
+def make_page(store, field):
+    """A GraphPage with just the state plot_data() uses, drawing off screen"""
+    page = GraphPage.__new__(GraphPage)
+    page.field = field
+    page.store = store
+    page.rollups = rollups.open_rollups(store)
+    page.settings = GRAPH_SETTINGS[field]
+    page.fig = Figure()
+    page.ax = page.fig.add_subplot()
+    page.canvas = FigureCanvasAgg(page.fig)
+    page.setup_axes()
+    page.mode = "month"
+    return page
+
+
+def test_month_without_any_readings_of_a_channel(tmp_path):
+    # A month of hourly temperatures, with the pH circuit missing throughout
+    end = datetime.datetime(2022, 3, 1)
+    start = end - datetime.timedelta(days=30)
+    t = np.arange(to_epoch_ms(start), to_epoch_ms(end), rollups.HOUR_MS // 4)
+    store = TimeSeriesStore(str(tmp_path / "t.tss"), channels=CHANNELS)
+    store.append(t, np.column_stack((np.full(len(t), 77.0), np.full(len(t), np.nan))))
+    rollups.update_rollups(store)
+
+    page = make_page(store, "pH")
+    page.plot_data(start, end)
+    assert len(page.line.get_xdata()) == 0
+    assert not page.envelope.get_visible()
+    assert page.ax.get_ylim() == (-0.1, 0.1)  # The empty-window limits
+
+    page = make_page(store, "Temperature (F)")
+    page.plot_data(start, end)
+    assert len(page.line.get_xdata()) >= 30 * 24
+    assert np.all(page.line.get_ydata() == 77.0)
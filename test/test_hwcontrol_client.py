@@ -0,0 +1,50 @@
+import queue
+import threading
+
+import grpc
+from hwcontrol_client import StreamSubscription
+
+
+class FakeRpcError(grpc.RpcError):
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+
+class FakeCall(object):
+    """A streaming call yielding items, then failing with UNAVAILABLE (or blocking until cancelled)"""
+
+    def __init__(self, items, block=False):
+        self.items = items
+        self.block = block
+        self.cancelled = threading.Event()
+
+    def __iter__(self):
+        yield from self.items
+        if self.block:
+            self.cancelled.wait()
+        raise FakeRpcError()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+def test_resubscribes_after_drop():
+    calls = [FakeCall([]), FakeCall([1, 2]), FakeCall([3], block=True)]
+    opened = iter(calls)
+    events = queue.Queue()
+
+    sub = StreamSubscription(
+        lambda: next(opened),
+        lambda item: events.put(item),
+        lambda connected: events.put(connected),
+        min_backoff_s=0.01,
+    )
+    # First attempt fails before any items: never connected, so no change reported
+    assert [events.get(timeout=2) for _ in range(6)] == [True, 1, 2, False, True, 3]
+    assert sub.connected
+
+    sub.cancel()
+    sub.thread.join(timeout=2)
+    assert not sub.thread.is_alive()
+    assert calls[2].cancelled.is_set()
+    assert events.get(timeout=2) is False
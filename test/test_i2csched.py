@@ -0,0 +1,109 @@
+import threading
+import time
+
+import i2csched
+import pytest
+
+
+class FakeEzo(object):
+    """Stands in for AtlasI2C. Commands take process_s to run, and reads before then get 254."""
+
+    LONG_TIMEOUT = 0.3
+    SHORT_TIMEOUT = 0.1
+
+    def __init__(self, name, process_s=0.2):
+        self.name = name
+        self.process_s = process_s
+        self.command = None
+        self.done_at = None
+        self.log = []  # (time, "write"/"read", command)
+
+    def get_command_timeout(self, command):
+        if command.upper().startswith("SLEEP"):
+            return None
+        if command.upper().startswith(("R", "CAL")):
+            return self.LONG_TIMEOUT
+        return self.SHORT_TIMEOUT
+
+    def write(self, cmd):
+        self.log.append((time.monotonic(), "write", cmd))
+        self.command = cmd
+        self.done_at = time.monotonic() + self.process_s
+
+    def read_response(self):
+        self.log.append((time.monotonic(), "read", self.command))
+        if time.monotonic() < self.done_at:
+            return i2csched.STILL_PROCESSING, f"Error {self.name}: 254"
+        return 1, f"{self.name}:{self.command}"
+
+
+def test_query_waits_for_device():
+    sched = i2csched.I2CTransactionScheduler()
+    dev = FakeEzo("ph", process_s=0.25)
+
+    start = time.monotonic()
+    assert sched.query(dev, "R") == "ph:R"
+    assert time.monotonic() - start == pytest.approx(0.25, abs=0.1)
+
+    # First read is early, then retried until the device is done
+    reads = [entry for entry in dev.log if entry[1] == "read"]
+    assert len(reads) >= 2
+    assert sched.query(dev, "Sleep") == "sleep mode"
+
+
+def test_interactive_jumps_queue():
+    sched = i2csched.I2CTransactionScheduler()
+    dev = FakeEzo("ph", process_s=0.1)
+
+    background = [sched.submit(dev, "R") for _ in range(3)]
+    time.sleep(0.02)  # First background read is now in flight
+    start = time.monotonic()
+    cal = sched.submit(dev, "Cal,mid,7.00", priority=i2csched.PRIORITY_INTERACTIVE)
+    assert cal.result(timeout=2) == "ph:Cal,mid,7.00"
+    # Only waited for the in-flight read, not the queued ones
+    assert time.monotonic() - start < 0.35
+
+    writes = [cmd for _, kind, cmd in dev.log if kind == "write"]
+    assert writes[:2] == ["R", "Cal,mid,7.00"]
+    assert [f.result(timeout=2) for f in background] == ["ph:R"] * 3
+
+
+def test_devices_overlap():
+    sched = i2csched.I2CTransactionScheduler()
+    devices = [FakeEzo(f"dev{i}", process_s=0.2) for i in range(4)]
+
+    start = time.monotonic()
+    futures = [sched.submit(dev, "R") for dev in devices]
+    results = [f.result(timeout=2) for f in futures]
+    assert results == [f"dev{i}:R" for i in range(4)]
+    # All four processed at the same time, rather than back to back
+    assert time.monotonic() - start < 0.5
+
+
+def test_failed_transaction():
+    class BrokenEzo(FakeEzo):
+        def read_response(self):
+            raise OSError("Remote I/O error")
+
+    sched = i2csched.I2CTransactionScheduler()
+    with pytest.raises(OSError):
+        sched.query(BrokenEzo("ph"), "R")
+
+    # Scheduler still works afterwards
+    assert sched.query(FakeEzo("ph", process_s=0), "R") == "ph:R"
+
+
+def test_concurrent_submitters():
+    sched = i2csched.I2CTransactionScheduler()
+    dev = FakeEzo("ph", process_s=0.01)
+    results = []
+
+    def worker(i):
+        results.append(sched.query(dev, f"T,{i}"))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=5)
+    assert sorted(results) == sorted(f"ph:T,{i}" for i in range(5))
@@ -0,0 +1,264 @@
+import threading
+import time
+
+import numpy as np
+import pollsched
+import pytest
+
+
+class FakePoller(object):
+    def __init__(self, interval_s, phase_s=None, work_s=0.0):
+        self.interval_s = interval_s
+        self.phase_s = phase_s
+        self.work_s = work_s
+        self.stats = pollsched.JitterStats()
+        self.times = []
+        self.running = 0
+        self.max_running = 0
+
+    def sample(self):
+        self.times.append(time.monotonic())
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        time.sleep(self.work_s)
+        self.running -= 1
+
+
+def wait_for_samples(poller, n, timeout=5):
+    start = time.monotonic()
+    while len(poller.times) < n:
+        assert time.monotonic() - start < timeout
+        time.sleep(0.01)
+
+
+def test_samples_do_not_drift():
+    sched = pollsched.PollScheduler()
+    # Work takes a good chunk of the interval, which would add up with sleep(interval)
+    poller = FakePoller(0.05, work_s=0.02)
+    sched.add(poller)
+    wait_for_samples(poller, 21)
+    sched.remove(poller)
+
+    times = np.array(poller.times[:21])
+    error = times - (times[0] + 0.05 * np.arange(21))
+    assert np.median(np.abs(error)) < 0.005
+    assert abs(error[-1]) < 0.02
+    assert poller.stats.samples >= 20
+    assert poller.stats.last_duration_s == pytest.approx(0.02, abs=0.015)
+
+
+def test_phase_alignment():
+    sched = pollsched.PollScheduler()
+    a = FakePoller(0.1, phase_s=0.0)
+    sched.add(a)
+    time.sleep(0.033)
+    b = FakePoller(0.1, phase_s=0.0)
+    c = FakePoller(0.1, phase_s=0.05)
+    sched.add(b)
+    sched.add(c)
+    wait_for_samples(b, 4)
+    wait_for_samples(c, 4)
+    for p in (a, b, c):
+        sched.remove(p)
+
+    # After the first sample (straight away), a and b sample together, and c half a period later,
+    # on the grid k * interval + phase
+    assert abs(b.times[0] - a.times[0]) > 0.02
+    for t in b.times[1:4]:
+        assert min(abs(t - ta) for ta in a.times) < 0.01
+    for t in c.times[1:4]:
+        offset = (t - 0.05) % 0.1
+        assert min(offset, 0.1 - offset) < 0.01
+
+
+def test_overrun_skips_deadlines():
+    sched = pollsched.PollScheduler()
+    poller = FakePoller(0.02, work_s=0.07)
+    sched.add(poller)
+    wait_for_samples(poller, 4)
+    sched.remove(poller)
+
+    assert poller.max_running == 1  # Never overlapped
+    assert poller.stats.skipped > 0
+
+
+def test_reschedule_and_shared_thread():
+    sched = pollsched.PollScheduler(workers=2)
+    threads_before = threading.active_count()
+    pollers = [FakePoller(10.0) for _ in range(8)]
+    for p in pollers:
+        sched.add(p)
+    for p in pollers:
+        wait_for_samples(p, 1)
+    # Workers are a fixed pool, whatever the number of pollers
+    assert threading.active_count() <= threads_before + 2
+
+    # Long interval, so no second sample until it's changed
+    time.sleep(0.05)
+    assert len(pollers[0].times) == 1
+    pollers[0].interval_s = 0.02
+    sched.add(pollers[0])
+    wait_for_samples(pollers[0], 3, timeout=1)
+    for p in pollers:
+        sched.remove(p)
+
+
+def test_failed_sample_keeps_going():
+    class Broken(FakePoller):
+        def sample(self):
+            super().sample()
+            raise OSError("bus error")
+
+    sched = pollsched.PollScheduler()
+    poller = Broken(0.02)
+    sched.add(poller)
+    wait_for_samples(poller, 3)
+    sched.remove(poller)
+
+
+def test_adaptive_interval():
+    adaptive = pollsched.AdaptiveInterval(
+        min_interval_s=10, max_interval_s=300, threshold=0.02
+    )
+    # Flat signal (noise well under the threshold) backs off to the ceiling, and stays there
+    intervals = [adaptive.update(7.0 + 0.001 * (i % 2)) for i in range(20)]
+    assert intervals[0] == 10
+    assert intervals == sorted(intervals)
+    assert intervals[-1] == 300
+
+    # A step change goes straight to the floor
+    assert adaptive.update(7.3) == 10
+    # Then back off again once it settles
+    intervals = [adaptive.update(7.3) for _ in range(40)]
+    assert intervals[-1] == 300
+
+    assert adaptive.clamp(1) == 10
+    with pytest.raises(ValueError):
+        pollsched.AdaptiveInterval(min_interval_s=10, max_interval_s=5, threshold=1)
+
+
+def test_stats_count_errors():
+    stats = pollsched.JitterStats()
+    stats.record(0.001, 0.01)
+    stats.record(0.003, 0.03, OSError("bus error"))
+    stats.record(0.002, 0.02, OSError("bus error"))
+    assert stats.samples == 3
+    assert stats.errors == 2
+    assert stats.consecutive_errors == 2
+    assert stats.last_error == "bus error"
+    assert stats.mean_duration_s == pytest.approx(0.02)
+    assert stats.max_lateness_s == pytest.approx(0.003)
+
+    stats.record(0.001, 0.01)
+    assert stats.consecutive_errors == 0
+    assert stats.last_success_at is not None
+
+
+def test_supervisor_restarts_with_backoff():
+    class Flaky(FakePoller):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.failing = True
+            self.restart_calls = 0
+
+        def restart(self):
+            self.restart_calls += 1
+
+        def sample(self):
+            super().sample()
+            if self.failing:
+                raise OSError("probe unplugged")
+
+    sched = pollsched.PollScheduler()
+    poller = Flaky(1.0)
+    sched.add(poller)
+    supervisor = pollsched.PollSupervisor(
+        sched,
+        [poller],
+        check_interval_s=1,
+        stale_intervals=2,
+        min_backoff_s=10,
+        max_backoff_s=25,
+    )
+    wait_for_samples(poller, 1)
+    start = time.monotonic()
+
+    supervisor.check(start + 2)  # Within 2 intervals + 1s grace of starting
+    assert poller.restart_calls == 0
+    assert not supervisor.is_healthy(poller, start + 4)
+
+    # Restarts back off 10, 20, 25 (max) seconds apart
+    restart_times = []
+    for t in range(4, 100):
+        supervisor.check(start + t)
+        if poller.restart_calls > len(restart_times):
+            restart_times.append(t)
+    assert restart_times[:4] == [4, 14, 34, 59]
+    assert poller.stats.restarts == poller.restart_calls
+    assert poller.stats.consecutive_errors >= 1
+    assert poller.stats.last_error == "probe unplugged"
+
+    # Recovers after a restart, and the backoff starts again from the bottom
+    poller.failing = False
+    sched.restart(poller)
+    wait_for_samples(poller, len(poller.times) + 1)
+    time.sleep(0.01)
+    now = time.monotonic()
+    supervisor.check(now)
+    assert supervisor.is_healthy(poller, now)
+    assert supervisor.watched[poller].backoff_s == 10
+    sched.remove(poller)
+
+
+def test_supervisor_frees_hung_poller():
+    sched = pollsched.PollScheduler()
+    hung = threading.Event()
+
+    class Hangs(FakePoller):
+        def sample(self):
+            super().sample()
+            if len(self.times) == 2:
+                hung.wait(5)  # Stuck on a bus that never answers
+
+    poller = Hangs(0.02)
+    sched.add(poller)
+    supervisor = pollsched.PollSupervisor(
+        sched, [poller], check_interval_s=0.02, stale_intervals=2, min_backoff_s=1
+    )
+    wait_for_samples(poller, 2)
+    time.sleep(0.2)
+    assert len(poller.times) == 2  # Every deadline skipped while it's stuck
+    assert poller.stats.started_at is not None
+
+    supervisor.check()
+    wait_for_samples(poller, 4, timeout=1)
+    assert poller.stats.restarts == 1
+    hung.set()
+    sched.remove(poller)
+
+
+def test_restart_replaces_stuck_worker():
+    sched = pollsched.PollScheduler(workers=1)
+    hung = threading.Event()
+
+    class HangsOnce(FakePoller):
+        def sample(self):
+            super().sample()
+            if len(self.times) == 1:
+                hung.wait(5)
+
+    stuck = HangsOnce(0.02)
+    other = FakePoller(0.02)
+    sched.add(stuck)
+    wait_for_samples(stuck, 1)
+    sched.add(other)
+    time.sleep(0.1)
+    assert not other.times  # The only worker is stuck
+
+    # The abandoned sample keeps its worker, so the others get a fresh one
+    sched.restart(stuck)
+    wait_for_samples(other, 3, timeout=1)
+    wait_for_samples(stuck, 3, timeout=1)
+    hung.set()
+    sched.remove(stuck)
+    sched.remove(other)
@@ -0,0 +1,60 @@
+from ringbuffer import SampleRingBuffer, downsample
+import numpy as np
+import pytest
+
+
+def test_ring_buffer_wraps():
+    rb = SampleRingBuffer(4)
+    assert len(rb) == 0
+    ts, vals = rb.get_all()
+    assert len(ts) == 0 and len(vals) == 0
+
+    for i in range(3):
+        rb.append(1000 * i, i / 2)
+    ts, vals = rb.get_all()
+    assert ts.tolist() == [0, 1000, 2000]
+    assert vals.tolist() == [0.0, 0.5, 1.0]
+
+    for i in range(3, 7):
+        rb.append(1000 * i, i / 2)
+    assert len(rb) == 4
+    ts, vals = rb.get_all()
+    assert ts.dtype == np.int64
+    assert vals.dtype == np.float32
+    assert ts.tolist() == [3000, 4000, 5000, 6000]  # Oldest samples were overwritten
+    assert vals.tolist() == [1.5, 2.0, 2.5, 3.0]
+
+    with pytest.raises(ValueError):
+        SampleRingBuffer(0)
+
+
+def test_ring_buffer_range():
+    rb = SampleRingBuffer(10)
+    for i in range(15):
+        rb.append(1000 * i, i)
+
+    ts, vals = rb.get_range(7000, 9000)
+    assert ts.tolist() == [7000, 8000, 9000]
+    assert vals.tolist() == [7, 8, 9]
+
+    ts, _ = rb.get_range(0, 4000)  # Already overwritten
+    assert len(ts) == 0
+
+
+def test_downsample():
+    ts = np.arange(10, dtype=np.int64) * 1000
+    vals = np.arange(10, dtype=np.float32)
+
+    # Nothing to do
+    out_ts, out_vals = downsample(ts, vals, 0)
+    assert len(out_ts) == 10
+    out_ts, out_vals = downsample(ts, vals, 20)
+    assert len(out_ts) == 10
+
+    out_ts, out_vals = downsample(ts, vals, 5)
+    assert out_ts.tolist() == [500, 2500, 4500, 6500, 8500]
+    assert out_vals.tolist() == [0.5, 2.5, 4.5, 6.5, 8.5]
+
+    out_ts, out_vals = downsample(ts, vals, 3)
+    assert len(out_ts) == 3
+    assert out_vals.mean() == pytest.approx(vals.mean(), abs=0.5)
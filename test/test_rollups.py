@@ -0,0 +1,70 @@
+import numpy as np
+import rollups
+from rollups import HOUR_MS, DAY_MS
+from tsstore import TimeSeriesStore
+
+CHANNELS = ["Temperature (F)", "pH"]
+MINUTE_MS = 60 * 1000
+
+
+def append_minutes(store, start_min, end_min):
+    t = np.arange(start_min, end_min, dtype=np.int64) * MINUTE_MS
+    minute = t // MINUTE_MS
+    store.append(t, np.column_stack((minute % 60, -(minute % 1440))))
+
+
+def test_aggregate():
+    t = np.array([0, 10, HOUR_MS - 1, HOUR_MS, 3 * HOUR_MS + 5])
+    v = np.array([[1, 5], [3, np.nan], [2, 7], [4, 4], [6, 6]], dtype=np.float32)
+    buckets = rollups.aggregate(t, v, HOUR_MS)
+    assert list(buckets.start_ms) == [0, HOUR_MS, 3 * HOUR_MS]
+    assert list(buckets.count) == [3, 1, 1]
+    assert list(buckets.min[0]) == [1, 5]
+    assert list(buckets.max[0]) == [3, 7]
+    assert list(buckets.mean[0]) == [2, 6]  # NaN left out
+
+
+def test_incremental_update(tmp_path):
+    raw = TimeSeriesStore(str(tmp_path / "t.tss"), channels=CHANNELS)
+    append_minutes(raw, 0, 90)
+    rollups.update_rollups(raw)
+    hourly = rollups.Rollup(raw, "hour", HOUR_MS)
+    assert len(hourly.store) == 1  # Second hour still in progress
+    assert hourly.covered_until_ms() == HOUR_MS
+
+    # Stored buckets plus the one in progress, from the raw store
+    buckets = hourly.query(0, 2 * HOUR_MS)
+    assert list(buckets.start_ms) == [0, HOUR_MS]
+    assert list(buckets.count) == [60, 30]
+    assert list(buckets.max[:, 0]) == [59, 29]
+    assert list(buckets.mean[:, 0]) == [29.5, 14.5]
+
+    append_minutes(raw, 90, 3 * 1440 + 30)
+    rollups.update_rollups(raw)
+    assert hourly.covered_until_ms() == 3 * DAY_MS
+    assert len(hourly.store) == 3 * 24
+    daily = rollups.Rollup(raw, "day", DAY_MS)
+    assert len(daily.store) == 3
+
+    # Same as aggregating everything at once
+    everything = rollups.aggregate(*raw.query(0, 2**62), DAY_MS)
+    buckets = daily.query(0, 2**62)
+    for got, expected in zip(buckets, everything):
+        np.testing.assert_array_equal(got, expected)
+    assert list(buckets.min[:, 1]) == [-1439] * 3 + [-29]
+
+
+def test_query_without_rollup_file(tmp_path):
+    raw = TimeSeriesStore(str(tmp_path / "t.tss"), channels=CHANNELS)
+    append_minutes(raw, 0, 600)
+    hourly = rollups.Rollup(raw, "hour", HOUR_MS)
+    assert hourly.store is None
+    buckets = hourly.query(2 * HOUR_MS + 1, 4 * HOUR_MS)
+    assert list(buckets.start_ms) == [2 * HOUR_MS, 3 * HOUR_MS, 4 * HOUR_MS]
+    assert list(buckets.count) == [60, 60, 60]
+
+    rollups.update_rollups(raw)
+    hourly = rollups.Rollup(raw, "hour", HOUR_MS)
+    assert len(hourly.query(-2 * HOUR_MS, -HOUR_MS).start_ms) == 0
+    for got, expected in zip(hourly.query(2 * HOUR_MS + 1, 4 * HOUR_MS), buckets):
+        np.testing.assert_array_equal(got, expected)
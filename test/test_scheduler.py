@@ -2,7 +2,7 @@ import pytest
 from scheduler import hhmmToTime, timeToHhmm, Scheduler, TimerState, LightTimer
 import datetime as dt
 from loguru import logger
-from typing import List
+from typing import Dict, List
 
 
 class MockHardwareControlClient:
@@ -68,6 +68,19 @@ class MockHardwareControlClient:
         logger.debug(f"Set {lightId} to {color_name}")
         self.light_colors[lightId - 1] = color_name
 
+    def setLightColors(self, colors: Dict[int, str], scope: str = "") -> None:
+        """Set several lights at once.
+
+        Parameters
+        ----------
+        colors : Dict[int, str]
+            Map of lightId to one of ['off', 'white', 'blue']
+        scope : str, optional
+            Command scope, by default ""
+        """
+        for lightId, color_name in colors.items():
+            self.setLightColor(lightId, color_name, scope)
+
     def getLightColors(self) -> List[str]:
         """Get all light colors and return as list of strings.
             Unpack from GRPC object and return as native Python list.
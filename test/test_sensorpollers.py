@@ -0,0 +1,221 @@
+import datetime
+import threading
+import time
+
+import i2csched
+import pollsched
+import pytest
+import sensorpollers
+
+
+class FakeEzo(object):
+    """Stands in for an AtlasI2C device. A read takes process_s, and reads before then get 254."""
+
+    LONG_TIMEOUT = 0.3
+    SHORT_TIMEOUT = 0.1
+
+    def __init__(self, moduletype, address, response, process_s=0.2):
+        self.moduletype = moduletype
+        self.address = address
+        self.response = response
+        self.process_s = process_s
+        self.commands = []
+        self.done_at = 0
+
+    def get_device_info(self):
+        return f"{self.moduletype} {self.address}"
+
+    def get_command_timeout(self, command):
+        if command.upper().startswith(("R", "CAL")):
+            return self.LONG_TIMEOUT
+        return self.SHORT_TIMEOUT
+
+    def write(self, cmd):
+        self.commands.append(cmd)
+        self.done_at = time.monotonic() + self.process_s
+
+    def read_response(self):
+        if time.monotonic() < self.done_at:
+            return i2csched.STILL_PROCESSING, "Error: 254"
+        if self.commands[-1].upper().startswith("R"):
+            return 1, self.response
+        return 1, "ok"
+
+
+@pytest.fixture
+def fake_bus(monkeypatch):
+    devices = [
+        FakeEzo("pH", 99, "7.012"),
+        FakeEzo("EC", 100, "1413,707,0.70,1.000"),
+        FakeEzo("ORP", 98, "245.1"),
+        FakeEzo("pH", 101, "6.5"),  # Duplicate, ignored
+    ]
+    monkeypatch.setattr(
+        sensorpollers.Atlas, "get_devices_cached", lambda cache_file: devices
+    )
+    return devices
+
+
+def test_atlas_poller_reads_all_in_one_cycle(fake_bus):
+    poller = sensorpollers.AtlasPoller(interval_s=60)
+    assert sorted(poller.sensors) == ["EC", "ORP", "pH"]
+    assert poller.sensors["pH"].device is fake_bus[0]
+
+    start = time.monotonic()
+    while not all(sensor.deque for sensor in poller.sensors.values()):
+        time.sleep(0.01)
+        assert time.monotonic() - start < 2
+    # All three overlapped, rather than 3 x 0.2s back to back
+    assert time.monotonic() - start < 0.45
+
+    assert poller.sensors["pH"].getLatestDatum()[1] == pytest.approx(7.012)
+    assert poller.sensors["EC"].getLatestDatum()[1] == pytest.approx(1413)
+    assert poller.sensors["ORP"].name == "orp"
+    assert fake_bus[3].commands == []
+
+
+def test_atlas_sensor_sample_time_and_commands(fake_bus):
+    poller = sensorpollers.AtlasPoller(interval_s=60)
+    ph = poller.sensors["pH"]
+
+    ph.set_sample_time(30000)
+    assert poller.interval_s == 30
+    assert poller.sensors["EC"].get_sample_time_msec() == 30000
+
+    assert ph.send_command("Cal,mid,7.00") == "ok"
+    assert "Cal,mid,7.00" in fake_bus[0].commands
+
+
+def test_temperature_compensation(fake_bus):
+    thermometer = sensorpollers.DatumPublisher(name="temperature")
+    poller = sensorpollers.AtlasPoller(
+        interval_s=60, temperature_poller=thermometer, max_temperature_age_s=120
+    )
+    ph = poller.sensors["pH"]
+    orp = poller.sensors["ORP"]
+
+    assert ph.read_command() == "R"  # No temperature yet
+
+    thermometer.publish((datetime.datetime.now(), 25.5))
+    assert ph.read_command() == "RT,25.50"
+    assert poller.sensors["EC"].read_command() == "RT,25.50"
+    assert orp.read_command() == "R"  # ORP isn't temperature dependent
+
+    old = datetime.datetime.now() - datetime.timedelta(seconds=121)
+    thermometer.publish((old, 25.5))
+    assert ph.read_command() == "R"
+
+    thermometer.publish((datetime.datetime.now(), -273))  # Missing probe placeholder
+    assert ph.read_command() == "R"
+
+    # Readings come back the same way
+    assert ph.parse_reading("7.012") == pytest.approx(7.012)
+
+
+def test_adaptive_sampling():
+    class ListPoller(sensorpollers.SensorPoller):
+        def __init__(self, values, **kwargs):
+            super().__init__(name="test", **kwargs)
+            self.values = values
+            self.intervals = []
+            self.start()
+
+        def read(self):
+            value = self.values[min(len(self.intervals), len(self.values) - 1)]
+            self.intervals.append(self.interval_s)
+            return value
+
+    adaptive = pollsched.AdaptiveInterval(
+        min_interval_s=0.01, max_interval_s=0.08, threshold=0.1
+    )
+    values = [7.0] * 10 + [8.0] * 30
+    poller = ListPoller(
+        values,
+        interval_s=0.02,
+        scheduler=pollsched.PollScheduler(),
+        adaptive=adaptive,
+    )
+    assert poller.is_adaptive()
+
+    start = time.monotonic()
+    while len(poller.intervals) < 12:
+        time.sleep(0.01)
+        assert time.monotonic() - start < 3
+    # Backed off while flat, then straight back to the floor on the step
+    assert max(poller.intervals[:11]) == pytest.approx(0.08)
+    assert poller.get_sample_time_msec() == 10
+
+    # A sample time set by hand holds...
+    poller.set_sample_time(50)
+    assert not poller.is_adaptive()
+    poller.adapt(100.0)
+    assert poller.interval_s == 0.05
+    # ...until adaptive sampling is turned back on
+    poller.set_sample_time(1000, adaptive=True)
+    assert poller.is_adaptive()
+    assert poller.interval_s == 0.08  # Clamped to the adaptive range
+    poller.scheduler.remove(poller)
+
+
+def test_atlas_adaptive_sampling(fake_bus):
+    poller = sensorpollers.AtlasPoller(
+        interval_s=60,
+        adaptive={
+            "pH": pollsched.AdaptiveInterval(
+                min_interval_s=10, max_interval_s=120, threshold=0.02
+            )
+        },
+    )
+    assert poller.sensors["pH"].is_adaptive()
+    assert poller.interval_s == 60
+    for _ in range(10):
+        poller.adapt({"pH": 7.0, "EC": 1413})
+    assert poller.sensors["pH"].get_sample_time_msec() == 120000
+    poller.adapt({"pH": 7.5})
+    assert poller.interval_s == 10
+
+    poller.sensors["pH"].set_sample_time(1000)
+    assert not poller.is_adaptive()
+    assert poller.interval_s == 1
+
+
+def test_thermometer_restart_defers_closing_hung_bank(monkeypatch):
+    class FakeBank(object):
+        """Its reads hang until released"""
+
+        def __init__(self, resolution_bits=None):
+            self.probes = ["28-000000000001"]
+            self.reading = threading.Event()
+            self.release = threading.Event()
+            self.closed = False
+            banks.append(self)
+
+        def ids(self):
+            return self.probes
+
+        def read_all(self):
+            self.reading.set()
+            self.release.wait(5)
+            return {"28-000000000001": 24.5}
+
+        def close(self):
+            self.closed = True
+
+    banks = []
+    monkeypatch.setattr(sensorpollers.w1therm, "W1ThermometerBank", FakeBank)
+    poller = sensorpollers.ThermometerPoller(interval_s=3600)
+    assert banks[0].reading.wait(2)
+
+    # The hung read still has the old bank's descriptors, so they stay open until it returns
+    poller.restart()
+    assert poller.bank is banks[1] and not banks[0].closed
+    banks[0].release.set()
+    start = time.monotonic()
+    while not banks[0].closed:
+        assert time.monotonic() - start < 2
+        time.sleep(0.01)
+
+    # With no read going, the old bank is closed straight away
+    poller.restart()
+    assert banks[1].closed and not banks[2].closed
+    poller.scheduler.remove(poller)
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import fakegpio
+import numpy as np
+import pulsegen
+import pytest
+import stepper
+
+
+@pytest.fixture
+def step_gpio(tmp_path, monkeypatch):
+    monkeypatch.setattr(fakegpio, "STATE_FILE", str(tmp_path / "gpiostate.bin"))
+    log = fakegpio.enable_edge_log()
+    yield fakegpio.DigitalOutputDevice(pin="GPIO17"), log
+    fakegpio.disable_edge_log()
+
+
+def rising_edges(log):
+    return np.array([t for _, t, state in log if state == 1])
+
+
+def test_software_pulses_do_not_drift(step_gpio):
+    gpio, log = step_gpio
+    rate_hz = 200
+    steps = 200
+    pulser = pulsegen.SoftwarePulseBackend(gpio)
+
+    steps_seen = []
+    result = pulser.run([(rate_hz, steps)], threading.Event(), steps_seen.append)
+
+    assert result.steps_done == steps
+    assert steps_seen == list(range(1, steps + 1))
+    assert result.requested_rate_hz == pytest.approx(rate_hz)
+
+    edges = rising_edges(log)
+    assert len(edges) == steps
+    # Each edge is measured against its ideal time from the first edge, so any drift would accumulate here
+    error = edges - (edges[0] + np.arange(steps) / rate_hz)
+    if result.resyncs == 0:  # A long stall on a loaded machine restarts the schedule
+        assert np.median(np.abs(error)) < 0.001
+        assert abs(error[-1]) < 0.005
+        assert result.achieved_rate_hz == pytest.approx(rate_hz, rel=0.02)
+
+
+def test_software_pulses_segments(step_gpio):
+    gpio, log = step_gpio
+    pulser = pulsegen.SoftwarePulseBackend(gpio)
+
+    segments = [(100, 10), (400, 40)]
+    result = pulser.run(segments, threading.Event())
+
+    assert result.steps_done == 50
+    assert result.requested_rate_hz == pytest.approx(
+        50 / pulsegen.segments_duration_s(segments)
+    )
+    periods = np.diff(rising_edges(log))
+    assert np.median(periods[:9]) == pytest.approx(1 / 100, rel=0.1)
+    assert np.median(periods[10:]) == pytest.approx(1 / 400, rel=0.1)
+
+
+def test_software_pulses_stop(step_gpio):
+    gpio, log = step_gpio
+    pulser = pulsegen.SoftwarePulseBackend(gpio)
+    stop_event = threading.Event()
+
+    timer = threading.Timer(0.1, stop_event.set)
+    timer.start()
+    start = time.monotonic()
+    result = pulser.run([(100, 1000)], stop_event)
+
+    assert time.monotonic() - start < 1.0
+    assert 0 < result.steps_done < 1000
+    assert len(rising_edges(log)) == result.steps_done
+    assert log[-1][2] == 0  # Left low
+
+
+def test_estimate_steps():
+    segments = [(100, 10), (200, 20)]
+    assert pulsegen.PigpioWaveBackend.estimate_steps(segments, 0.05) == 5
+    assert pulsegen.PigpioWaveBackend.estimate_steps(segments, 0.15) == 20
+    assert pulsegen.PigpioWaveBackend.estimate_steps(segments, 10) == 30
+
+
+def test_plan_trapezoid():
+    segments = stepper.plan_trapezoid(1000, 100, 400, 800)
+    rates = [rate for rate, _ in segments]
+    assert sum(steps for _, steps in segments) == 1000
+    assert max(rates) == 400
+    assert rates[0] < rates[1] < 400  # Ramp up
+    assert rates == rates[::-1]  # Symmetric ramp down
+    # (400^2 - 100^2) / (2 * 800) steps to get up to speed
+    assert sum(steps for rate, steps in segments if rate < 400) == 2 * 93
+
+    # Too short to reach max rate
+    segments = stepper.plan_trapezoid(50, 100, 400, 800)
+    assert sum(steps for _, steps in segments) == 50
+    assert max(rate for rate, _ in segments) < 400
+
+    # Odd short moves: the middle step runs at the ramp's peak, never jumps to max rate
+    assert stepper.plan_trapezoid(1, 100, 400, 800) == [(100, 1)]
+    for steps in (3, 5, 7, 11, 51):
+        segments = stepper.plan_trapezoid(steps, 100, 400, 800)
+        rates = [rate for rate, _ in segments]
+        assert sum(n for _, n in segments) == steps
+        assert rates == rates[::-1]
+        assert max(rates) < 400
+        assert max(rates) == segments[len(segments) // 2][0]
+        # No jump bigger than a ramp chunk's
+        assert all(abs(b - a) < 50 for a, b in zip(rates, rates[1:]))
+
+    assert stepper.plan_trapezoid(0, 100, 400, 800) == []
+    assert stepper.plan_trapezoid(10, 100, 400, 0) == [(400, 10)]
+
+
+def test_step_mode(step_gpio):
+    motor = stepper.StepperMotor(
+        "GPIO17", "GPIO27", "GPIO22", None, None, None, use_mock_hw=True
+    )
+    assert stepper.StepMode.EIGTH_STEP.microsteps == 8
+    with pytest.raises(ValueError):
+        motor.sendCommand(10, mode=stepper.StepMode.HALF_STEP)
+
+    cmd = motor.sendCommand(20, max_rate_hz=1000, accel=20000)
+    assert cmd["done"].wait(timeout=5)
+    assert cmd["steps_done"] == 20
+    assert motor.last_result.steps_done == 20
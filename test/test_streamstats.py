@@ -0,0 +1,67 @@
+import math
+
+import numpy as np
+import pytest
+import streamstats
+
+
+def test_welford_matches_numpy():
+    rng = np.random.default_rng(1)
+    values = 7 + 0.1 * rng.standard_normal(1000)
+    w = streamstats.Welford()
+    assert w.variance == 0.0
+    for x in values:
+        w.update(x)
+    assert w.count == 1000
+    assert w.mean == pytest.approx(values.mean())
+    assert w.std == pytest.approx(values.std(ddof=1))
+
+
+def test_ewma_uses_elapsed_time():
+    # One sample every 10s or every 60s, the EWMA after the same time is the same
+    fast = streamstats.Ewma(tau_s=600)
+    slow = streamstats.Ewma(tau_s=600)
+    fast.update(0, 0.0)
+    slow.update(0, 0.0)
+    for t in range(10, 601, 10):
+        fast.update(1000 * t, 1.0)
+    for t in range(60, 601, 60):
+        slow.update(1000 * t, 1.0)
+    assert fast.value == pytest.approx(1 - math.exp(-1))
+    assert slow.value == pytest.approx(fast.value)
+
+
+def test_rolling_extrema_matches_brute_force():
+    rng = np.random.default_rng(2)
+    window_s = 100
+    extrema = streamstats.RollingExtrema(window_s)
+    timestamps_ms = np.cumsum(rng.integers(1000, 20000, 500))
+    values = np.cumsum(rng.standard_normal(500))
+
+    for i, (t, x) in enumerate(zip(timestamps_ms, values)):
+        extrema.update(int(t), float(x))
+        in_window = values[: i + 1][timestamps_ms[: i + 1] >= t - 1000 * window_s]
+        assert extrema.min[1] == in_window.min()
+        assert extrema.max[1] == in_window.max()
+    # Only samples that could still be the min/max are kept
+    assert len(extrema.mins) + len(extrema.maxs) < 50
+
+
+def test_sensor_stats_snapshot():
+    stats = streamstats.SensorStats(windows_s=(60, 3600))
+    assert stats.snapshot().count == 0
+
+    # Rising 1 unit per minute, sampled every 10s for an hour
+    for t in range(0, 3600, 10):
+        stats.update(1000 * t, t / 60)
+    snap = stats.snapshot()
+    assert snap.count == 360
+    assert snap.last == (3590 * 1000, pytest.approx(3590 / 60))
+    assert snap.rate_per_s == pytest.approx(1 / 60)
+    assert snap.mean == pytest.approx(3590 / 120)
+
+    last_minute, last_hour = snap.windows
+    assert last_minute.window_s == 60
+    assert last_minute.min == (3530 * 1000, pytest.approx(3530 / 60))
+    assert last_hour.min == (0, 0.0)
+    assert last_hour.max == snap.last
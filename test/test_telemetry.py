@@ -0,0 +1,32 @@
+import datetime
+
+import numpy as np
+import telemetry
+from sensorpollers import DatumPublisher
+from tsstore import TimeSeriesStore
+
+
+def test_skips_readings_that_are_not_live(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry.TelemetryRecorder, "_run", lambda self: None)
+    thermometer = DatumPublisher(name="temperature")
+    ph = DatumPublisher(name="ph")
+    thermometer.deque.append(
+        (datetime.datetime.now(), -273)
+    )  # Missing sensor placeholder
+    ph.publish((datetime.datetime.now(), 8.1))
+    live = {ph}
+
+    path = str(tmp_path / "t.tss")
+    recorder = telemetry.TelemetryRecorder(
+        path, thermometer, ph, is_live=lambda poller: poller in live
+    )
+    recorder.record()
+    live.clear()  # Both stale: no row at all
+    recorder.record()
+    live.update((thermometer, ph))
+    thermometer.publish((datetime.datetime.now(), 25.0))
+    recorder.record()
+    recorder.flush()
+
+    _, values = TimeSeriesStore(path).query(0, 2**62)
+    np.testing.assert_allclose(values, [[np.nan, 8.1], [77.0, 8.1]], rtol=1e-6)
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import rollups
+import telemetry_cache
+from tsstore import TimeSeriesStore
+
+
+def test_shared_and_refreshed(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry_cache, "_cache", {})
+    monkeypatch.setattr(telemetry_cache, "REFRESH_INTERVAL_S", 0)
+    path = str(tmp_path / "t.tss")
+    with pytest.raises(FileNotFoundError):
+        telemetry_cache.get_telemetry(path)
+
+    writer = TimeSeriesStore(path, channels=["Temperature (F)", "pH"])
+    writer.append([0, 1000], [[77, 8], [78, 8.1]])
+    first = telemetry_cache.get_telemetry(path)
+    assert len(first.store) == 2
+    assert first.rollups["hour"].store is None
+
+    writer.append([rollups.HOUR_MS + 1], [[79, 8.2]])
+    rollups.update_rollups(writer)
+    second = telemetry_cache.get_telemetry(path)
+    assert second is first
+    assert len(second.store) == 3
+
+    # Rollup files that appear after the store was opened get picked up
+    buckets = second.rollups["hour"].query(0, 2 * rollups.HOUR_MS)
+    assert second.rollups["hour"].store is not None
+    assert list(buckets.count) == [2, 1]
+    np.testing.assert_allclose(buckets.max[0], [78, 8.1], rtol=1e-6)
@@ -0,0 +1,122 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+import tsstore
+from tsstore import TimeSeriesStore
+
+CHANNELS = ["Temperature (F)", "pH"]
+
+
+def make_store(tmp_path, n, step_ms=1000):
+    store = TimeSeriesStore(str(tmp_path / "t.tss"), channels=CHANNELS)
+    t = np.arange(n, dtype=np.int64) * step_ms
+    store.append(t, np.column_stack((t / 1000.0, -t / 1000.0)))
+    return store
+
+
+def test_append_and_query(tmp_path):
+    n = 5 * tsstore.INDEX_STRIDE + 17
+    store = make_store(tmp_path, n)
+    assert len(store) == n
+    assert (store.first_timestamp_ms, store.last_timestamp_ms) == (0, (n - 1) * 1000)
+
+    # Bounds are inclusive, and needn't fall on a record
+    t, v = store.query(1500 * 1000, 3000 * 1000)
+    assert t[0] == 1500 * 1000 and t[-1] == 3000 * 1000
+    assert len(t) == 1501
+    np.testing.assert_allclose(v[:, 0], t / 1000)
+    np.testing.assert_allclose(v[:, 1], -t / 1000)
+    t, _ = store.query(1499500, 1500500)
+    assert list(t) == [1500 * 1000]
+
+    # Ranges off either end
+    assert len(store.query(-5000, -1)[0]) == 0
+    assert len(store.query(n * 1000, (n + 10) * 1000)[0]) == 0
+    assert len(store.query(-5000, 10**12)[0]) == n
+
+
+def test_out_of_order_append(tmp_path):
+    store = make_store(tmp_path, 10)
+    with pytest.raises(ValueError):
+        store.append([5000], [[1.0, 2.0]])
+    with pytest.raises(ValueError):
+        store.append([20000, 19000], [[1.0, 2.0], [3.0, 4.0]])
+    assert len(store) == 10
+
+    # Equal timestamps are fine
+    store.append([9000], [[1.0, 2.0]])
+    assert len(store) == 11
+
+
+def test_reader_sees_appends(tmp_path):
+    writer = make_store(tmp_path, 100)
+    reader = TimeSeriesStore(writer.path)
+    assert reader.channels == CHANNELS
+    assert len(reader) == 100
+
+    writer.append(np.arange(100, 3000) * 1000, np.ones((2900, 2)))
+    assert len(reader) == 100
+    reader.refresh()
+    assert len(reader) == 3000
+    assert len(reader.index) == len(writer.index) == 3
+    t, v = reader.query(2500 * 1000, 2600 * 1000)
+    assert len(t) == 101 and np.all(v == 1.0)
+
+
+def test_partial_record(tmp_path):
+    store = make_store(tmp_path, 10)
+    store.close()
+    with open(store.path, "ab") as f:
+        f.write(b"\x01\x02\x03")  # Write cut short
+
+    store = TimeSeriesStore(store.path)
+    assert len(store) == 10
+    store.append([10000], [[10.0, -10.0]])
+    assert len(store) == 11
+    assert (
+        os.path.getsize(store.path) == tsstore.HEADER_SIZE + 11 * store.dtype.itemsize
+    )
+    t, v = store.query(10000, 10000)
+    assert list(t) == [10000] and list(v[0]) == [10.0, -10.0]
+
+
+def test_bad_files(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        TimeSeriesStore(str(tmp_path / "missing.tss"))
+    path = tmp_path / "telemetry.csv"
+    path.write_text("Timestamp,Temperature (F),pH\n" * 200)
+    with pytest.raises(ValueError):
+        TimeSeriesStore(str(path))
+    make_store(tmp_path, 1)
+    with pytest.raises(ValueError):
+        TimeSeriesStore(str(tmp_path / "t.tss"), channels=["pH"])
+
+
+def test_migrate_csv(tmp_path):
+    start = datetime.datetime(2023, 1, 1)
+    rows = [
+        (start + datetime.timedelta(hours=i), 77 + i / 100, 8 - i / 100)
+        for i in range(50)
+    ]
+    order = list(range(50))
+    order[10], order[12] = order[12], order[10]  # Slightly out of order: gets sorted
+    order.append(3)  # Far out of order: dropped
+
+    csv_path = tmp_path / "telemetry.csv"
+    with open(csv_path, "w") as f:
+        f.write("Timestamp,Temperature (F),pH\n")
+        for i in order:
+            ts, temp, ph = rows[i]
+            f.write(f"{ts:%Y-%m-%d %H:%M:%S},{temp},{ph}\n")
+        f.write("not a timestamp,1,2\n")
+
+    store_path = str(tmp_path / "telemetry.tss")
+    assert tsstore.migrate_csv(str(csv_path), store_path, reorder_rows=5) == (50, 2)
+
+    store = TimeSeriesStore(store_path)
+    assert store.channels == CHANNELS
+    t, v = store.query(0, 2**62)
+    assert list(t) == [int(r[0].timestamp() * 1000) for r in rows]
+    np.testing.assert_allclose(v, [r[1:] for r in rows], rtol=1e-6)
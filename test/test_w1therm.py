@@ -0,0 +1,70 @@
+import os
+
+import pytest
+import w1therm
+
+GOOD = "72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t=23125\n"
+BAD_CRC = "72 01 4b 46 7f ff 0e 10 57 : crc=00 NO\n72 01 4b 46 7f ff 0e 10 57 t=23125\n"
+
+
+def make_probe(devices_dir, probe_id, contents, resolution=None):
+    probe_dir = devices_dir / probe_id
+    probe_dir.mkdir()
+    (probe_dir / "w1_slave").write_text(contents)
+    if resolution is not None:
+        (probe_dir / "resolution").write_text(f"{resolution}\n")
+    return probe_dir
+
+
+def test_parse_w1_slave():
+    assert w1therm.parse_w1_slave(GOOD) == pytest.approx(23.125)
+    assert w1therm.parse_w1_slave(BAD_CRC) is None
+    assert w1therm.parse_w1_slave("") is None
+
+
+def test_probe_reads_reuse_fd(tmp_path):
+    probe_dir = make_probe(tmp_path, "28-000000000001", GOOD)
+    probe = w1therm.W1Probe(str(probe_dir))
+    assert probe.id == "28-000000000001"
+    assert probe.read() == pytest.approx(23.125)
+
+    (probe_dir / "w1_slave").write_text(GOOD.replace("t=23125", "t=-1500"))
+    assert probe.read() == pytest.approx(-1.5)
+    probe.close()
+
+
+def test_probe_crc_retries_bounded(tmp_path):
+    probe_dir = make_probe(tmp_path, "28-000000000001", BAD_CRC)
+    probe = w1therm.W1Probe(str(probe_dir))
+    assert probe.read() is None
+    assert probe.crc_errors == 1 + w1therm.W1Probe.MAX_CRC_RETRIES
+
+
+def test_bank_reads_every_probe(tmp_path):
+    make_probe(tmp_path, "28-000000000002", GOOD.replace("t=23125", "t=24000"))
+    make_probe(tmp_path, "28-000000000001", GOOD)
+    make_probe(tmp_path, "28-000000000003", BAD_CRC)
+    (tmp_path / "10-000000000009").mkdir()  # Not a DS18B20
+
+    bank = w1therm.W1ThermometerBank(devices_dir=str(tmp_path))
+    assert bank.ids() == ["28-000000000001", "28-000000000002", "28-000000000003"]
+    assert bank.bulk_read_path is None
+    assert bank.read_all() == {
+        "28-000000000001": pytest.approx(23.125),
+        "28-000000000002": pytest.approx(24.0),
+        "28-000000000003": None,
+    }
+
+
+def test_bank_bulk_read(tmp_path):
+    make_probe(tmp_path, "28-000000000001", GOOD, resolution=9)
+    make_probe(tmp_path, "28-000000000002", GOOD, resolution=10)
+    master = tmp_path / "w1_bus_master1"
+    master.mkdir()
+    (master / "therm_bulk_read").write_text("0\n")
+
+    bank = w1therm.W1ThermometerBank(devices_dir=str(tmp_path))
+    assert bank.bulk_read_path == os.path.join(str(master), "therm_bulk_read")
+    assert bank.conversion_time_s == w1therm.CONVERSION_TIME_S[10]
+    assert len(bank.read_all()) == 2
+    assert (master / "therm_bulk_read").read_text() == "trigger"
@@ -1,20 +1,18 @@
 import tkinter as tk
 
+from fakegpio import STATE_FILE, read_states
+
 
 def read_gpios():
     try:
-        with open("gpiostate.txt", "r") as file:
-            lines = file.readlines()
-            if lines:
-                bits = lines[-1].strip().split()
-                the_list = list(map(int, bits))
-                if len(the_list) != 11:
-                    return None
-                return the_list
+        the_list = [state for _, state in read_states()]
+        if len(the_list) < 11:
+            return None
+        return the_list[:11]
     except FileNotFoundError:
-        print("File 'gpios.txt' not found.")
+        print(f"File '{STATE_FILE}' not found.")
     except Exception as e:
-        print(f"Error reading 'gpios.txt': {e}")
+        print(f"Error reading '{STATE_FILE}': {e}")
     return None
 
 
@@ -72,7 +70,7 @@ for i, elm in enumerate(gpio_indicator + aqlights + outlets):
 # Update circle colors initially
 update_circle_colors()
 
-# Start monitoring gpios.txt
+# Start monitoring the GPIO state file
 update_gpios()
 
 # Run the Tkinter event loop